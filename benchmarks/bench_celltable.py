@@ -0,0 +1,46 @@
+""" Docstring for CCHQC.v1.qcapi.benchmarks.bench_celltable
+  memory of one dict per cell vs CellTable on a large slide
+"""
+import os
+import sys
+import tempfile
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.synthaix import write_synthetic_aix
+from cchqc.qcxfuncs import get_metadata_from_aix, iter_cell_nodes
+from cchqc.celltable import CellTable
+
+def cells_as_dicts(cellnodes, nulltags):
+    """ former list of dict of collect_target_cells() """
+    allcells = []
+    for cellname, segments, cdata in cellnodes:
+        if not cdata:
+            continue
+        allcells.append({'cellname': cellname, 'category': cdata.get('category', -1), 'segments': segments,
+                         'ncratio': cdata.get('ncRatio', 0.0), 'probability': cdata.get('prob', 0.0),
+                         'score': cdata.get('score', 0.0), 'traits': cdata.get('tags', nulltags)})
+    return sorted(allcells, key=lambda x: (-x['category'], x['score']), reverse=True)
+
+def retained_bytes(build, aixfile):
+    """ bytes still allocated by the result of build() after the parsed JSON is released """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    _, aixcell = get_metadata_from_aix(aixfile)
+    result = build(iter_cell_nodes(aixcell))
+    del aixcell
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return retained, len(result)
+
+def main(ncells=100000):
+    """ run benchmark for AIxURO """
+    nulltags = [0.0 for _ in range(14)]
+    with tempfile.TemporaryDirectory() as workdir:
+        aixfile = write_synthetic_aix(os.path.join(workdir, 'AIxURO.aix'), 'AIxURO', '2024.1.0', ncells)
+        dicts, ndicts = retained_bytes(lambda x: cells_as_dicts(x, nulltags), aixfile)
+        table, ntable = retained_bytes(lambda x: CellTable.from_cell_nodes(x, nulltags, True), aixfile)
+        print(f'AIxURO {ndicts} cells: dicts {dicts/ndicts:.0f} B/cell, CellTable {table/ntable:.0f} B/cell, '
+              f'{dicts/table:.2f}x smaller')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,79 @@
+""" Docstring for CCHQC.v1.qcapi.benchmarks.bench_decompress
+  gzip.GzipFile vs AixReader on 10-500 MB decompressed .aix payloads
+"""
+import gzip
+import os
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.synthaix import write_synthetic_aix
+from cchqc.aixio import AixReader, read_aix_bytes
+
+def write_payload(aixfile, basefile, mbytes):
+    """ gzip .aix of about mbytes MB decompressed, content of basefile repeated """
+    with gzip.open(basefile, 'rb') as fbase:
+        block = fbase.read()
+    written = 0
+    with gzip.open(aixfile, 'wb') as faix:
+        while written < mbytes*1024*1024:
+            faix.write(block)
+            written += len(block)
+    return written
+
+def gzipfile_read_all(aixfile):
+    """ former get_metadata_from_aix() """
+    with open(aixfile, 'rb') as raw, gzip.GzipFile(mode='rb', fileobj=raw) as gaix:
+        return len(gaix.read())
+
+def gzipfile_stream(aixfile):
+    """ former streaming parser input, 1 MB reads """
+    nbytes = 0
+    with open(aixfile, 'rb') as raw, gzip.GzipFile(mode='rb', fileobj=raw) as gaix:
+        while chunk := gaix.read(1 << 20):
+            nbytes += len(chunk)
+    return nbytes
+
+def aixreader_stream(aixfile, use_mmap=None):
+    """ streaming parser input with chunked AixReader, 1 MB reads """
+    nbytes = 0
+    with AixReader(aixfile, use_mmap, chunked=True) as gaix:
+        while chunk := gaix.read(1 << 20):
+            nbytes += len(chunk)
+    return nbytes
+
+def best_of(func, aixfile, repeat):
+    """ best elapsed seconds of repeat runs and decompressed bytes """
+    elapsed = []
+    for _ in range(repeat):
+        tstart = time.perf_counter()
+        nbytes = func(aixfile)
+        elapsed.append(time.perf_counter()-tstart)
+    return min(elapsed), nbytes
+
+def main(sizes=(10, 100, 500), repeat=3):
+    """ run benchmark for each payload size in MB """
+    methods = [
+        ('GzipFile.read()', gzipfile_read_all),
+        ('read_aix_bytes(mmap)', lambda x: len(read_aix_bytes(x, True))),
+        ('read_aix_bytes(read)', lambda x: len(read_aix_bytes(x, False))),
+        ('GzipFile.read(1MB)', gzipfile_stream),
+        ('AixReader.read(1MB)', aixreader_stream),
+        ('AixReader(chunked)', lambda x: aixreader_stream(x, False))
+    ]
+    with tempfile.TemporaryDirectory() as workdir:
+        basefile = write_synthetic_aix(os.path.join(workdir, 'base.aix'), 'AIxTHY', '2025.2.0', 20000)
+        for mbytes in sizes:
+            aixfile = os.path.join(workdir, f'payload_{mbytes}.aix')
+            written = write_payload(aixfile, basefile, mbytes)
+            print(f'{written/1024/1024:.0f} MB decompressed, {os.path.getsize(aixfile)/1024/1024:.0f} MB compressed')
+            baseline = None
+            for name, func in methods:
+                elapsed, nbytes = best_of(func, aixfile, repeat)
+                assert nbytes == written, name
+                baseline = baseline if baseline else elapsed
+                print(f'  {name:<22}{elapsed:8.3f}s {nbytes/elapsed/1024/1024:8.1f} MB/s {baseline/elapsed:6.2f}x')
+            os.remove(aixfile)
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] if len(sys.argv) > 1 else (10, 100, 500))
@@ -0,0 +1,45 @@
+""" Docstring for CCHQC.v1.qcapi.benchmarks.bench_resolve
+  linear `slide_id in slidename` scan vs SlideNameResolver on many slide names
+"""
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cchqc.slideindex import SlideEntry, SlideNameResolver
+
+def make_entries(nslides, seed=0):
+    """ slide names like S2024-012345_a, re-scans share the pathology id """
+    rng = random.Random(seed)
+    entries = []
+    for i in range(nslides):
+        pathid = f'S{2020+i%6}-{rng.randrange(1000000):06d}'
+        for rescan in 'ab'[:rng.randint(1, 2)]:
+            entries.append(SlideEntry(f'{pathid}_{rescan}', True, True, 0, rng.uniform(0, 1e6), 0, 0.0))
+    return entries
+
+def linear_latest(entries, slide_id):
+    """ what the slide handlers did before: scan all names, keep max mtime """
+    matched = [x for x in entries if slide_id in x.slideid]
+    return max(matched, key=lambda x: x.med_mtime).slideid if matched else None
+
+def main(nslides=100000, nqueries=2000):
+    """ compare results and per-query time """
+    entries = make_entries(nslides)
+    tstart = time.perf_counter()
+    resolver = SlideNameResolver(entries)
+    build = time.perf_counter()-tstart
+    rng = random.Random(1)
+    queries = [rng.choice(entries).slideid.split('_')[0] for _ in range(nqueries)]
+    queries += ['S2021', 'nothing', '12', '']
+    tstart = time.perf_counter()
+    expected = [linear_latest(entries, x) for x in queries]
+    linear = (time.perf_counter()-tstart)/len(queries)
+    tstart = time.perf_counter()
+    found = [resolver.find_latest(x) for x in queries]
+    indexed = (time.perf_counter()-tstart)/len(queries)
+    assert found == expected, 'resolver does not match substring semantics'
+    print(f'{len(entries)} slides: build {build:.3f}s, linear {linear*1000:.3f}ms/query, indexed {indexed*1000:.4f}ms/query')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,188 @@
+""" Docstring for CCHQC.v1.qcapi.benchmarks.bench_suite
+  parse/QC hot paths and FastAPI endpoints over a synthetic DRIVEY_HOME, results to JSON
+  usage: python benchmarks/bench_suite.py [--slides 2] [--cells 20000] [--repeat 3] [--output bench_results.json]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.synthaix import make_drivey_home
+
+def percentile(values, pct):
+    """ nearest-rank percentile of sorted values """
+    if not values:
+        return 0.0
+    rank = max(1, min(len(values), round(pct/100*len(values) + 0.5)))
+    return values[rank-1]
+
+def run_case(name, func, calls, repeat=1, nbytes=0, before=None):
+    """
+    time func over calls, then trace peak memory of the first call
+      :param name: case name in results
+      :param func: function to be measured
+      :param calls: list of argument tuples, one call each
+      :param repeat: rounds over calls
+      :param nbytes: input bytes of one round, for MB/s
+      :param before: called before every call and not timed, e.g. to drop caches
+    peak memory is of this process only, not of worker processes
+    """
+    latencies = []
+    tstart = time.perf_counter()
+    for _ in range(repeat):
+        for args in calls:
+            if before:
+                before()
+            procts = time.perf_counter()
+            func(*args)
+            latencies.append(time.perf_counter()-procts)
+    elapsed = time.perf_counter()-tstart
+    if before:
+        before()
+    tracemalloc.start()
+    func(*calls[0])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    latencies.sort()
+    busy = sum(latencies)
+    result = {
+        'name': name,
+        'calls': len(latencies),
+        'seconds': round(elapsed, 4),
+        'ops_per_second': round(len(latencies)/busy, 2) if busy else None,
+        'latency_ms': {k: round(percentile(latencies, p)*1000, 3) for k, p in (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100))},
+        'peak_memory_mb': round(peak/1024/1024, 2)
+    }
+    if nbytes:
+        result['mb_per_second'] = round(nbytes*repeat/busy/1024/1024, 2)
+    print(f"{name:<48}{result['ops_per_second']:>10} ops/s  p50 {result['latency_ms']['p50']:>9} ms  "
+          f"p99 {result['latency_ms']['p99']:>9} ms  peak {result['peak_memory_mb']:>8} MB")
+    return result
+
+def main(argv=None):
+    """ build synthetic DRIVEY_HOME, run all cases, write results """
+    parser = argparse.ArgumentParser(description='qcapi benchmark suite')
+    parser.add_argument('--slides', type=int, default=2, help='slides per .aix profile')
+    parser.add_argument('--cells', type=int, default=20000, help='cells per slide')
+    parser.add_argument('--repeat', type=int, default=3, help='rounds over all slides')
+    parser.add_argument('--output', default='bench_results.json', help='JSON results file')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='qcapi_bench_')
+    drivehome = os.path.join(workdir, 'medaix')
+    ## settings are read when cchqc is imported, point them at the synthetic folders first
+    os.environ['DRIVEY_HOME'] = drivehome
+    os.environ['DRIVEY_URL'] = 'synthetic'    # not a UNC path, slides are read from DRIVEY_HOME
+    os.environ['AMAQC_HOME'] = os.path.join(workdir, 'amaqc')
+    os.environ['WATCHER_ENABLED'] = 'false'
+    os.environ['WATCHWSI_ENABLED'] = 'false'
+    os.environ.setdefault('LOCALAPPDATA', workdir)
+    try:
+        print(f'writing {args.slides} slides x {args.cells} cells of each profile to {drivehome}')
+        slides = make_drivey_home(drivehome, args.slides, args.cells)
+        results = run_all(slides, args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'params': {'slides': args.slides, 'cells': args.cells, 'repeat': args.repeat},
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as fout:
+        json.dump(report, fout, indent=2)
+    print(f'results are written to {args.output}')
+
+def run_all(slides, args):
+    """ run all cases over slides of make_drivey_home() """
+    from fastapi.testclient import TestClient
+    from cchqc.config import MYENV
+    from cchqc.qccache import qcResultCache
+    from cchqc.summarystore import summaryStores
+    from cchqc.slideindex import slideIndex
+    from cchqc.qcxfuncs import get_target_cells_from_aix, count_number_of_thyroid_traits
+    from cchqc.qcxfuncs import query_qcresult_for_slide, summarize_cell_counts_to_csv, qcMAGIC
+    from cchqc.api_main import app
+
+    results = []
+    allslides = [x for profile in slides.values() for x in profile]
+    slideIndex.rescan()
+    for profile, profileslides in slides.items():
+        calls = [(x[2],) for x in profileslides]
+        nbytes = sum(os.path.getsize(x[2]) for x in profileslides)
+        results.append(run_case(f'get_target_cells_from_aix[{profile}]', get_target_cells_from_aix, calls, args.repeat, nbytes))
+
+    for profile, max_traits in (('thy-2024.2', 8), ('thy-2025.2', 20)):
+        tables = [(get_target_cells_from_aix(x[2])[1], max_traits, 0.4) for x in slides[profile]]
+        results.append(run_case(f'count_number_of_thyroid_traits[{profile}]', count_number_of_thyroid_traits, tables, args.repeat*10))
+
+    calls = [(x[0], x[1], 1) for x in allslides]
+    nbytes = sum(os.path.getsize(x[2]) for x in allslides)
+    sidecar_enabled, MYENV.SIDECAR_ENABLED = MYENV.SIDECAR_ENABLED, False
+    results.append(run_case('query_qcresult_for_slide[parse]', query_qcresult_for_slide, calls, args.repeat, nbytes, qcResultCache.clear))
+    MYENV.SIDECAR_ENABLED = sidecar_enabled
+    if sidecar_enabled:
+        for x in calls:
+            ## first parse writes the sidecar
+            qcResultCache.clear()
+            query_qcresult_for_slide(*x)
+        results.append(run_case('query_qcresult_for_slide[sidecar]', query_qcresult_for_slide, calls, args.repeat, 0, qcResultCache.clear))
+    results.append(run_case('query_qcresult_for_slide[cached]', query_qcresult_for_slide, calls, args.repeat*10))
+
+    ## parsed summaries count traits at any threshold, sidecar ones only on the 0.01 grid
+    MYENV.SIDECAR_ENABLED = False
+    qcResultCache.clear()
+    for x in calls:
+        query_qcresult_for_slide(*x)
+    MYENV.SIDECAR_ENABLED = sidecar_enabled
+    threshold = qcMAGIC.get_score_threshold()
+    def next_criteria():
+        """ off-grid score threshold changed before every call """
+        qcMAGIC.set_score_threshold(round(0.3 + (qcMAGIC.get_score_threshold()+0.0013) % 0.4, 4))
+    results.append(run_case('query_qcresult_for_slide[new criteria]', query_qcresult_for_slide, calls, args.repeat*10, 0, next_criteria))
+    qcMAGIC.set_score_threshold(threshold)
+
+    def drop_summaries():
+        """ summarize from scratch: no summary store, no sidecar, no cached result """
+        summaryStores.clear()
+        shutil.rmtree(os.path.join(MYENV.AMAQC_HOME, 'metadata'), ignore_errors=True)
+        shutil.rmtree(os.path.join(MYENV.AMAQC_HOME, 'sidecar'), ignore_errors=True)
+        qcResultCache.clear()
+    for slide_type in ('urine', 'thyroid'):
+        folder = os.path.join(MYENV.DRIVEY_HOME, slide_type)
+        nbytes = sum(os.path.getsize(x[2]) for x in allslides if x[0] == slide_type)
+        results.append(run_case(f'summarize_cell_counts_to_csv[{slide_type},cold]', summarize_cell_counts_to_csv,
+                                [(slide_type, folder)], args.repeat, nbytes, drop_summaries))
+        results.append(run_case(f'summarize_cell_counts_to_csv[{slide_type},store]', summarize_cell_counts_to_csv,
+                                [(slide_type, folder)], args.repeat))
+
+    with TestClient(app) as client:
+        def get(url, params=None):
+            response = client.get(url, params=params)
+            assert response.status_code == 200, (url, params, response.status_code)
+        def post(url, body):
+            response = client.post(url, json=body)
+            assert response.status_code == 200, (url, response.status_code)
+        qcResultCache.clear()
+        queries = [('/qc/v1/slide', {'slide_type': x[0], 'slide_id': x[1]}) for x in allslides]
+        MYENV.SIDECAR_ENABLED = False
+        results.append(run_case('GET /qc/v1/slide[parse]', get, queries, 1, 0, qcResultCache.clear))
+        MYENV.SIDECAR_ENABLED = sidecar_enabled
+        results.append(run_case('GET /qc/v1/slide', get, queries, args.repeat*10))
+        results.append(run_case('GET /qc/v0/slide', get, [('/qc/v0/slide', x[1]) for x in queries], args.repeat*10))
+        batch = {'slides': [{'slide_type': x[0], 'slide_id': x[1]} for x in allslides]}
+        results.append(run_case('POST /qc/v1/slides', post, [('/qc/v1/slides', batch)], args.repeat*10))
+        results.append(run_case('GET /qc/allslides', get, [('/qc/allslides', {'slide_type': x}) for x in ('urine', 'thyroid')], args.repeat*10))
+        results.append(run_case('GET /health', get, [('/health',)], args.repeat*30))
+        results.append(run_case('GET /metrics', get, [('/metrics',)], args.repeat*30))
+    return results
+
+if __name__ == '__main__':
+    main()
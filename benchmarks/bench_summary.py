@@ -0,0 +1,31 @@
+""" Docstring for CCHQC.v1.qcapi.benchmarks.bench_summary
+  get_target_cells_from_aix() vs summarize_target_cells_from_aix() on a large slide
+"""
+import os
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.synthaix import write_synthetic_aix
+from cchqc.qcxfuncs import get_target_cells_from_aix, summarize_target_cells_from_aix
+
+def best_of(func, aixfile, repeat):
+    """ best elapsed seconds of repeat runs """
+    elapsed = []
+    for _ in range(repeat):
+        tstart = time.perf_counter()
+        func(aixfile)
+        elapsed.append(time.perf_counter()-tstart)
+    return min(elapsed)
+
+def main(ncells=100000, repeat=3):
+    """ run benchmark for AIxURO and AIxTHY """
+    with tempfile.TemporaryDirectory() as workdir:
+        for model, version in [('AIxURO', '2024.1.0'), ('AIxTHY', '2025.2.0')]:
+            aixfile = write_synthetic_aix(os.path.join(workdir, f'{model}.aix'), model, version, ncells)
+            full = best_of(get_target_cells_from_aix, aixfile, repeat)
+            summary = best_of(summarize_target_cells_from_aix, aixfile, repeat)
+            print(f'{model} {ncells} cells: full {full:.3f}s, summary {summary:.3f}s, speedup {full/summary:.2f}x')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
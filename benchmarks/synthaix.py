@@ -0,0 +1,98 @@
+""" Docstring for CCHQC.v1.qcapi.benchmarks.synthaix
+  synthetic .aix generator for benchmarks
+"""
+import gzip
+import json
+import os
+import random
+
+## name: (model info, number of traits, share of each category ID)
+PROFILES = {
+    'uro': ({'Model': 'AIxURO', 'ModelVersion': '2024.1.0'}, 14,
+            [0.0, 0.55, 0.01, 0.03, 0.25, 0.08, 0.05, 0.03]),
+    ## decart 2.0.x and 2.1.x: benign, atypical and nuclei are IDs 0, 1 and 3
+    'uro-legacy': ({'Model': 'AIxURO', 'ModelVersion': '2.1.3', 'ModelArchitect': 'decart'}, 14,
+                   [0.25, 0.03, 0.01, 0.55, 0.0, 0.08, 0.05, 0.03]),
+    'thy-2024.2': ({'Model': 'AIxTHY', 'ModelVersion': '2024.2.1'}, 8,
+                   [0.0, 0.50, 0.10, 0.10, 0.15, 0.13, 0.01, 0.01]),
+    'thy-2025.2': ({'Model': 'AIxTHY', 'ModelVersion': '2025.2.0'}, 20,
+                   [0.0, 0.45, 0.08, 0.04, 0.15, 0.10, 0.15, 0.03])
+}
+
+def make_cell(rng, model, ncategories, ntags, npoints, weights=None):
+    """ one graph[*][1].children[*][1] node, categories are uniform unless weights are given """
+    cx, cy = rng.uniform(0, 100000), rng.uniform(0, 100000)
+    category = rng.choices(range(len(weights)), weights)[0] if weights else rng.randrange(ncategories)
+    cdata = {
+        'category': category,
+        'score': round(rng.random(), 6),
+        'prob': round(rng.random(), 6),
+        'tags': [round(rng.random(), 6) if rng.random() < 0.3 else 0.0 for _ in range(ntags)]
+    }
+    if model == 'AIxURO':
+        cdata['ncRatio'] = round(rng.random(), 6)
+    segments = [[round(cx+rng.uniform(-20, 20), 2), round(cy+rng.uniform(-20, 20), 2)] for _ in range(npoints)]
+    return {'name': '', 'segments': segments, 'data': cdata}
+
+def write_synthetic_aix(aixfile, model='AIxURO', version='2024.1.0', ncells=1000, npoints=16, seed=0,
+                        modelinfo=None, ntags=None, weights=None):
+    """
+    write gzipped .aix with ncells cells
+      :param aixfile: output .aix filename
+      :param model: AIxURO or AIxTHY
+      :param version: ModelVersion of model
+      :param ncells: number of cells
+      :param npoints: number of polygon points per cell
+      :param seed: random seed
+      :param modelinfo: 'model' of .aix, replaces model and version
+      :param ntags: number of trait scores per cell, 14 for AIxURO and 20 for AIxTHY if None
+      :param weights: share of each category ID, uniform if None
+    """
+    rng = random.Random(seed)
+    modelinfo = modelinfo if modelinfo else {'Model': model, 'ModelVersion': version}
+    if ntags is None:
+        ntags = 14 if modelinfo['Model'] == 'AIxURO' else 20
+    graph = []
+    for i in range(ncells):
+        cell = make_cell(rng, modelinfo['Model'], 8, ntags, npoints, weights)
+        cell['name'] = f'cell_{i}'
+        graph.append([f'node_{i}', {'name': f'node_{i}', 'children': [[f'cell_{i}', cell]]}])
+    aixjson = {'model': modelinfo, 'graph': graph}
+    with gzip.open(aixfile, 'wt', encoding='utf-8') as gaix:
+        json.dump(aixjson, gaix)
+    return aixfile
+
+def write_profile_aix(aixfile, profile, ncells=1000, seed=0):
+    """
+    write .aix of one of PROFILES
+      :param aixfile: output .aix filename
+      :param profile: uro, uro-legacy, thy-2024.2 or thy-2025.2
+      :param ncells: number of cells
+      :param seed: random seed
+    """
+    modelinfo, ntags, weights = PROFILES[profile]
+    return write_synthetic_aix(aixfile, ncells=ncells, seed=seed, modelinfo=dict(modelinfo), ntags=ntags, weights=weights)
+
+def make_drivey_home(drivehome, nslides=2, ncells=20000, seed=0):
+    """
+    write urine/ and thyroid/ slide folders, nslides .med/.aix pairs of each profile
+      :param drivehome: root folder like DRIVEY_HOME
+      :param nslides: slides per profile
+      :param ncells: cells per slide
+      :param seed: random seed of the first slide
+    returns {profile: [(slide_type, slide_id, aixfile), ...]}
+    """
+    slides = {}
+    for i, profile in enumerate(PROFILES):
+        slide_type = 'urine' if profile.startswith('uro') else 'thyroid'
+        folder = os.path.join(drivehome, slide_type)
+        os.makedirs(folder, exist_ok=True)
+        slides[profile] = []
+        for j in range(nslides):
+            slide_id = f"{profile.upper().replace('.', '')}-{j:04d}"
+            aixfile = write_profile_aix(os.path.join(folder, f'{slide_id}.aix'), profile, ncells, seed+i*nslides+j)
+            ## WSI is not read by QC, only its presence and mtime
+            with open(os.path.join(folder, f'{slide_id}.med'), 'wb') as fmed:
+                fmed.write(b'\0'*1024)
+            slides[profile].append((slide_type, slide_id, aixfile))
+    return slides
@@ -0,0 +1,168 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.aixio
+  .aix decompression: one sequential read (memory-map for local files) or large chunks, large zlib buffers
+"""
+import mmap
+import os
+import time
+import zlib
+from loguru import logger
+from cchqc.config import MYENV
+from cchqc.metrics import aixBytesDecompressed, aixDecompressSeconds
+
+GZIP_WBITS = 31             # zlib wbits for gzip header and trailer
+INFLATE_BLOCK = 1 << 20     # compressed bytes inflated at once by read(size)
+READ_BLOCK = 8 << 20        # compressed bytes read at once in chunked mode, few round trips on SMB
+
+def is_local_file(filename):
+    """ True if filename is neither a UNC path nor on the drive of DRIVEY_HOME """
+    fullpath = os.path.abspath(filename)
+    if fullpath.startswith('\\\\') or fullpath.startswith('//'):
+        return False
+    drive = os.path.splitdrive(fullpath)[0].upper()
+    return not drive or drive != os.path.splitdrive(MYENV.DRIVEY_HOME)[0].upper()
+
+class AixReader:
+    """ binary file object of decompressed .aix
+    the compressed file is read at once (memory-mapped if local) and its handle is closed
+    before decompressing; in chunked mode a file which is not memory-mapped is read READ_BLOCK
+    bytes at a time instead, so memory does not grow with its size
+    stats has bytes and seconds of this file after close()
+    """
+    def __init__(self, aixfile, use_mmap=None, chunked=False):
+        """
+          :param aixfile: .aix filename
+          :param use_mmap: memory-map compressed file, None for local files only
+          :param chunked: read compressed file in chunks if it is not memory-mapped, for streaming parsers
+        """
+        self.aixfile = aixfile
+        self.stats = {'compressed': 0, 'decompressed': 0, 'read_seconds': 0.0, 'inflate_seconds': 0.0}
+        self.__mmap = None
+        self.__view = None
+        self.__file = None
+        self.__pos = 0
+        self.__pending = b''
+        self.__offset = 0
+        self.__inflater = zlib.decompressobj(wbits=GZIP_WBITS)
+        self.__closed = False
+        procts = time.perf_counter()
+        use_mmap = is_local_file(aixfile) if use_mmap is None else use_mmap
+        faix = open(aixfile, 'rb')
+        try:
+            size = os.fstat(faix.fileno()).st_size
+            if use_mmap and size > 0:
+                self.__mmap = mmap.mmap(faix.fileno(), 0, access=mmap.ACCESS_READ)
+                self.__view = memoryview(self.__mmap)
+            elif chunked:
+                ## kept open until close(), __view is the current chunk
+                self.__file, faix = faix, None
+                self.__view = memoryview(b'')
+            else:
+                self.__view = memoryview(faix.read())
+        finally:
+            if faix is not None:
+                faix.close()
+        self.stats['compressed'] = size if self.__file else len(self.__view)
+        self.stats['read_seconds'] = time.perf_counter() - procts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __next_chunk(self):
+        """ chunked mode: read next READ_BLOCK compressed bytes into __view once it is used up """
+        if self.__file is None or self.__pos < len(self.__view):
+            return
+        procts = time.perf_counter()
+        self.__view = memoryview(self.__file.read(READ_BLOCK))
+        self.__pos = 0
+        self.stats['read_seconds'] += time.perf_counter() - procts
+
+    def __next_input(self, blocksize):
+        """ next compressed bytes for zlib, empty at end of file """
+        self.__next_chunk()
+        data = self.__view[self.__pos:self.__pos+blocksize] if blocksize else self.__view[self.__pos:]
+        self.__pos += len(data)
+        return data
+
+    def __inflate(self, blocksize):
+        """ decompressed bytes of next blocksize (0 for all) compressed bytes, b'' after the last gzip member """
+        while True:
+            inflater = self.__inflater
+            if inflater.eof:
+                ## unused_data is the tail of the last input, rewind to the next member
+                self.__pos -= len(inflater.unused_data)
+                self.__next_chunk()
+                if self.__pos >= len(self.__view) or self.__view[self.__pos] == 0:
+                    ## end of file or zero padding like gzip.GzipFile
+                    return b''
+                self.__inflater = inflater = zlib.decompressobj(wbits=GZIP_WBITS)
+            data = self.__next_input(blocksize)
+            try:
+                out = inflater.decompress(data)
+                ninput = len(data)
+            finally:
+                ## a slice left in a traceback would keep the memory map open
+                data.release()
+            if out:
+                return out
+            if not ninput and not inflater.eof:
+                if not self.stats['compressed']:
+                    return b''
+                raise EOFError(f'{os.path.basename(self.aixfile)} ended before the end-of-stream marker was reached')
+
+    def read(self, size=-1):
+        """
+        read decompressed bytes, may return less than size, b'' at end
+          :param size: maximum bytes, all the rest if negative
+        """
+        procts = time.perf_counter()
+        if size is None or size < 0:
+            ## rest of each member in one zlib call
+            chunks = [self.__pending[self.__offset:]] if self.__offset < len(self.__pending) else []
+            self.__pending, self.__offset = b'', 0
+            while True:
+                out = self.__inflate(0)
+                if not out:
+                    break
+                chunks.append(out)
+            out = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+        else:
+            if self.__offset >= len(self.__pending):
+                self.__pending, self.__offset = self.__inflate(INFLATE_BLOCK), 0
+            out = self.__pending[self.__offset:self.__offset+size]
+            self.__offset += len(out)
+        self.stats['inflate_seconds'] += time.perf_counter() - procts
+        self.stats['decompressed'] += len(out)
+        return out
+
+    def tell(self):
+        """ decompressed bytes read so far """
+        return self.stats['decompressed']
+
+    def close(self):
+        """ release memory map, report stats of this file """
+        if self.__closed:
+            return
+        self.__closed = True
+        self.__view.release()
+        if self.__mmap is not None:
+            self.__mmap.close()
+        if self.__file is not None:
+            self.__file.close()
+        self.__view, self.__mmap, self.__file, self.__inflater, self.__pending = None, None, None, None, b''
+        elapsed = self.stats['read_seconds'] + self.stats['inflate_seconds']
+        aixBytesDecompressed.inc(amount=self.stats['decompressed'])
+        aixDecompressSeconds.observe(elapsed)
+        logger.trace(f"{os.path.basename(self.aixfile)}: {self.stats['compressed']} -> {self.stats['decompressed']} bytes, "
+                     f"read {self.stats['read_seconds']:.3f}s, inflate {self.stats['inflate_seconds']:.3f}s")
+
+def read_aix_bytes(aixfile, use_mmap=None):
+    """
+    decompressed content of .aix
+      :param aixfile: .aix filename
+      :param use_mmap: memory-map compressed file, None for local files only
+    """
+    with AixReader(aixfile, use_mmap) as reader:
+        return reader.read()
@@ -0,0 +1,257 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.aixstream
+  streaming .aix parser, walks graph[*][1].children[*][1] without loading the whole JSON
+"""
+import codecs
+import json
+import re
+from cchqc.aixio import AixReader
+
+_WS = re.compile(r'[ \t\r\n]*')
+_WS_COMMA = re.compile(r'[ \t\r\n,]*')
+_KEY = re.compile(r'"([^"\\]*)"[ \t\r\n]*:')
+_STRING_BODY = re.compile(r'(?:[^"\\]|\\.)*', re.S)
+_SCALAR = re.compile(r'[^,\]}\s]+')
+_NESTED = re.compile(r'["\[\]{}]')
+## array of number arrays, e.g. segments [[x, y], [x, y], ...]
+_POINTS = re.compile(r'\[[ \t\r\n]*(?:\[[^\[\]{}"]*\][ \t\r\n,]*)*\]')
+
+class AixStreamError(ValueError):
+    """ malformed or truncated .aix stream """
+
+class AixStream:
+    """ pull parser over a byte stream with bounded buffer """
+    def __init__(self, fileobj, chunksize=1 << 20):
+        self.__src = fileobj
+        self.__chunksize = chunksize
+        self.__decoder = codecs.getincrementaldecoder('utf-8')()
+        self.__scan_once = json.JSONDecoder().scan_once
+        self.__buf = ''
+        self.__pos = 0
+        self.__mark = None
+        self.__eof = False
+
+    def __fill(self):
+        """ read next chunk, drop consumed text unless it is marked """
+        if self.__eof:
+            return False
+        chunk = self.__src.read(self.__chunksize)
+        keep = self.__pos if self.__mark is None else self.__mark
+        self.__buf = self.__buf[keep:] + self.__decoder.decode(chunk, final=not chunk)
+        self.__pos -= keep
+        if self.__mark is not None:
+            self.__mark -= keep
+        if not chunk:
+            self.__eof = True
+            return False
+        return True
+
+    def peek(self):
+        """ next non-whitespace character, None at end of stream """
+        if self.__pos < len(self.__buf):
+            c = self.__buf[self.__pos]
+            if c not in ' \t\r\n':
+                return c
+        while True:
+            self.__pos = _WS.match(self.__buf, self.__pos).end()
+            if self.__pos < len(self.__buf):
+                return self.__buf[self.__pos]
+            if not self.__fill():
+                return None
+
+    def expect(self, token):
+        """ consume one structural character """
+        if self.peek() != token:
+            raise AixStreamError(f'expected {token!r}')
+        self.__pos += 1
+
+    def next_item(self, closing):
+        """ consume ',' between items, return first character of next item, None at closing bracket """
+        buf, pos = self.__buf, self.__pos
+        if pos+2 < len(buf):
+            ## fast path for compact or json.dump() separators
+            c = buf[pos]
+            if c == ',':
+                pos += 1
+                c = buf[pos]
+                if c == ' ':
+                    pos += 1
+                    c = buf[pos]
+            if c not in ' \t\r\n,':
+                if c == closing:
+                    self.__pos = pos+1
+                    return None
+                self.__pos = pos
+                return c
+        while True:
+            self.__pos = _WS_COMMA.match(self.__buf, self.__pos).end()
+            if self.__pos < len(self.__buf):
+                break
+            if not self.__fill():
+                raise AixStreamError('truncated .aix stream')
+        c = self.__buf[self.__pos]
+        if c == closing:
+            self.__pos += 1
+            return None
+        return c
+
+    def read_key(self):
+        """ consume object key and ':' """
+        mm = _KEY.match(self.__buf, self.__pos)
+        if mm:
+            self.__pos = mm.end()
+            return mm.group(1)
+        ## escaped key or key across chunk border
+        key = self.read_value()
+        self.expect(':')
+        return key
+
+    def __skip_string_body(self):
+        """ skip string content after the opening quote """
+        while True:
+            ## a lone trailing backslash stays unconsumed so the escape is not split by the chunk border
+            self.__pos = _STRING_BODY.match(self.__buf, self.__pos).end()
+            if self.__pos < len(self.__buf) and self.__buf[self.__pos] == '"':
+                self.__pos += 1
+                return
+            if not self.__fill():
+                raise AixStreamError('truncated string')
+
+    def skip_value(self):
+        """ consume one JSON value without building python objects """
+        c = self.peek()
+        if c is None:
+            raise AixStreamError('truncated .aix stream')
+        if c == '"':
+            self.__pos += 1
+            self.__skip_string_body()
+            return
+        if c not in '[{':
+            while True:
+                mm = _SCALAR.match(self.__buf, self.__pos)
+                if mm.end() < len(self.__buf) or not self.__fill():
+                    self.__pos = mm.end() if mm.end() < len(self.__buf) else len(self.__buf)
+                    return
+        mm = _POINTS.match(self.__buf, self.__pos)
+        if mm:
+            self.__pos = mm.end()
+            return
+        depth = 0
+        while True:
+            mm = _NESTED.search(self.__buf, self.__pos)
+            if mm is None:
+                self.__pos = len(self.__buf)
+                if not self.__fill():
+                    raise AixStreamError('truncated .aix stream')
+                continue
+            self.__pos = mm.end()
+            c = mm.group()
+            if c == '"':
+                self.__skip_string_body()
+            elif c in '[{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def read_value(self):
+        """ consume one JSON value and return it as python object """
+        self.peek()
+        while True:
+            try:
+                value, end = self.__scan_once(self.__buf, self.__pos)
+            except (StopIteration, ValueError):
+                end = None
+            ## a value ending at the buffer end may continue in the next chunk
+            if end is not None and (end < len(self.__buf) or self.__eof):
+                self.__pos = end
+                return value
+            if not self.__fill():
+                if end is None:
+                    raise AixStreamError('malformed or truncated value')
+
+def iter_aix_events(fileobj, keep_segments=False):
+    """
+    walk decompressed .aix stream
+      :param fileobj: binary file object of decompressed .aix
+      :param keep_segments: decode segments of each cell, skipped if False
+    yields ('model', dict) and ('cell', (name, segments, data)) events,
+    'segments' is None when keep_segments is False
+    """
+    aix = AixStream(fileobj)
+    aix.expect('{')
+    while aix.next_item('}'):
+        key = aix.read_key()
+        if key == 'model':
+            yield 'model', aix.read_value()
+        elif key == 'graph' and aix.peek() == '[':
+            yield from _iter_graph(aix, keep_segments)
+        else:
+            aix.skip_value()
+
+def _iter_pairs(aix):
+    """ [[key, {...}], ...]: yields once per pair with stream positioned at its object """
+    aix.expect('[')
+    c = aix.next_item(']')
+    while c:
+        if c != '[':
+            aix.skip_value()
+        else:
+            aix.expect('[')
+            idx = 0
+            c = aix.next_item(']')
+            while c:
+                if idx == 1 and c == '{':
+                    yield
+                else:
+                    aix.skip_value()
+                idx += 1
+                c = aix.next_item(']')
+        c = aix.next_item(']')
+
+def _iter_graph(aix, keep_segments):
+    """ graph: [[key, {"children": [[key, {...}], ...]}], ...] """
+    for _ in _iter_pairs(aix):
+        aix.expect('{')
+        while aix.next_item('}'):
+            key = aix.read_key()
+            if key != 'children' or aix.peek() != '[':
+                aix.skip_value()
+                continue
+            for _ in _iter_pairs(aix):
+                yield 'cell', _read_cell_body(aix, keep_segments)
+
+def _read_cell_body(aix, keep_segments):
+    """ children[*][1]: keep name/data, skip segments unless requested """
+    name, segments, data = None, None, None
+    aix.expect('{')
+    while aix.next_item('}'):
+        key = aix.read_key()
+        if key == 'data':
+            data = aix.read_value()
+        elif key == 'name':
+            name = aix.read_value()
+        elif key == 'segments' and keep_segments:
+            segments = aix.read_value()
+        else:
+            aix.skip_value()
+    return name, segments, data
+
+def stream_aix_cells(aixfile, keep_segments=False):
+    """
+    read model info and cell nodes of .aix without the whole JSON in memory
+    compressed .aix is memory-mapped if local, else read in READ_BLOCK chunks, so memory grows
+    with the cell nodes kept and not with the file size
+      :param aixfile: .aix filename
+      :param keep_segments: decode segments of each cell
+    returns (aixinfo, [(name, segments, data), ...])
+    """
+    aixinfo = {}
+    cellnodes = []
+    with AixReader(aixfile, chunked=True) as gaix:
+        for event, value in iter_aix_events(gaix, keep_segments):
+            if event == 'cell':
+                cellnodes.append(value)
+            else:
+                aixinfo = value
+    return aixinfo, cellnodes
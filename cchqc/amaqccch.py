@@ -1,12 +1,20 @@
 """ Docstring for CCHQC.v1.qcapi.cchqc.amaqccch
   endpoints for providing analyzed metadata for specified slide
 """
+from typing import Optional
 from loguru import logger
-from fastapi import APIRouter, Request, HTTPException
-from cchqc.config import serviceHistory, TSaction
-from cchqc.qcxfuncs import get_st_mtime
-from cchqc.qcxfuncs import query_all_slide_name, query_qcresult_for_slide
+from fastapi import APIRouter, Request, Response, HTTPException
+from fastapi.responses import StreamingResponse
+from cchqc.config import MYENV, serviceHistory, TSaction
+from cchqc.workers import storagePool
+from cchqc.storagemonitor import storageMonitor, storage_unavailable
+from cchqc.qcxfuncs import query_slide_listing, select_slides, iter_slide_lines
+from cchqc.qcxfuncs import query_qcresult_for_slide, rescan_slide_index
 from cchqc.qcxfuncs import change_qc_score_criteria, change_qc_magic_number, get_current_magic_number
+from cchqc.qcxfuncs import get_qc_cache_stats
+from cchqc.batchqc import SlidesQuery, evaluate_slides, stream_slides_as_ndjson
+from cchqc.slidestore import query_slide_store
+from cchqc.conditional import resolve_slide, listing_validators, validator_headers, is_not_modified, not_modified
 
 qcapicch = APIRouter()
 
@@ -15,10 +23,21 @@ qcapicch = APIRouter()
 # ---------------------------------------------------------
 
 @qcapicch.get('/allslides', summary='query all the analyzed slide image files')
-async def get_all_slides(slide_type: str, request: Request):
+async def get_all_slides(slide_type: str, request: Request, response: Response, prefix: Optional[str] = None,
+                         scanned_from: Optional[str] = None, scanned_to: Optional[str] = None,
+                         order_by: Optional[str] = None, descending: bool = False,
+                         cursor: Optional[str] = None, limit: Optional[int] = None, stream: bool = False):
     """
     query all the analyzed slide image files in image storage
       :param slide_type: urine or thyroid
+      :param prefix: slide name prefix
+      :param scanned_from: .med mtime at or after this ISO date/datetime, e.g. 2025-06-30
+      :param scanned_to: .med mtime before this ISO date/datetime
+      :param order_by: name or scanned
+      :param cursor: next_cursor of the previous page
+      :param limit: slides per page
+      :param stream: NDJSON lines of {slidename, scanned_at} instead of JSON
+    a list of slide names as before unless cursor or limit is given, then {slides, next_cursor}
     """
     procts = TSaction()
     if slide_type.lower() not in ['urine', 'thyroid']:
@@ -26,18 +45,71 @@ async def get_all_slides(slide_type: str, request: Request):
         logger.error(errmsg)
         serviceHistory.append(f"{procts.action_at()},allslides,{request.client.host},failed,{procts.consumed_time()},{errmsg}")
         raise HTTPException(status_code=404, detail=f'there is no slide for {slide_type} slides')
+    if not storageMonitor.is_alive():
+        errmsg = 'lost the connection to image storage'
+        logger.error(errmsg)
+        serviceHistory.append(f"{procts.action_at()},allslides,{request.client.host},failed,{procts.consumed_time()},{errmsg}")
+        raise storage_unavailable(errmsg)
+    variant = f'list|{prefix}|{scanned_from}|{scanned_to}|{order_by}|{descending}|{cursor}|{limit}|{stream}'
+    validators = await storagePool.run(listing_validators, slide_type, variant)
+    if is_not_modified(request, validators):
+        serviceHistory.append(f"{procts.action_at()},allslides,{request.client.host},completed,{procts.consumed_time()},not modified")
+        return not_modified(validators)
     logger.info(f'get_all_slides({slide_type})')
-    err = query_all_slide_name(slide_type)
+    if stream:
+        err = await storagePool.run(select_slides, slide_type, prefix, scanned_from, scanned_to,
+                                    order_by or 'name', descending, cursor)
+    else:
+        err = await storagePool.run(query_slide_listing, slide_type, prefix, scanned_from, scanned_to,
+                                    order_by, descending, cursor, limit)
     if err['code'] < 0:
         logger.error(err['data'])
-        serviceHistory.append(f"{procts.action_at()},allslides,{request.client.host},failed,{procts.consumed_time()},err['data']")
-        raise HTTPException(status_code=404, detail=err['data'])
-    errmsg = f"found {len(err['data'])} slide image files"
+        serviceHistory.append(f"{procts.action_at()},allslides,{request.client.host},failed,{procts.consumed_time()},{err['data']}")
+        if err['code'] == -4:
+            raise HTTPException(status_code=400, detail=err['data'])
+        raise storage_unavailable(err['data'])
+    ## validators were taken before listing, a later change only makes the next revalidation miss
+    headers = validator_headers(validators)
+    if stream:
+        def ndjson_lines():
+            summary = {'slides': 0}
+            yield from iter_slide_lines(err['data'], limit, summary)
+            serviceHistory.append(f"{procts.action_at()},allslides,{request.client.host},completed,{procts.consumed_time()},streamed {summary['slides']} slide image files")
+        return StreamingResponse(ndjson_lines(), media_type='application/x-ndjson', headers=headers)
+    data = err['data']
+    nslides = len(data['slides']) if isinstance(data, dict) else len(data)
+    errmsg = f"found {nslides} slide image files"
     serviceHistory.append(f"{procts.action_at()},allslides,{request.client.host},completed,{procts.consumed_time()},{errmsg}")
+    response.headers.update(headers)
+    return data
+
+@qcapicch.post('/rescan', summary='force re-scan of the slide index')
+async def rescan_all_slides(request: Request, slide_type: Optional[str] = None):
+    """
+    force re-scan of image storage for the slide index
+      :param slide_type: urine or thyroid, all slide types if not specified
+    """
+    procts = TSaction()
+    if slide_type and slide_type.lower() not in ['urine', 'thyroid']:
+        errmsg = f'there is no slide for {slide_type} slides'
+        logger.error(errmsg)
+        serviceHistory.append(f"{procts.action_at()},rescan,{request.client.host},failed,{procts.consumed_time()},{errmsg}")
+        raise HTTPException(status_code=404, detail=errmsg)
+    if not storageMonitor.is_alive():
+        errmsg = 'lost the connection to image storage'
+        logger.error(errmsg)
+        serviceHistory.append(f"{procts.action_at()},rescan,{request.client.host},failed,{procts.consumed_time()},{errmsg}")
+        raise storage_unavailable(errmsg)
+    err = await storagePool.run(rescan_slide_index, slide_type)
+    if err['code'] < 0:
+        logger.error(err['data'])
+        serviceHistory.append(f"{procts.action_at()},rescan,{request.client.host},failed,{procts.consumed_time()},{err['data']}")
+        raise storage_unavailable(err['data'])
+    serviceHistory.append(f"{procts.action_at()},rescan,{request.client.host},completed,{procts.consumed_time()},{err['data']}")
     return err['data']
 
 @qcapicch.get('/v0/slide', summary='query analyzed metadata for QC, return 2 signals')
-async def get_v0_slide_qc_result(slide_type: str, slide_id: str, request: Request):
+async def get_v0_slide_qc_result(slide_type: str, slide_id: str, request: Request, response: Response):
     """
     endpoint.v0 for querying analyzed metadata of specified slide
       :param slide_type: urine or thyroid
@@ -49,36 +121,21 @@ async def get_v0_slide_qc_result(slide_type: str, slide_id: str, request: Reques
         logger.error(errmsg)
         serviceHistory.append(f"{procts.action_at()},slide,{request.client.host},failed,{procts.consumed_time()},{errmsg}")
         raise HTTPException(status_code=404, detail=f'{slide_type} {slide_id} can not be found')
-    logger.info(f'starting get_slide_qc_result({slide_type}, {slide_id}) ...')
-    ## find slide_id with pathology_id
-    err = query_all_slide_name(slide_type)
-    if err['code'] < 0:
+    if not storageMonitor.is_alive():
         errmsg = 'lost the connection to image storage'
         logger.error(errmsg)
         serviceHistory.append(f"{procts.action_at()},slide,{request.client.host},failed,{procts.consumed_time()},{errmsg}")
-        raise HTTPException(status_code=404, detail=errmsg)
-    slideimages = []
-    for slidename in err['data']:
-        thisslide = {}
-        if slide_id in slidename:
-            thisslide['slideid'] = slidename
-            thisslide['stmtime'] = get_st_mtime(slide_type, f'{slidename}.med')
-            #logger.debug(f'{slidename}: {thisslide['stmtime']}')
-            slideimages.append(thisslide)
-    slide_found = True
-    if len(slideimages) > 1:
-        foundslide = sorted(slideimages, key=lambda x: (x['stmtime']), reverse=True)
-        #logger.debug(f'foundslide: {foundslide}')
-        slidename = foundslide[0]['slideid']
-    elif len(slideimages) == 1:
-        slidename = slideimages[0]['slideid']
-    else:
-        slide_found = False
-    ##
-    logger.debug(f'slideimages: {slideimages}')
+        raise storage_unavailable(errmsg)
+    logger.info(f'starting get_slide_qc_result({slide_type}, {slide_id}) ...')
+    ## find the latest scanned slide_id with pathology_id
+    slidename, validators = await storagePool.run(resolve_slide, slide_type, slide_id, 'v0')
+    logger.debug(f'{slide_id} is resolved to {slidename}')
+    if is_not_modified(request, validators):
+        serviceHistory.append(f"{procts.action_at()},slide,{request.client.host},completed,{procts.consumed_time()},not modified")
+        return not_modified(validators)
     qcresult = {}
-    if slide_found:
-        err = query_qcresult_for_slide(slide_type, slidename, 1)
+    if slidename is not None:
+        err = await storagePool.run(query_qcresult_for_slide, slide_type, slidename, 1)
         qcresult = err['data']
     else:
         err = {'code': -3, 'data': None}
@@ -94,10 +151,14 @@ async def get_v0_slide_qc_result(slide_type: str, slide_id: str, request: Reques
         errmsg = f'{slide_type} slide {slide_id} does not exist'
         logger.error(errmsg)
         serviceHistory.append(f"{procts.action_at()},slide,{request.client.host},failed,{procts.consumed_time()},{errmsg}")
+    if err['code'] == -1:
+        raise storage_unavailable(errmsg)
     if err['code'] < 0:
         raise HTTPException(status_code=404, detail=errmsg)
 
     serviceHistory.append(f"{procts.action_at()},slide,{request.client.host},completed,{procts.consumed_time()},{qcresult['rawdata']}")
+    ## validators were taken before evaluating, a later change only makes the next revalidation miss
+    response.headers.update(validator_headers(validators))
     return {
         'signal1': qcresult['signal'][0],
         'signal2': qcresult['signal'][1],
@@ -109,7 +170,7 @@ async def get_v0_slide_qc_result(slide_type: str, slide_id: str, request: Reques
     }
 
 @qcapicch.get('/v1/slide', summary='query analyzed metadata for QC, return 4 signals')
-async def get_v1_slide_qc_result(slide_type: str, slide_id: str, request: Request):
+async def get_v1_slide_qc_result(slide_type: str, slide_id: str, request: Request, response: Response):
     """
     endpoint.v1 for querying analyzed metadata of specified slide
       :param slide_type: urine or thyroid
@@ -121,38 +182,24 @@ async def get_v1_slide_qc_result(slide_type: str, slide_id: str, request: Reques
         logger.error(errmsg)
         serviceHistory.append(f"{procts.action_at()},slide,{request.client.host},failed,{procts.consumed_time()},{errmsg}")
         raise HTTPException(status_code=404, detail=f'{slide_type} {slide_id} can not be found')
-    logger.info(f'starting get_slide_qc_result({slide_type}, {slide_id}) ...')
-    ## find slide_id with pathology_id
-    err = query_all_slide_name(slide_type)
-    if err['code'] < 0:
+    if not storageMonitor.is_alive():
         errmsg = 'lost the connection to image storage'
         logger.error(errmsg)
         serviceHistory.append(f"{procts.action_at()},slide,{request.client.host},failed,{procts.consumed_time()},{errmsg}")
-        raise HTTPException(status_code=404, detail=errmsg)
-    slideimages = []
-    for slidename in err['data']:
-        thisslide = {}
-        if slide_id in slidename:
-            thisslide['slideid'] = slidename
-            thisslide['stmtime'] = get_st_mtime(slide_type, f'{slidename}.med')
-            #logger.debug(f'{slidename}: {thisslide['stmtime']}')
-            slideimages.append(thisslide)
-    slide_found = True
-    if len(slideimages) > 1:
-        foundslide = sorted(slideimages, key=lambda x: (x['stmtime']), reverse=True)
-        #logger.debug(f'foundslide: {foundslide}')
-        slidename = foundslide[0]['slideid']
-    elif len(slideimages) == 1:
-        slidename = slideimages[0]['slideid']
-    else:
-        slide_found = False
-    ##
-    logger.debug(f'slideimages: {slideimages}')
-    if slide_found:
-        err = query_qcresult_for_slide(slide_type, slidename, 1)
+        raise storage_unavailable(errmsg)
+    logger.info(f'starting get_slide_qc_result({slide_type}, {slide_id}) ...')
+    ## find the latest scanned slide_id with pathology_id
+    slidename, validators = await storagePool.run(resolve_slide, slide_type, slide_id, 'v1')
+    logger.debug(f'{slide_id} is resolved to {slidename}')
+    if is_not_modified(request, validators):
+        serviceHistory.append(f"{procts.action_at()},slide,{request.client.host},completed,{procts.consumed_time()},not modified")
+        return not_modified(validators)
+    if slidename is not None:
+        err = await storagePool.run(query_qcresult_for_slide, slide_type, slidename, 1)
         qcresult = err['data']
     else:
         qcresult = {}
+        err = {'code': -3, 'data': None}
     if err['code'] == -1:
         errmsg = 'lost net connection to image storage'
         logger.error(errmsg)
@@ -161,10 +208,18 @@ async def get_v1_slide_qc_result(slide_type: str, slide_id: str, request: Reques
         errmsg = f'can not find any metadata for {slide_type} slide {slide_id}'
         logger.error(errmsg)
         serviceHistory.append(f"{procts.action_at()},slide,{request.client.host},failed,{procts.consumed_time()},{errmsg}")
+    elif err['code'] == -3:
+        errmsg = f'{slide_type} slide {slide_id} does not exist'
+        logger.error(errmsg)
+        serviceHistory.append(f"{procts.action_at()},slide,{request.client.host},failed,{procts.consumed_time()},{errmsg}")
+    if err['code'] == -1:
+        raise storage_unavailable(errmsg)
     if err['code'] < 0:
         raise HTTPException(status_code=404, detail=errmsg)
 
     serviceHistory.append(f"{procts.action_at()},slide,{request.client.host},completed,{procts.consumed_time()},{qcresult['rawdata']}")
+    ## validators were taken before evaluating, a later change only makes the next revalidation miss
+    response.headers.update(validator_headers(validators))
     return {
         'signal1': qcresult['signal'][0],
         'signal2': qcresult['signal'][1],
@@ -177,6 +232,72 @@ async def get_v1_slide_qc_result(slide_type: str, slide_id: str, request: Reques
         'refnote': qcresult['refnote']
     }
 
+@qcapicch.post('/v1/slides', summary='query analyzed metadata for QC of many slides, return 4 signals each')
+async def get_v1_slides_qc_result(query: SlidesQuery, request: Request, stream: bool = False):
+    """
+    endpoint.v1 for querying analyzed metadata of many slides in one request
+      :param query: list of slide_type/slide_id pairs
+      :param stream: return NDJSON lines in completion order instead of one JSON list
+    code of each slide: 0 completed, -1 lost connection, -2 no metadata,
+    -3 slide not found, -4 unknown slide type, -5 .aix can not be parsed
+    """
+    procts = TSaction()
+    if len(query.slides) > MYENV.BATCH_MAX_SLIDES:
+        errmsg = f'too many slides ({len(query.slides)}), maximum is {MYENV.BATCH_MAX_SLIDES}'
+        logger.error(errmsg)
+        serviceHistory.append(f"{procts.action_at()},slides,{request.client.host},failed,{procts.consumed_time()},{errmsg}")
+        raise HTTPException(status_code=413, detail=errmsg)
+    if not storageMonitor.is_alive():
+        errmsg = 'lost the connection to image storage'
+        logger.error(errmsg)
+        serviceHistory.append(f"{procts.action_at()},slides,{request.client.host},failed,{procts.consumed_time()},{errmsg}")
+        raise storage_unavailable(errmsg)
+    logger.info(f'starting get_v1_slides_qc_result({len(query.slides)} slides) ...')
+    if stream:
+        async def ndjson_lines():
+            summary = {'completed': 0, 'failed': 0}
+            async for line in stream_slides_as_ndjson(query.slides, summary):
+                yield line
+            serviceHistory.append(f"{procts.action_at()},slides,{request.client.host},completed,{procts.consumed_time()},{summary['completed']} completed; {summary['failed']} failed")
+        return StreamingResponse(ndjson_lines(), media_type='application/x-ndjson')
+    results = await evaluate_slides(query.slides)
+    nfailed = sum(1 for x in results if x['code'] < 0)
+    serviceHistory.append(f"{procts.action_at()},slides,{request.client.host},completed,{procts.consumed_time()},{len(results)-nfailed} completed; {nfailed} failed")
+    return results
+
+@qcapicch.get('/v1/slidestore', summary='query slides by pathology id, scan time, model and cell counts')
+async def query_slides_in_store(request: Request, slide_type: str, pathology_id: Optional[str] = None,
+                                scanned_from: Optional[str] = None, scanned_to: Optional[str] = None,
+                                model: Optional[str] = None, version: Optional[str] = None,
+                                category: Optional[str] = None, min_count: Optional[int] = None, max_count: Optional[int] = None,
+                                order_by: str = 'scanned', descending: bool = True, limit: int = 100, offset: int = 0):
+    """
+    endpoint for querying the slide store, no .aix is parsed
+      :param slide_type: urine or thyroid
+      :param pathology_id: exact pathology id
+      :param scanned_from: scanned at or after this ISO date/datetime, e.g. 2025-06-30
+      :param scanned_to: scanned before this ISO date/datetime
+      :param model: AIxURO or AIxTHY
+      :param version: model version prefix, e.g. 2025.2
+      :param category: cell category, e.g. suspicious, for min_count/max_count and order_by=count
+      :param order_by: scanned, name, pathology_id or count
+      :param limit: maximum slides, up to SLIDESTORE_MAX_ROWS
+    """
+    procts = TSaction()
+    if slide_type.lower() not in ['urine', 'thyroid']:
+        errmsg = f'there is no slide for {slide_type} slides'
+        logger.error(errmsg)
+        serviceHistory.append(f"{procts.action_at()},slidestore,{request.client.host},failed,{procts.consumed_time()},{errmsg}")
+        raise HTTPException(status_code=404, detail=errmsg)
+    err = await storagePool.run(query_slide_store, slide_type, pathology_id, scanned_from, scanned_to, model, version,
+                                category, min_count, max_count, order_by, descending, limit, offset)
+    if err['code'] < 0:
+        logger.error(err['data'])
+        serviceHistory.append(f"{procts.action_at()},slidestore,{request.client.host},failed,{procts.consumed_time()},{err['data']}")
+        raise HTTPException(status_code=400, detail=err['data'])
+    serviceHistory.append(f"{procts.action_at()},slidestore,{request.client.host},completed,{procts.consumed_time()},found {len(err['data'])} slides")
+    return err['data']
+
 @qcapicch.post('/setScoreThreshold', summary='set urine score threshold', include_in_schema=True)
 async def set_score_threshold_for_qc(s: float, request: Request):
     """
@@ -189,10 +310,10 @@ async def set_score_threshold_for_qc(s: float, request: Request):
         logger.warning(retmsg)
         errstat = 'failed'
     else:
-        change_qc_score_criteria(s)
+        await storagePool.run(change_qc_score_criteria, s)
         retmsg = f'score threshold was set to {s}'
         errstat = 'completed'
-    ret = get_current_magic_number()
+    ret = await storagePool.run(get_current_magic_number)
     serviceHistory.append(f"{procts.action_at()},setScoreCriteria,{request.client.host},{errstat},{procts.consumed_time()},{retmsg}")
     return {
         'score threshold': ret[2]
@@ -204,7 +325,7 @@ async def get_magic_number_for_qc(request: Request):
     endpoint for querying urine QC MAGIC number
     """
     procts = TSaction()
-    ret = get_current_magic_number()
+    ret = await storagePool.run(get_current_magic_number)
     serviceHistory.append(f"{procts.action_at()},currentQCmagic,{request.client.host},completed,{procts.consumed_time()},{ret}")
     return {
         'suspicious': ret[0],
@@ -219,7 +340,7 @@ async def change_magic_number_for_qc(s: int, a: int, request: Request):
       :param a: magic number for atypical cell
     """
     procts = TSaction()
-    ret = change_qc_magic_number(s, a)
+    ret = await storagePool.run(change_qc_magic_number, s, a)
     if ret:
         retstr = f'magic number was changed to suspicious:{s}, atypical:{a}'
         logger.info(retstr)
@@ -230,3 +351,14 @@ async def change_magic_number_for_qc(s: int, a: int, request: Request):
         errstat = 'failed'
     serviceHistory.append(f"{procts.action_at()},changeQCmagic,{request.client.host},{errstat},{procts.consumed_time()},{retstr}")
     return retstr
+
+@qcapicch.get('/cachestats', summary='get QC result cache statistics', include_in_schema=True)
+async def get_qc_cache_statistics(request: Request):
+    """
+    endpoint for querying hit/miss/eviction counters of QC result cache
+    """
+    procts = TSaction()
+    err = get_qc_cache_stats()
+    stats = err['data']
+    serviceHistory.append(f"{procts.action_at()},cachestats,{request.client.host},completed,{procts.consumed_time()},hits {stats['hits']} misses {stats['misses']}")
+    return stats
@@ -3,23 +3,68 @@
 """
 import os
 import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 from loguru import logger
 from cchqc.config import MYENV, serviceHistory, TSaction, init_logger
+from cchqc.metrics import qcMetrics, MetricsMiddleware
 from cchqc.amaqccch import qcapicch
 from cchqc.secureqc import secure_qcapicch
 from cchqc.subfuncs import localapi
 from cchqc.dummycch import router_cchapi, router_cchimg
-from cchqc.qcxfuncs import is_net_connection_alive
+from cchqc.storagemonitor import storageMonitor, is_net_connection_alive
+from cchqc.slideindex import slideIndex
+from cchqc.slidewatcher import slideWatcher
+from cchqc.watchwsi import wsiMover
+from cchqc.workers import storagePool
+from cchqc.slidestore import slideStoreService
+from cchqc.sharedstate import sharedState, leaderLease
+
+def start_singleton_services():
+    """ services which run in one API worker only """
+    if MYENV.WATCHER_ENABLED:
+        slideWatcher.start()
+    if MYENV.WATCHWSI_ENABLED:
+        wsiMover.start()
+    if MYENV.SLIDESTORE_ENABLED:
+        slideStoreService.start()
+
+def stop_singleton_services():
+    """ stop services of start_singleton_services() """
+    slideStoreService.stop()
+    wsiMover.stop()
+    slideWatcher.stop()
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """ start background services with API service """
+    storageMonitor.start()
+    if leaderLease:
+        ## take the lease before the slide index, the leader scans while others load its index
+        leaderLease.start(start_singleton_services, stop_singleton_services)
+    slideIndex.start()
+    if not leaderLease:
+        start_singleton_services()
+    yield
+    if leaderLease:
+        leaderLease.stop()
+    else:
+        stop_singleton_services()
+    slideIndex.stop()
+    storageMonitor.stop()
+    storagePool.shutdown()
+    serviceHistory.close()
 
 app = FastAPI(
     title = MYENV.APP_NAME,
     description = MYENV.APP_DESCRIPTION,
     version = MYENV.APP_VERSION,
     docs_url="/docs" if MYENV.ENVIRONMENT != 'production' else None,
-    redoc_url="/redoc" if MYENV.ENVIRONMENT != 'production' else None
+    redoc_url="/redoc" if MYENV.ENVIRONMENT != 'production' else None,
+    lifespan=lifespan
 )
 app.add_middleware(
     CORSMiddleware,
@@ -28,6 +73,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"]
 )
+app.add_middleware(MetricsMiddleware)
 app.include_router(qcapicch, prefix="/qc", tags=["APIs for CCH QC"])
 app.include_router(secure_qcapicch, prefix="/cchqc", tags=["secured endpoints for CCH QC"])
 app.include_router(localapi, prefix="/sub", tags=['sub functions'])
@@ -48,11 +94,23 @@ async def read_root():
 @app.get('/health', summary='API service healthy check')
 async def qcapi_health_check(request: Request):
     """
-    API serivce health check
+    API serivce health check, with image storage state of the last background probe
     """
     procts = TSaction()
-    serviceHistory.append(f"{procts.action_at()},health,{request.client.host},completed,{procts.consumed_time()},n.a.")
-    return {'status': 'healthy', 'timestamp': time.strftime("%Y-%m-%d %H:%M:%S",time.localtime())}
+    storage = storageMonitor.status()
+    serviceHistory.append(f"{procts.action_at()},health,{request.client.host},completed,{procts.consumed_time()},storage {storage['status']}")
+    return {
+        'status': 'healthy' if storage['status'] == 'up' else 'degraded',
+        'timestamp': time.strftime("%Y-%m-%d %H:%M:%S",time.localtime()),
+        'storage': storage
+    }
+
+@app.get('/metrics', summary='service metrics in Prometheus text format', response_class=PlainTextResponse)
+async def qcapi_metrics():
+    """
+    request counts, latency histograms and storage/parse/cache counters, not written to request history
+    """
+    return PlainTextResponse(qcMetrics.render(), media_type='text/plain; version=0.0.4')
 
 def start_qcapi(from_main=None):
     """ 🔒🛡️🚨
@@ -79,10 +137,16 @@ def start_qcapi(from_main=None):
     if isconnected:
         key_file = os.path.join(os.getenv('localappdata'), MYENV.APP_NAME, MYENV.SSL_KEYFILE)
         certfile = os.path.join(os.getenv('localappdata'), MYENV.APP_NAME, MYENV.SSL_CERTFILE)
+        workers = max(1, MYENV.API_WORKERS)
+        if sharedState:
+            ## QC criteria of the previous run are not kept, same as one process
+            sharedState.reset_criteria()
+            logger.info(f'starting {workers} API workers, shared state in {sharedState.dbfile}')
         uvicorn.run('cchqc.api_main:app', host=MYENV.API_HOST, port=MYENV.API_PORT,
                     ssl_keyfile=key_file,
                     ssl_certfile=certfile,
-                    reload=need_reload)
+                    reload=need_reload and workers == 1,
+                    workers=workers)
     else:
         logger.error(f'[AMI_MAIN][ERROR] can not connect to {MYENV.DRIVEY_HOME}, pleasec contact with service team')
 
@@ -0,0 +1,76 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.batchqc
+  query QC results of many slides in one request
+"""
+import asyncio
+import json
+from typing import List
+from pydantic import BaseModel
+from cchqc.qcxfuncs import query_qcresult_for_slide, find_latest_slide
+from cchqc.workers import storagePool
+from cchqc.storagemonitor import storageMonitor
+
+class SlideQuery(BaseModel):
+    """ one slide of batch query """
+    slide_type: str
+    slide_id: str
+
+class SlidesQuery(BaseModel):
+    """ request body of batch query """
+    slides: List[SlideQuery]
+
+def v1_slide_response(qcresult):
+    """
+    response body of v1 slide endpoint
+      :param qcresult: data of query_qcresult_for_slide()
+    """
+    return {
+        'signal1': qcresult['signal'][0],
+        'signal2': qcresult['signal'][1],
+        'signal3': qcresult['signal'][2],
+        'signal4': qcresult['signal'][3],
+        'medpath': qcresult['medpath'],
+        'asposix': qcresult['posixpath'],
+        'medfile': qcresult['medname'],
+        'rawdata': qcresult['rawdata'],
+        'refnote': qcresult['refnote']
+    }
+
+async def evaluate_one_slide(query):
+    """
+    resolve slide id with the slide index and evaluate its .aix
+      :param query: SlideQuery
+    """
+    slide_type = query.slide_type.lower()
+    ret = {'slide_type': query.slide_type, 'slide_id': query.slide_id}
+    if slide_type not in ['urine', 'thyroid']:
+        return {**ret, 'code': -4, 'detail': f'there is no slide for {query.slide_type} slides'}
+    if not storageMonitor.is_alive():
+        return {**ret, 'code': -1, 'detail': 'lost the connection to image storage'}
+    slidename = await storagePool.run(find_latest_slide, slide_type, query.slide_id)
+    if slidename is None:
+        return {**ret, 'code': -3, 'detail': f'{slide_type} slide {query.slide_id} does not exist'}
+    try:
+        err = await storagePool.run(query_qcresult_for_slide, slide_type, slidename, 1, False)
+    except Exception as e:
+        return {**ret, 'code': -5, 'detail': f'failed to parse metadata of {slidename}: {e}'}
+    if err['code'] < 0:
+        return {**ret, 'code': err['code'], 'detail': f'can not find any metadata for {slide_type} slide {query.slide_id}'}
+    return {**ret, 'code': 0, 'detail': 'completed', 'data': v1_slide_response(err['data'])}
+
+async def evaluate_slides(queries):
+    """
+    evaluate slides concurrently, results in request order
+      :param queries: list of SlideQuery
+    """
+    return await asyncio.gather(*[evaluate_one_slide(x) for x in queries])
+
+async def stream_slides_as_ndjson(queries, summary):
+    """
+    evaluate slides concurrently, yield one NDJSON line per slide as completed
+      :param queries: list of SlideQuery
+      :param summary: dict updated with number of completed/failed slides
+    """
+    for task in asyncio.as_completed([evaluate_one_slide(x) for x in queries]):
+        result = await task
+        summary['completed' if result['code'] == 0 else 'failed'] += 1
+        yield json.dumps(result)+'\n'
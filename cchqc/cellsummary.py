@@ -0,0 +1,133 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.cellsummary
+  counts-only summary of analyzed cells for QC criteria
+"""
+import sys
+import numpy as np
+
+def trait_matrix(traitrows):
+    """
+    cells x traits float64 matrix of trait scores, shorter rows padded with NaN
+      :param traitrows: list of trait score lists, one per cell
+    float64 keeps `score >= threshold` identical to comparing the JSON floats,
+    NaN never passes a threshold like a missing trait
+    """
+    if not traitrows:
+        return np.empty((0, 0), dtype=np.float64)
+    width = max(len(x) for x in traitrows)
+    if all(len(x) == width for x in traitrows):
+        return np.array(traitrows, dtype=np.float64)
+    traits = np.full((len(traitrows), width), np.nan, dtype=np.float64)
+    for i, row in enumerate(traitrows):
+        traits[i, :len(row)] = row
+    return traits
+
+def count_traits(traits, max_traits, threshold):
+    """
+    count cells of each trait with score >= threshold
+      :param traits: cells x traits matrix from trait_matrix()
+      :param max_traits: maximum number of traits
+      :param threshold: criteria for counting trait
+    """
+    width = min(traits.shape[1], max_traits)
+    traitcount = np.zeros(max_traits, dtype=np.int64)
+    traitcount[:width] = np.count_nonzero(traits[:, :width] >= threshold, axis=0)
+    return traitcount.tolist()
+
+class TraitScoreIndex:
+    """
+    trait scores of one .aix sorted per (cell category, trait), counts at any threshold by binary search
+    each score is kept as key = row*(len(values)+1) + rank of its value, one sorted array for all rows,
+    so counts of every category and trait at a threshold are two searchsorted() calls
+    """
+    def __init__(self, categories, traits):
+        self.width = traits.shape[1]
+        valid = ~np.isnan(traits)
+        self.categories, slots = np.unique(categories, return_inverse=True)
+        ## exact float64 scores in ascending order, ranks keep `score >= threshold` exact
+        self.values, ranks = np.unique(traits[valid], return_inverse=True)
+        self.stride = len(self.values) + 1
+        nrows = len(self.categories)*self.width
+        dtype = np.int32 if nrows*self.stride < 2**31 else np.int64
+        rows = (slots[:, None]*self.width + np.arange(self.width))[valid]
+        self.keys = np.sort(rows.astype(dtype)*self.stride + ranks.astype(dtype))
+        self.starts = np.arange(nrows, dtype=dtype)*self.stride
+        self.ends = np.searchsorted(self.keys, self.starts + self.stride)
+
+    def counts_at(self, thresholds):
+        """
+        cells with score >= threshold, categories x traits x thresholds
+          :param thresholds: list of criteria for counting trait
+        """
+        ranks = np.searchsorted(self.values, np.asarray(thresholds, dtype=np.float64), side='left')
+        ## queries of the same dtype as keys, or searchsorted() would convert all keys
+        firsts = np.searchsorted(self.keys, self.starts[:, None] + ranks[None, :].astype(self.keys.dtype))
+        return (self.ends[:, None] - firsts).reshape(len(self.categories), self.width, len(ranks))
+
+    def category_slot(self, category):
+        """ index of category in counts_at(), None if no cell is of category """
+        slot = int(np.searchsorted(self.categories, category))
+        if slot < len(self.categories) and self.categories[slot] == category:
+            return slot
+        return None
+
+    def nbytes(self):
+        """ memory size of arrays """
+        return self.categories.nbytes + self.values.nbytes + self.keys.nbytes + self.starts.nbytes + self.ends.nbytes
+
+class CellSummary:
+    """ category counts and sorted thyroid trait scores of one .aix, no per-cell dict """
+    def __init__(self, aixinfo, cellscount, traitcats=None, traitrows=None):
+        self.aixinfo = aixinfo
+        self.cellscount = cellscount
+        self.ncells = len(traitcats) if traitcats else 0
+        self.scores = TraitScoreIndex(np.asarray(traitcats if traitcats else [], dtype=np.int64), trait_matrix(traitrows))
+
+    def number_of_cells(self):
+        """ number of cells with trait scores """
+        return self.ncells
+
+    def trait_counts(self, max_traits, threshold):
+        """
+        count cells of each trait with score >= threshold
+          :param max_traits: maximum number of traits
+          :param threshold: criteria for counting trait
+        """
+        return self.trait_counts_at(max_traits, [threshold])[0]
+
+    def trait_counts_at(self, max_traits, thresholds):
+        """
+        trait_counts() of several thresholds in one pass
+          :param max_traits: maximum number of traits
+          :param thresholds: list of criteria for counting trait
+        returns one count list per threshold
+        """
+        width = min(self.scores.width, max_traits)
+        traitcount = np.zeros((len(thresholds), max_traits), dtype=np.int64)
+        traitcount[:, :width] = self.scores.counts_at(thresholds)[:, :width].sum(axis=0).T
+        return traitcount.tolist()
+
+    def category_counts_at(self, category, thresholds):
+        """
+        cells of category with score >= threshold, traits x thresholds
+          :param category: cell category
+          :param thresholds: list of criteria for counting trait
+        """
+        slot = self.scores.category_slot(category)
+        if slot is None:
+            return [[0 for _ in thresholds] for _ in range(self.scores.width)]
+        return self.scores.counts_at(thresholds)[slot].tolist()
+
+    def count_trait_in_category(self, trait, category, threshold):
+        """
+        count cells of category with trait score >= threshold
+          :param trait: index of trait
+          :param category: cell category
+          :param threshold: criteria for counting trait
+        """
+        if trait >= self.scores.width:
+            return 0
+        return self.category_counts_at(category, [threshold])[trait][0]
+
+    def nbytes(self):
+        """ estimated memory size """
+        return sys.getsizeof(self.aixinfo) + sys.getsizeof(self.cellscount) + self.scores.nbytes()
@@ -0,0 +1,159 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.celltable
+  columnar table of analyzed cells, replaces one dict per cell
+"""
+from array import array
+from collections.abc import Mapping
+import numpy as np
+from cchqc.cellsummary import trait_matrix
+
+## category ids are kept as int8
+CATEGORY_RANGE = np.iinfo(np.int8)
+
+class CellRow(Mapping):
+    """ read-only dict-like view of one row of CellTable, values are read on access """
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, key):
+        return self._table.value(self._row, key)
+
+    def __iter__(self):
+        return iter(self._table.keys)
+
+    def __len__(self):
+        return len(self._table.keys)
+
+    def __repr__(self):
+        return f'CellRow({dict(self)})'
+
+class CellTable:
+    """ target cells of one .aix as columns, rows ordered by category then score descending
+      categories int8, score/probability/ncratio/traits float64, segments as [x, y] float64
+      coordinates of all cells with per-cell offsets, row i has seg_coords[seg_offsets[i]:seg_offsets[i+1]]
+      float64 keeps the JSON values, QC criteria of CellTable and CellSummary compare the same floats
+    """
+    def __init__(self, names, categories, scores, probs, ncratios, traits, seg_offsets, seg_coords, with_segments):
+        self.names = names
+        self.categories = categories
+        self.scores = scores
+        self.probs = probs
+        self.ncratios = ncratios
+        self.traits = traits
+        self.seg_offsets = seg_offsets
+        self.seg_coords = seg_coords
+        self.with_segments = with_segments
+        self.keys = ('cellname', 'category', 'segments') + (('ncratio',) if ncratios is not None else ()) + \
+                    ('probability', 'score', 'traits')
+
+    @classmethod
+    def from_cell_nodes(cls, cellnodes, nulltags, with_ncratio, with_segments=True):
+        """
+        build table from (name, segments, data) of cells, cells without data are skipped
+          :param cellnodes: iterable of (name, segments, data)
+          :param nulltags: trait scores of cells without tags
+          :param with_ncratio: keep ncRatio column (AIxURO)
+          :param with_segments: keep segments, None for every row if False
+        """
+        names, traitrows = [], []
+        categories, scores, probs, ncratios = array('q'), array('d'), array('d'), array('d')
+        seg_lengths, seg_coords = array('q'), array('d')
+        for cellname, segments, cdata in cellnodes:
+            if not cdata:
+                continue
+            names.append(cellname)
+            categories.append(cdata.get('category', -1))
+            scores.append(cdata.get('score', 0.0))
+            probs.append(cdata.get('prob', 0.0))
+            if with_ncratio:
+                ncratios.append(cdata.get('ncRatio', 0.0))
+            traitrows.append(cdata.get('tags', nulltags))
+            if with_segments and segments:
+                seg_lengths.append(len(segments))
+                for point in segments:
+                    seg_coords.extend(point[:2])
+            else:
+                seg_lengths.append(0)
+        categories = np.frombuffer(categories, dtype=np.int64)
+        ## int8 would wrap a category id of a broken or newer model .aix into another category
+        if len(categories) and (categories.min() < CATEGORY_RANGE.min or categories.max() > CATEGORY_RANGE.max):
+            bad = categories[(categories < CATEGORY_RANGE.min) | (categories > CATEGORY_RANGE.max)][0]
+            raise ValueError(f'category id {bad} is out of range {CATEGORY_RANGE.min}..{CATEGORY_RANGE.max}')
+        scores = np.frombuffer(scores, dtype=np.float64)
+        ## same order as sorted(key=(-category, score), reverse=True)
+        order = np.lexsort((-scores, categories)) if len(names) else np.empty(0, dtype=np.int64)
+        traits = trait_matrix([[np.nan] if x is None else x for x in traitrows])
+        seg_lengths = np.frombuffer(seg_lengths, dtype=np.int64)
+        seg_starts = np.concatenate(([0], np.cumsum(seg_lengths)))
+        seg_coords = np.frombuffer(seg_coords, dtype=np.float64).reshape(-1, 2)
+        ## regroup segments of all cells in row order
+        sorted_lengths = seg_lengths[order]
+        seg_offsets = np.concatenate(([0], np.cumsum(sorted_lengths)))
+        if len(seg_coords):
+            picks = np.repeat(seg_starts[order] - seg_offsets[:-1], sorted_lengths) + np.arange(seg_offsets[-1])
+            seg_coords = seg_coords[picks]
+        return cls([names[i] for i in order],
+                   categories[order].astype(np.int8),
+                   scores[order],
+                   np.frombuffer(probs, dtype=np.float64)[order],
+                   np.frombuffer(ncratios, dtype=np.float64)[order] if with_ncratio else None,
+                   traits[order] if len(traits) else traits,
+                   seg_offsets, seg_coords, with_segments)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self.names)
+        if not 0 <= row < len(self.names):
+            raise IndexError('CellTable index out of range')
+        return CellRow(self, row)
+
+    def __iter__(self):
+        for row in range(len(self.names)):
+            yield CellRow(self, row)
+
+    def segment_array(self, row):
+        """ (points, 2) view of segments of row, no copy """
+        return self.seg_coords[self.seg_offsets[row]:self.seg_offsets[row+1]]
+
+    def value(self, row, key):
+        """ python value of one cell, same as the former per-cell dict """
+        if key == 'cellname':
+            return self.names[row]
+        if key == 'category':
+            return int(self.categories[row])
+        if key == 'segments':
+            return self.segment_array(row).tolist() if self.with_segments else None
+        if key == 'ncratio' and self.ncratios is not None:
+            return float(self.ncratios[row])
+        if key == 'probability':
+            return float(self.probs[row])
+        if key == 'score':
+            return float(self.scores[row])
+        if key == 'traits':
+            traits = self.traits[row]
+            return traits[~np.isnan(traits)].tolist()
+        raise KeyError(key)
+
+    def category_counts(self, ncategories):
+        """
+        number of cells of each category, unknown categories are not counted
+          :param ncategories: number of categories of the model
+        returns (counts, sorted unknown categories)
+        """
+        categories = self.categories.astype(np.int64)
+        known = (categories >= 0) & (categories < ncategories)
+        counts = np.bincount(categories[known], minlength=ncategories)
+        return counts.tolist(), np.unique(categories[~known]).tolist()
+
+    def nbytes(self):
+        """ memory size of columns """
+        nbytes = sum(len(x) + 49 for x in self.names) + 8*len(self.names)
+        for column in (self.categories, self.scores, self.probs, self.ncratios, self.traits, self.seg_offsets, self.seg_coords):
+            if column is not None:
+                nbytes += column.nbytes
+        return nbytes
@@ -0,0 +1,96 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.conditional
+  ETag/Last-Modified of slide and listing responses, 304 for If-None-Match/If-Modified-Since
+"""
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from typing import NamedTuple
+from fastapi import Response
+from cchqc.slideindex import slideIndex
+from cchqc.qcxfuncs import qcMAGIC, find_latest_slide
+
+class Validators(NamedTuple):
+    """ strong ETag and Last-Modified timestamp of one response """
+    etag: str
+    last_modified: float
+
+def make_etag(*parts):
+    """ strong ETag of parts """
+    return '"' + hashlib.blake2b('|'.join(str(x) for x in parts).encode('utf-8'), digest_size=12).hexdigest() + '"'
+
+def slide_validators(slide_type, slidename, variant):
+    """
+    validators of one slide from its slide index entry and QC criteria, .aix is not touched
+      :param slide_type: urine or thyroid
+      :param slidename: resolved slide name
+      :param variant: response format, e.g. v1
+    None if the slide is not in the slide index
+    """
+    sindex = slideIndex.get_index(slide_type)
+    entry = sindex.lookup(slidename) if sindex else None
+    if entry is None or not (entry.has_med and entry.has_aix):
+        return None
+    etag = make_etag(slide_type.lower(), slidename, variant, repr(entry.aix_mtime), entry.aix_size, qcMAGIC.criteria_version())
+    return Validators(etag, max(entry.aix_mtime, qcMAGIC.criteria_changed_at()))
+
+def resolve_slide(slide_type, slide_id, variant):
+    """
+    latest slide name of slide_id and its validators, run in storage pool
+      :param slide_type: urine or thyroid
+      :param slide_id: slide id for querying
+      :param variant: response format, e.g. v1
+    (None, None) if the slide can not be found
+    """
+    slidename = find_latest_slide(slide_type, slide_id)
+    if slidename is None:
+        return None, None
+    return slidename, slide_validators(slide_type, slidename, variant)
+
+def listing_validators(slide_type, variant='list'):
+    """
+    validators of slide listing from slide index generation
+      :param slide_type: urine or thyroid
+      :param variant: response format
+    None if there is no slide index of slide_type
+    """
+    sindex = slideIndex.get_index(slide_type)
+    if sindex is None:
+        return None
+    generation, modified_at = sindex.version()
+    return Validators(make_etag(slide_type.lower(), variant, generation, repr(modified_at)), modified_at)
+
+def validator_headers(validators):
+    """ response headers of validators, clients revalidate before using a cached body """
+    if validators is None:
+        return {}
+    return {
+        'ETag': validators.etag,
+        'Last-Modified': formatdate(validators.last_modified, usegmt=True),
+        'Cache-Control': 'no-cache'
+    }
+
+def is_not_modified(request, validators):
+    """
+    True if the client copy is current, If-None-Match wins over If-Modified-Since
+      :param request: starlette Request
+      :param validators: Validators of current response, None never matches
+    """
+    if validators is None:
+        return False
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        ## weak comparison as RFC 9110 for GET
+        tags = [x.strip().removeprefix('W/') for x in if_none_match.split(',')]
+        return '*' in tags or validators.etag in tags
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        ## HTTP dates have one second resolution
+        return int(validators.last_modified) <= since
+    return False
+
+def not_modified(validators):
+    """ empty 304 response with validators """
+    return Response(status_code=304, headers=validator_headers(validators))
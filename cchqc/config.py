@@ -3,10 +3,19 @@
 """
 import os
 from typing import Optional, List
+import atexit
+import queue
+import threading
 import time
 from functools import lru_cache
 from loguru import logger
 from pydantic_settings import BaseSettings, SettingsConfigDict
+try:
+    import msvcrt
+    fcntl = None
+except ImportError:     ## not Windows
+    import fcntl
+    msvcrt = None
 
 class TSaction:
     """ for calculating process time """
@@ -59,6 +68,43 @@ class Settings(BaseSettings):
     #DECART_PATH: str = r"C:\Program Files\WindowsApps\com.aixmed.decart_2.8.14.0_x64__pkjfmh18q18h8"
     #DECART_YAML: str = r"C:\ProgramData\DeCart\config.yaml"
     ENDPOINT_SLIDEINFO: str = "http://192.168.42.115:5025/v1/slideinfo?slide_id="
+    SLIDEINDEX_REFRESH_SECONDS: int = 60    # background re-scan interval of DRIVEY_HOME
+    QCCACHE_MAX_ENTRIES: int = 512          # parsed QC results kept in memory
+    QCCACHE_MAX_MB: int = 256               # memory budget of parsed QC results
+    STORAGE_WORKERS: int = 8                # threads for storage access and .aix parsing
+    BATCH_MAX_SLIDES: int = 500             # maximum slides of one batch query
+    SUMMARY_WORKERS: int = 0                # processes for summarizing .aix to CSV, 0 for CPU count
+    REQUESTLOG_BATCH_SIZE: int = 64         # request records written per batch
+    REQUESTLOG_FLUSH_SECONDS: float = 1.0   # maximum delay of request records
+    REQUESTLOG_MAX_MB: int = 16             # rotate request-history.csv over this size
+    REQUESTLOG_ROTATE_DAILY: bool = True    # rotate request-history.csv every day
+    STORAGE_PROBE_SECONDS: int = 10         # probe interval of DRIVEY_HOME while it is up
+    STORAGE_PROBE_MAX_SECONDS: int = 120    # maximum probe interval, backoff while it is down
+    STORAGE_PROBE_TIMEOUT: int = 15         # report DRIVEY_HOME down if a probe hangs longer
+    WATCHER_ENABLED: bool = True            # pre-compute QC results of new slides
+    WATCHER_POLL_SECONDS: int = 5           # poll interval of slide folders
+    WATCHER_STABLE_SECONDS: int = 10        # .med/.aix unchanged this long are complete
+    WATCHER_WORKERS: int = 2                # threads for parsing new .aix
+    WATCHWSI_ENABLED: bool = False          # move WSI files from scanner folders to watch folder
+    WATCHWSI_SOURCES: List[str] = []        # WSI folders of scanner workstation
+    WATCHWSI_TARGET: str = ''               # watch folder of model inference
+    WATCHWSI_EXTENSIONS: List[str] = ['.med']   # WSI file extensions to move
+    WATCHWSI_POLL_SECONDS: int = 5          # scan interval of scanner folders
+    WATCHWSI_STABLE_SECONDS: int = 30       # WSI unchanged this long is completely scanned
+    WATCHWSI_WORKERS: int = 4               # concurrent copies
+    WATCHWSI_MAX_MBPS: float = 0            # total copy bandwidth in MB/s, 0 for unlimited
+    WATCHWSI_KEEP_SOURCE: bool = False      # copy only, keep WSI in scanner folder
+    SIDECAR_ENABLED: bool = True            # keep compact QC summary of each .aix
+    SIDECAR_BESIDE_AIX: bool = False        # write it next to .aix, else under AMAQC_HOME\sidecar
+    API_WORKERS: int = 1                    # uvicorn worker processes, state is shared in SQLite if more than 1
+    SHARED_SYNC_SECONDS: float = 1.0        # followers reload the slide index published by the leader this often
+    SHARED_LEASE_SECONDS: int = 30          # leader lease of background services, taken over after it expires
+    SLIDESTORE_ENABLED: bool = True         # keep slide metadata and category counts in SQLite for queries
+    SLIDESTORE_SYNC_SECONDS: int = 30       # sync the slide store after the slide index changed, checked this often
+    SLIDESTORE_MAX_ROWS: int = 1000         # maximum slides of one slide store query
+    PATHOLOGY_ID_PATTERN: str = r'^[^_\s]+'    # pathology id in slide name, whole name if it does not match
+    ALLSLIDES_PAGE_SIZE: int = 500          # slides per page of /allslides if cursor is given without limit
+    ALLSLIDES_MAX_PAGE: int = 5000          # maximum limit of one /allslides page
     # DUMMY ADMIN for CCH
     DUMMY_ADMIN: str = 'empty'
     DUMMY_EMAIL: str = 'empty'
@@ -74,28 +120,123 @@ class Settings(BaseSettings):
     )
     #print(model_config)
 
+def lock_file(fobj):
+    """ exclusive lock shared by all processes, blocks until acquired """
+    if msvcrt is not None:
+        fobj.seek(0)
+        while True:
+            try:
+                msvcrt.locking(fobj.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue    ## LK_LOCK gives up after 10 seconds, keep waiting
+    fcntl.flock(fobj.fileno(), fcntl.LOCK_EX)
+
+def unlock_file(fobj):
+    """ release lock_file() """
+    if msvcrt is not None:
+        fobj.seek(0)
+        msvcrt.locking(fobj.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(fobj.fileno(), fcntl.LOCK_UN)
+
 class RequestLog:
-    """ append request history to CSV """
-    def __init__(self):
+    """ append request history to CSV
+      records are queued and written in batches by a background thread,
+      the history file is rotated by size or day, a lock file serializes
+      writers of all uvicorn worker processes
+    """
+    header = 'datetime, request, requestor, status, consumed_time, note'
+
+    def __init__(self, batch_size=64, flush_seconds=1.0, max_bytes=16*1024*1024, rotate_daily=True):
         self.logservice = os.path.join(os.getenv('LOCALAPPDATA'), 'ama_qcapi', 'request-history.csv')
-        if os.path.exists(self.logservice):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.__queue = queue.SimpleQueue()
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__writer_loop, name='requestlog', daemon=True)
+        self.__thread.start()
+        atexit.register(self.close)
+
+    def append(self, record):
+        """ append request record, never blocks the caller """
+        if self.__closed:
+            logger.warning(f'RequestLog is closed, drop record: {record}')
             return
-        header = 'datetime, request, requestor, status, consumed_time, note'
+        self.__queue.put(record)
+
+    def __writer_loop(self):
+        batch = []
+        deadline = time.monotonic()+self.flush_seconds
+        while True:
+            try:
+                record = self.__queue.get(timeout=max(deadline-time.monotonic(), 0.0))
+            except queue.Empty:
+                record = ''
+            if record is None:  ## close() was called
+                self.__flush(batch, sync=True)
+                return
+            if record:
+                batch.append(record)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self.__flush(batch)
+                batch = []
+                deadline = time.monotonic()+self.flush_seconds
+
+    def __need_rotation(self):
         try:
-            with open(self.logservice, 'a', encoding='utf-8') as rlog:
-                rlog.write(header+'\n')
-        except Exception as e:
-            logger.error(f'RequestLog.init failed: {e}')
-            raise
+            fstat = os.stat(self.logservice)
+        except FileNotFoundError:
+            return None
+        if fstat.st_size >= self.max_bytes:
+            return fstat
+        if self.rotate_daily and time.strftime('%Y%m%d', time.localtime(fstat.st_mtime)) != time.strftime('%Y%m%d'):
+            return fstat
+        return None
 
-    def append(self, record):
-        """ append request record """
+    def __rotate(self, fstat):
+        stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(fstat.st_mtime))
+        rotated = os.path.join(os.path.dirname(self.logservice), f'request-history_{stamp}.csv')
+        serial = 0
+        while os.path.exists(rotated):
+            serial += 1
+            rotated = os.path.join(os.path.dirname(self.logservice), f'request-history_{stamp}_{serial}.csv')
+        os.replace(self.logservice, rotated)
+        logger.info(f'request history is rotated to {rotated}')
+
+    def __flush(self, batch, sync=False):
+        if not batch and not sync:
+            return
         try:
-            with open(self.logservice, 'a', encoding='utf-8') as rlog:
-                rlog.write(record+'\n')
+            with open(f'{self.logservice}.lock', 'a+b') as flock:
+                lock_file(flock)
+                try:
+                    fstat = self.__need_rotation()
+                    if fstat is not None:
+                        self.__rotate(fstat)
+                    newfile = not os.path.exists(self.logservice)
+                    with open(self.logservice, 'a', encoding='utf-8') as rlog:
+                        if newfile:
+                            rlog.write(self.header+'\n')
+                        if batch:
+                            rlog.write('\n'.join(batch)+'\n')
+                        if sync:
+                            rlog.flush()
+                            os.fsync(rlog.fileno())
+                finally:
+                    unlock_file(flock)
         except Exception as e:
-            logger.error(f'RequestLog.append failed: {e}')
-            raise
+            logger.error(f'RequestLog.flush failed, {len(batch)} records lost: {e}')
+
+    def close(self):
+        """ flush pending records and fsync the history file """
+        if self.__closed:
+            return
+        self.__closed = True
+        self.__queue.put(None)
+        self.__thread.join(timeout=10)
 
 @lru_cache()
 def get_settings():
@@ -104,7 +245,8 @@ def get_settings():
 
 # init settings
 MYENV = get_settings()
-serviceHistory = RequestLog()
+serviceHistory = RequestLog(MYENV.REQUESTLOG_BATCH_SIZE, MYENV.REQUESTLOG_FLUSH_SECONDS,
+                            MYENV.REQUESTLOG_MAX_MB*1024*1024, MYENV.REQUESTLOG_ROTATE_DAILY)
 
 def init_logger(loglevel):
     """
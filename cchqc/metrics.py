@@ -0,0 +1,170 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.metrics
+  counters, gauges and histograms in Prometheus text exposition format
+"""
+import bisect
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def format_labels(labelnames, labelvalues, extra=None):
+    """ {name="value",...} of one sample """
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+class Counter:
+    """ monotonic counter, label values are positional """
+    kind = 'counter'
+    def __init__(self, name, doc, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = labelnames
+        self.__lock = threading.Lock()
+        self.__values = {}
+
+    def inc(self, *labelvalues, amount=1):
+        """ add amount to the sample of labelvalues """
+        with self.__lock:
+            self.__values[labelvalues] = self.__values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        """ [(name, labels, value), ...] """
+        with self.__lock:
+            values = dict(self.__values)
+        return [(self.name, format_labels(self.labelnames, k), v) for k, v in sorted(values.items())]
+
+class Gauge(Counter):
+    """ value that goes up and down """
+    kind = 'gauge'
+    def dec(self, *labelvalues, amount=1):
+        """ subtract amount from the sample of labelvalues """
+        self.inc(*labelvalues, amount=-amount)
+
+class Histogram:
+    """ cumulative histogram of observed values """
+    kind = 'histogram'
+    def __init__(self, name, doc, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.__lock = threading.Lock()
+        self.__values = {}
+
+    def observe(self, value, *labelvalues):
+        """ count value into its bucket """
+        i = bisect.bisect_left(self.buckets, value)
+        with self.__lock:
+            series = self.__values.get(labelvalues)
+            if series is None:
+                ## [count per bucket..., +Inf bucket, sum]
+                series = [0]*(len(self.buckets)+1) + [0.0]
+                self.__values[labelvalues] = series
+            series[i] += 1
+            series[-1] += value
+
+    def samples(self):
+        """ [(name, labels, value), ...] with cumulative buckets """
+        with self.__lock:
+            values = {k: list(v) for k, v in self.__values.items()}
+        ret = []
+        for labelvalues, series in sorted(values.items()):
+            cumulative = 0
+            for upper, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                le = '+Inf' if upper == float('inf') else repr(upper)
+                ret.append((f'{self.name}_bucket', format_labels(self.labelnames, labelvalues, ('le', le)), cumulative))
+            ret.append((f'{self.name}_sum', format_labels(self.labelnames, labelvalues), series[-1]))
+            ret.append((f'{self.name}_count', format_labels(self.labelnames, labelvalues), cumulative))
+        return ret
+
+class MetricsRegistry:
+    """ registered metrics and scrape-time collectors """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__metrics = []
+        self.__collectors = []
+
+    def register(self, metric):
+        """ add metric, returns it """
+        with self.__lock:
+            self.__metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """
+        add function called at scrape time
+          :param collector: returns [(name, kind, doc, [(labels dict, value), ...]), ...]
+        """
+        with self.__lock:
+            self.__collectors.append(collector)
+
+    def render(self):
+        """ all metrics in text exposition format """
+        with self.__lock:
+            metrics, collectors = list(self.__metrics), list(self.__collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.doc}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name}{labels} {value}' for name, labels, value in metric.samples())
+        for collector in collectors:
+            for name, kind, doc, samples in collector():
+                lines.append(f'# HELP {name} {doc}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{format_labels(tuple(labels), tuple(labels.values()))} {value}')
+        return '\n'.join(lines) + '\n'
+
+qcMetrics = MetricsRegistry()
+httpRequestsTotal = qcMetrics.register(Counter('qcapi_http_requests_total', 'HTTP requests by route and status', ('method', 'route', 'status')))
+httpRequestSeconds = qcMetrics.register(Histogram('qcapi_http_request_seconds', 'HTTP request latency by route and status', ('method', 'route', 'status')))
+httpInflight = qcMetrics.register(Gauge('qcapi_http_requests_inflight', 'HTTP requests in progress'))
+storageProbesTotal = qcMetrics.register(Counter('qcapi_storage_probes_total', 'image storage probes by result', ('result',)))
+storageProbeSeconds = qcMetrics.register(Histogram('qcapi_storage_probe_seconds', 'image storage probe latency'))
+aixParsesTotal = qcMetrics.register(Counter('qcapi_aix_parses_total', '.aix files parsed by result', ('result',)))
+aixParseSeconds = qcMetrics.register(Histogram('qcapi_aix_parse_seconds', '.aix parse time'))
+aixBytesDecompressed = qcMetrics.register(Counter('qcapi_aix_bytes_decompressed_total', 'decompressed bytes of parsed .aix'))
+aixDecompressSeconds = qcMetrics.register(Histogram('qcapi_aix_decompress_seconds', '.aix read and decompression time'))
+aixSidecarTotal = qcMetrics.register(Counter('qcapi_aix_sidecar_total', 'sidecar summary lookups and writes by result', ('result',)))
+singleflightTotal = qcMetrics.register(Counter('qcapi_singleflight_total', 'slide resolutions and .aix evaluations run or coalesced into a running one', ('flight', 'result')))
+singleflightInflight = qcMetrics.register(Gauge('qcapi_singleflight_inflight', 'running single-flight calls', ('flight',)))
+
+class MetricsMiddleware:
+    """ ASGI middleware counting requests, latency and in-flight requests """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+        httpInflight.inc()
+        procts = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - procts
+            httpInflight.dec()
+            ## only matched routes are labeled by path, keeps the number of series bounded,
+            ## scope['route'] of an included router may not carry the router prefix
+            route = getattr(scope.get('route'), 'path', None)
+            if route is None:
+                path = 'unmatched'
+            elif '{' in route:
+                path = route
+            else:
+                path = scope['path']
+            labelvalues = (scope['method'], path, str(status[0]))
+            httpRequestsTotal.inc(*labelvalues)
+            httpRequestSeconds.observe(elapsed, *labelvalues)
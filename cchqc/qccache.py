@@ -0,0 +1,105 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.qccache
+  bounded LRU cache of parsed QC results keyed by .aix path, mtime and size
+"""
+import threading
+from collections import OrderedDict
+from loguru import logger
+from cchqc.config import MYENV
+from cchqc.metrics import qcMetrics
+
+class QCResultCache:
+    """ LRU cache bounded by number of entries and estimated bytes """
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.__lock = threading.Lock()
+        self.__entries = OrderedDict()
+        self.__bytes = 0
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__invalidations = 0
+
+    def get(self, aixfile, mtime, size):
+        """
+        get cached summary, None if missing or the .aix was changed
+          :param aixfile: .aix filename
+          :param mtime: current st_mtime of .aix
+          :param size: current st_size of .aix
+        """
+        with self.__lock:
+            entry = self.__entries.get(aixfile)
+            if entry is None:
+                self.__misses += 1
+                return None
+            if entry[0] != mtime or entry[1] != size:
+                ## .aix was re-written since it was cached
+                self.__drop(aixfile)
+                self.__invalidations += 1
+                self.__misses += 1
+                return None
+            self.__entries.move_to_end(aixfile)
+            self.__hits += 1
+            return entry[2]
+
+    def put(self, aixfile, mtime, size, summary, nbytes):
+        """
+        cache summary of .aix, evict least recently used entries over budget
+          :param aixfile: .aix filename
+          :param mtime: st_mtime of parsed .aix
+          :param size: st_size of parsed .aix
+          :param summary: parsed QC summary
+          :param nbytes: estimated memory size of summary
+        """
+        if nbytes > self.max_bytes:
+            logger.debug(f'{aixfile} is too large to cache ({nbytes} bytes)')
+            return
+        with self.__lock:
+            if aixfile in self.__entries:
+                self.__drop(aixfile)
+            self.__entries[aixfile] = (mtime, size, summary, nbytes)
+            self.__bytes += nbytes
+            while len(self.__entries) > self.max_entries or self.__bytes > self.max_bytes:
+                oldest = next(iter(self.__entries))
+                self.__drop(oldest)
+                self.__evictions += 1
+
+    def __drop(self, aixfile):
+        entry = self.__entries.pop(aixfile)
+        self.__bytes -= entry[3]
+
+    def clear(self):
+        """ drop all cached entries """
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def stats(self):
+        """ hit/miss/eviction counters and current usage """
+        with self.__lock:
+            return {
+                'entries': len(self.__entries),
+                'bytes': self.__bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'evictions': self.__evictions,
+                'invalidations': self.__invalidations
+            }
+
+qcResultCache = QCResultCache(MYENV.QCCACHE_MAX_ENTRIES, MYENV.QCCACHE_MAX_MB*1024*1024)
+
+def collect_cache_metrics():
+    """ QC result cache counters for /metrics """
+    stats = qcResultCache.stats()
+    return [
+        ('qcapi_qccache_hits_total', 'counter', 'QC result cache hits', [({}, stats['hits'])]),
+        ('qcapi_qccache_misses_total', 'counter', 'QC result cache misses', [({}, stats['misses'])]),
+        ('qcapi_qccache_evictions_total', 'counter', 'QC result cache evictions', [({}, stats['evictions'])]),
+        ('qcapi_qccache_invalidations_total', 'counter', 'QC result cache entries dropped for changed .aix', [({}, stats['invalidations'])]),
+        ('qcapi_qccache_entries', 'gauge', 'QC result cache entries', [({}, stats['entries'])]),
+        ('qcapi_qccache_bytes', 'gauge', 'QC result cache estimated bytes', [({}, stats['bytes'])])
+    ]
+
+qcMetrics.add_collector(collect_cache_metrics)
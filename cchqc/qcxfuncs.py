@@ -3,70 +3,84 @@
 """
 import os
 import glob
-import gzip
 import csv
 import json
+import base64
+from datetime import datetime
 from pathlib import Path
 import platform
 import subprocess
 import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat, islice
 from loguru import logger
-import win32wnet
-import pywintypes
 from cchqc.config import MYENV
+from cchqc.storagemonitor import storageMonitor
+from cchqc.slideindex import slideIndex, SlideListView
+from cchqc.aixio import AixReader, read_aix_bytes
+from cchqc.aixstream import stream_aix_cells, iter_aix_events
+from cchqc.cellsummary import CellSummary, trait_matrix, count_traits
+from cchqc.celltable import CellTable
+from cchqc.sidecar import SidecarSummary, read_sidecar, write_sidecar, threshold_step
+from cchqc.singleflight import SingleFlight
+from cchqc.sharedstate import sharedState
+from cchqc.summarystore import get_summary_store
+from cchqc.qccache import qcResultCache
+from cchqc.metrics import aixParsesTotal, aixParseSeconds
 
 ## --------------------------------------------------------------
 ##  global preset working folders
 ## --------------------------------------------------------------
 class QCmagic:
-    """ magic number for QC criteria """
-    def __init__(self, magic_s, magic_a):
+    """ magic number for QC criteria, kept in SharedState if given so all API workers see the same """
+    def __init__(self, magic_s, magic_a, shared=None):
         self.__magic_suspicious = magic_s
         self.__magic_atypical = magic_a
         self.__magic_threshold = 0.4
+        self.__changed_at = time.time()
+        self.__shared = shared
     def setqc_magic_number(self, s, a):
         """ set magic number for both suspicious cell and atypical cell """
+        if self.__shared:
+            self.__shared.set_criteria(magic_s=s, magic_a=a, changed_at=time.time())
+            return
         self.__magic_suspicious = s
         self.__magic_atypical = a
+        self.__changed_at = time.time()
     def getqc_magic_s(self):
         """ get suspicious magic number """
+        if self.__shared:
+            return self.__shared.get_criteria('magic_s')
         return self.__magic_suspicious
     def getqc_magic_a(self):
         """ get atypical magic number """
+        if self.__shared:
+            return self.__shared.get_criteria('magic_a')
         return self.__magic_atypical
     def set_score_threshold(self, tagscore):
         """ set score threshold """
+        if self.__shared:
+            self.__shared.set_criteria(threshold=tagscore, changed_at=time.time())
+            return
         self.__magic_threshold = tagscore
+        self.__changed_at = time.time()
     def get_score_threshold(self):
         """ get score threshold """
+        if self.__shared:
+            return self.__shared.get_criteria('threshold')
         return self.__magic_threshold
+    def criteria_version(self):
+        """ version of current criteria, equal whenever the criteria are equal """
+        return f'{self.getqc_magic_s()}/{self.getqc_magic_a()}/{self.get_score_threshold()!r}'
+    def criteria_changed_at(self):
+        """ timestamp of the last change of criteria, service start if never changed """
+        if self.__shared:
+            return self.__shared.get_criteria('changed_at')
+        return self.__changed_at
 
-qcMAGIC = QCmagic(6, 8)
-
-def is_net_connection_alive(drivehome):
-    """ misc tools ♚
-    is NET drives still connected?? re-connect once if lost connection
-      :param drivehome: path in remote drive
-    """
-    reconn = False
-    driveletter = drivehome[:2]
-    if not os.path.exists(driveletter):
-        reconn = True
-    else:
-        if not os.path.exists(drivehome):
-            logger.trace(f'{driveletter} is connected, but not connected to {drivehome}, need to re-connect')
-            win32wnet.WNetCancelConnection2(driveletter, 1, True)
-            reconn = True
-    if reconn:  ## reconnect remote Windows computer
-        ## try re-connect
-        try:
-            win32wnet.WNetAddConnection2(0, driveletter, MYENV.DRIVEY_URL, None, MYENV.Y_USERNAME, MYENV.Y_PASSWORD)
-        except pywintypes.error as e:
-            logger.error(f'connection error: {e} ({drivehome})')
-        else:
-            logger.info(f'{drivehome} is re-connected to {driveletter}')
-    #
-    return os.path.exists(drivehome)
+qcMAGIC = QCmagic(6, 8, sharedState)
+resolveFlight = SingleFlight('resolve')
+evaluateFlight = SingleFlight('evaluate')
 
 def get_st_mtime(slide_type, slide_id):
     """ misc tools ♛
@@ -74,6 +88,10 @@ def get_st_mtime(slide_type, slide_id):
       :param slide_type: urine or thyroid
       :param slide_id: slide id
     """
+    sindex = slideIndex.get_index(slide_type)
+    entry = sindex.lookup(os.path.splitext(slide_id)[0]) if sindex else None
+    if entry and entry.has_med:
+        return entry.med_mtime
     medfile = os.path.join(MYENV.DRIVEY_HOME, slide_type.lower(), slide_id)
     fstat = os.stat(medfile)
     return fstat.st_mtime
@@ -107,52 +125,123 @@ def get_current_magic_number():
 
 def get_metadata_from_aix(aixfile):
     """ core tools ♠︎: retrieve .aix """
-    gaix = gzip.GzipFile(mode='rb', fileobj=open(aixfile, 'rb'))
-    aixdata = gaix.read()
-    gaix.close()
-    aixjson = json.loads(aixdata)
+    aixjson = json.loads(read_aix_bytes(aixfile))
     ## here is for decart version 2.x.x
     aixinfo = aixjson.get('model', {})
     aixcell = aixjson.get('graph', {})
     return aixinfo, aixcell
 
+def iter_cell_nodes(aixcell):
+    """ walk graph[*][1].children[*][1] of parsed .aix, yields (name, segments, data) """
+    for cell in aixcell:
+        cbody = cell[1].get('children', '')
+        if not cbody:
+            continue
+        for kkbody in cbody:
+            yield kkbody[1].get('name'), kkbody[1].get('segments'), kkbody[1].get('data', '')
+
+def category_names(aixinfo):
+    """ names of cellscount entries of the model of .aix, empty for unsupported models """
+    thismodel = aixinfo.get('Model')
+    if thismodel == 'AIxURO':
+        return ['background', 'nuclei', 'suspicious', 'atypical', 'benign',
+                'other', 'tissue', 'degenerated']
+    if thismodel == 'AIxTHY':
+        if aixinfo.get('ModelVersion', '')[:6] in ['2025.2']:
+            return ['background', 'follicular', 'oncocytic', 'epithelioid', 'lymphocytes',
+                    'histiocytes', 'colloid', 'unknown']
+        return ['background', 'follicular', 'hurthle', 'histiocytes', 'lymphocytes',
+                'colloid', 'multinucleatedGaint', 'psammomaBodies']
+    return []
+
+def collect_target_cells(aixfile, aixinfo, cellnodes, with_segments=True):
+    """ core tools ♣︎:
+    count categories and collect target cells into CellTable
+      :param aixfile: .aix filename, for logging
+      :param aixinfo: model information of .aix
+      :param cellnodes: iterable of (name, segments, data) of cells
+      :param with_segments: keep segments of each cell
+    """
+    thismodel = aixinfo.get('Model')
+    categories = category_names(aixinfo)
+    if thismodel == 'AIxURO':
+        nulltags = [0.0 for _ in range(14)]
+        celltable = CellTable.from_cell_nodes(cellnodes, nulltags, True, with_segments)
+        cellscount, unknown = celltable.category_counts(len(categories))
+        for category in unknown:
+            logger.error(f'{os.path.basename(aixfile)} has unknown cell category (ID: {category})')
+        ## whatif too old version of AIxURO model ???
+        if 'ModelArchitect' in aixinfo:
+            ## decart 2.0.x and decart 2.1.x
+            num_nuclei, num_atypical, num_benign = cellscount[3], cellscount[1], cellscount[0]
+            cellscount[0], cellscount[4] = 0, num_benign
+            cellscount[1], cellscount[3] = num_nuclei, num_atypical
+            logger.warning(f"{os.path.basename(aixfile)} was inference with {aixinfo.get('Model')}_{aixinfo.get('ModelVersion')}")
+    elif thismodel == 'AIxTHY':
+        nulltags = [0.0 for _ in range(20)]
+        celltable = CellTable.from_cell_nodes(cellnodes, nulltags, False, with_segments)
+        cellscount, unknown = celltable.category_counts(len(categories))
+        for category in unknown:
+            logger.error(f'{os.path.basename(aixfile)} has unknown cell category (ID: {category})')
+    else:
+        celltable = CellTable.from_cell_nodes([], [], False, with_segments)
+        cellscount = []
+        logger.warning(f'does not support {thismodel}')
+    return celltable, cellscount
+
 def get_target_cells_from_aix(aixfile):
-    """ core tools ♣︎: 
+    """ core tools ♣︎:
     parse .aix
       :param aixfile: .aix filename for parsing
     """
     aixinfo, aixcell = get_metadata_from_aix(aixfile)
+    cellslist, cellscount = collect_target_cells(aixfile, aixinfo, iter_cell_nodes(aixcell))
+    return aixinfo, cellslist, cellscount
+
+def stream_target_cells_from_aix(aixfile, with_segments=False):
+    """ core tools ♣︎:
+    parse .aix with streaming parser, same result as get_target_cells_from_aix()
+    but segments are skipped (None) unless with_segments is True
+      :param aixfile: .aix filename for parsing
+      :param with_segments: decode segments of each cell
+    """
+    aixinfo, cellnodes = stream_aix_cells(aixfile, with_segments)
+    cellslist, cellscount = collect_target_cells(aixfile, aixinfo, cellnodes, with_segments)
+    return aixinfo, cellslist, cellscount
+
+def summarize_target_cells_from_aix(aixfile):
+    """ core tools ♦︎:
+    parse .aix in summary mode, only category counts and thyroid trait scores
+    are kept, no per-cell dict and no sorting
+      :param aixfile: .aix filename for parsing
+    """
+    aixinfo = None
+    cellscount = [0 for _ in range(8)]
+    traitcats, traitrows = [], []
+    unknown = set()
+    with AixReader(aixfile, chunked=True) as gaix:
+        for event, value in iter_aix_events(gaix):
+            if event == 'model':
+                aixinfo = value
+                continue
+            cdata = value[2]
+            if not cdata:
+                continue
+            category = cdata.get('category', -1)
+            if 0 <= category < len(cellscount):
+                cellscount[category] += 1
+            else:
+                unknown.add(category)
+            ## model may come after graph in .aix, keep traits until model is known
+            if aixinfo is None or aixinfo.get('Model') == 'AIxTHY':
+                traitcats.append(category)
+                traitrows.append(cdata.get('tags'))
+    aixinfo = aixinfo if aixinfo else {}
+    for category in unknown:
+        logger.error(f'{os.path.basename(aixfile)} has unknown cell category (ID: {category})')
     thismodel = aixinfo.get('Model')
-    allcells = []
     if thismodel == 'AIxURO':
-        categories = ['background', 'nuclei', 'suspicious', 'atypical', 'benign',
-                      'other', 'tissue', 'degenerated']
-        cellscount = [0 for _ in range(len(categories))]
-        nulltags = [0.0 for _ in range(14)]
-        for cell in aixcell:
-            thiscell = {}
-            cbody = cell[1].get('children', '')
-            if cbody == '':
-                continue
-            for kkbody in cbody:
-                cdata = kkbody[1].get('data', '')
-                if not cdata:
-                    continue
-                category = cdata.get('category', -1)
-                if category >= 0 and category <= len(categories):
-                    cellscount[category] += 1
-                else:
-                    logger.error(f'{os.path.basename(aixfile)} has unknown cell category (ID: {category})')
-                thiscell['cellname'] = kkbody[1]['name']
-                thiscell['category'] = category
-                thiscell['segments'] = kkbody[1]['segments']
-                thiscell['ncratio'] = cdata.get('ncRatio', 0.0)
-                thiscell['probability'] = cdata.get('prob', 0.0)
-                thiscell['score'] = cdata.get('score', 0.0)
-                thiscell['traits'] = cdata.get('tags', nulltags)
-                allcells.append(thiscell)
-        cellslist = sorted(allcells, key=lambda x: (-x['category'], x['score']), reverse=True)
-        ## whatif too old version of AIxURO model ???
+        traitcats, traitrows = [], []
         if 'ModelArchitect' in aixinfo:
             ## decart 2.0.x and decart 2.1.x
             num_nuclei, num_atypical, num_benign = cellscount[3], cellscount[1], cellscount[0]
@@ -160,45 +249,17 @@ def get_target_cells_from_aix(aixfile):
             cellscount[1], cellscount[3] = num_nuclei, num_atypical
             logger.warning(f"{os.path.basename(aixfile)} was inference with {aixinfo.get('Model')}_{aixinfo.get('ModelVersion')}")
     elif thismodel == 'AIxTHY':
-        if aixinfo['ModelVersion'][:6] in ['2025.2']:
-            categories = ['background', 'follicular', 'oncocytic', 'epithelioid', 'lymphocytes',
-                          'histiocytes', 'colloid', 'unknown']
-        else:
-            categories = ['background', 'follicular', 'hurthle', 'histiocytes', 'lymphocytes',
-                          'colloid', 'multinucleatedGaint', 'psammomaBodies']
-        cellscount = [0 for _ in range(len(categories))]
         nulltags = [0.0 for _ in range(20)]
-        for jjcell in aixcell:
-            thiscell = {}
-            cbody = jjcell[1].get('children', '')
-            if not cbody:
-                continue
-            for kkbody in cbody:
-                cdata = kkbody[1].get('data', '')
-                if not cdata:
-                    continue
-                category = cdata.get('category', -1)
-                if category >= 0 and category <= len(categories):
-                    cellscount[category] += 1
-                else:
-                    logger.error(f'{os.path.basename(aixfile)} has unknown cell category (ID: {category})')
-                thiscell['cellname'] = kkbody['name']
-                thiscell['category'] = category
-                thiscell['segments'] = kkbody[1]['segments']
-                thiscell['probability'] = cdata.get('prob', 0.0)
-                thiscell['score'] = cdata.get('score', 0.0)
-                thiscell['traits'] = cdata.get('tags', nulltags)
-                allcells.append(thiscell)
-        cellslist = sorted(allcells, key=lambda x: (-x['category'], x['score']), reverse=True)
+        traitrows = [nulltags if tags is None else tags for tags in traitrows]
     else:
-        cellslist = []
-        logger.warning('does not support {thismodel}')
-    return aixinfo, cellslist, cellscount
+        cellscount, traitcats, traitrows = [], [], []
+        logger.warning(f'does not support {thismodel}')
+    return CellSummary(aixinfo, cellscount, traitcats, traitrows)
 
 def count_number_of_thyroid_traits(tclist, max_traits, threshold=None):
     """ core tools ♥︎: 
     count thyroid traits
-      :param tclist: cell list from .aix file
+      :param tclist: CellTable or cell list from .aix file
       :param max_traits:maximum number of traits
       :param threshold: criteria for counting trait
     """
@@ -209,40 +270,235 @@ def count_number_of_thyroid_traits(tclist, max_traits, threshold=None):
     if howmany == 0:
         logger.error('empty cell list in countNumberOfTHYtraits()')
         return traitcount
-    for i in range(howmany):
-        celltraits = tclist[i]['traits']
-        for j in range(len(tclist[i]['traits'])):
-            if celltraits[j] >= threshold:
-                traitcount[j] += 1
-    return traitcount
+    if isinstance(tclist, CellTable):
+        return count_traits(tclist.traits, max_traits, threshold)
+    return count_traits(trait_matrix([x['traits'] for x in tclist]), max_traits, threshold)
+
+def load_qc_summary(aixfile, threshold=None, cache=True):
+    """
+    get summary of .aix from cache, shared state of API workers or its sidecar, parse .aix only if none has it
+      :param aixfile: .aix filename
+      :param threshold: trait score threshold to be counted, None for any
+      :param cache: False to not fill QC result cache or shared state, they are left to slides users query,
+                    e.g. for bulk syncs and exports
+    sidecar keeps trait counts of thresholds on the 0.01 grid, others need CellSummary
+    concurrent calls of the same .aix share one lookup and parse, waiters get its summary or error
+    """
+    fstat = os.stat(aixfile)
+    summary = qcResultCache.get(aixfile, fstat.st_mtime, fstat.st_size) if cache else None
+    if summary is not None and (not isinstance(summary, SidecarSummary) or summary.supports(threshold)):
+        return summary
+    kind = 'grid' if threshold is None or threshold_step(threshold) is not None else 'cells'
+    return evaluateFlight.do((aixfile, fstat.st_mtime, fstat.st_size, kind, cache), load_uncached_summary,
+                             aixfile, fstat, threshold, summary, cache)
+
+def load_uncached_summary(aixfile, fstat, threshold, summary=None, cache=True):
+    """
+    shared state, sidecar or parse part of load_qc_summary()
+      :param fstat: os.stat() of .aix
+      :param summary: cached SidecarSummary which does not support threshold, None if not cached
+      :param cache: put the summary into QC result cache and shared state
+    """
+    if summary is None and sharedState:
+        ## parsed by another worker
+        summary = sharedState.get_summary(aixfile, fstat.st_mtime, fstat.st_size)
+        if summary is not None:
+            if cache:
+                qcResultCache.put(aixfile, fstat.st_mtime, fstat.st_size, summary, summary.nbytes())
+            if summary.supports(threshold):
+                return summary
+    if summary is None and MYENV.SIDECAR_ENABLED:
+        summary = read_sidecar(aixfile, fstat.st_mtime, fstat.st_size)
+        if summary is not None:
+            if cache:
+                qcResultCache.put(aixfile, fstat.st_mtime, fstat.st_size, summary, summary.nbytes())
+            if cache and sharedState:
+                sharedState.put_summary(aixfile, fstat.st_mtime, fstat.st_size, summary)
+            if summary.supports(threshold):
+                return summary
+    sidecar_found = summary is not None
+    procts = time.perf_counter()
+    try:
+        summary = summarize_target_cells_from_aix(aixfile)
+    except Exception:
+        aixParsesTotal.inc('failed')
+        raise
+    aixParsesTotal.inc('ok')
+    aixParseSeconds.observe(time.perf_counter()-procts)
+    if cache:
+        qcResultCache.put(aixfile, fstat.st_mtime, fstat.st_size, summary, summary.nbytes())
+    if not sidecar_found and ((cache and sharedState) or MYENV.SIDECAR_ENABLED):
+        sidecar = SidecarSummary.from_cell_summary(summary)
+        if cache and sharedState:
+            sharedState.put_summary(aixfile, fstat.st_mtime, fstat.st_size, sidecar)
+        if MYENV.SIDECAR_ENABLED:
+            write_sidecar(aixfile, fstat.st_mtime, fstat.st_size, sidecar)
+    return summary
+
+def get_qc_cache_stats():
+    """ hit/miss/eviction counters of QC result cache """
+    return {'code': 0, 'data': qcResultCache.stats()}
 
 def query_all_slide_name(slide_type):
     """
     query slidename of all analyzed images
       :param slide_type: urine or thyroid
     """
-    if not is_net_connection_alive(MYENV.DRIVEY_HOME):
+    if not storageMonitor.is_alive():
         return {'code': -1, 'data': 'lost connection to image storage'}
-    folder = os.path.join(MYENV.DRIVEY_HOME, slide_type.lower())
     logger.trace(f'starting query_all_slide_name({slide_type})...')
-    medfiles = glob.glob(os.path.join(folder, '*.med'))
-    namelist = []
-    for _, fmed in enumerate(medfiles):
-        faix = fmed.replace('.med', '.aix')
-        #logger.trace(f'{fmed} <=> {faix}')
-        if os.path.exists(faix):
-            namelist.append(os.path.splitext(os.path.basename(fmed))[0])
-    logger.info(f'found {len(namelist)} {slide_type} slides in {folder}')
+    sindex = slideIndex.get_index(slide_type)
+    if sindex is None:
+        return {'code': 0, 'data': []}
+    namelist = sindex.analyzed_slides()
+    logger.info(f'found {len(namelist)} {slide_type} slides in {sindex.folder}')
     return {'code': 0, 'data': namelist}
 
-def query_qcresult_for_slide(slide_type, slide_id, out_ver):
+def parse_scan_time(value):
+    """ timestamp of ISO date/datetime in local time, None if value is empty """
+    if not value:
+        return None
+    return datetime.fromisoformat(value).timestamp()
+
+def encode_slide_cursor(order_by, descending, entry):
+    """ opaque cursor after entry, valid across re-scans since it keeps the sort key, not a position """
+    key = SlideListView.sort_key(order_by, entry)
+    raw = json.dumps([order_by, descending, key], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_slide_cursor(cursor, order_by, descending):
+    """ sort key of cursor, ValueError if it is broken or of another order """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '='*(-len(cursor) % 4))
+        corder, cdescending, key = json.loads(raw)
+        if corder == order_by and cdescending == descending:
+            return str(key) if order_by == 'name' else (float(key[0]), str(key[1]))
+    except (ValueError, TypeError, IndexError, KeyError) as e:
+        raise ValueError(f'invalid cursor: {e}') from e
+    raise ValueError('cursor is of another order_by/descending')
+
+def slide_list_item(entry):
+    """ slide of paged and streamed listing """
+    return {'slidename': entry.slideid, 'scanned_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.med_mtime))}
+
+def select_slides(slide_type, prefix=None, scanned_from=None, scanned_to=None, order_by='name', descending=False, cursor=None):
+    """
+    analyzed slides from the sorted view of the slide index, nothing is read from image storage
+      :param slide_type: urine or thyroid
+      :param prefix: slide name prefix
+      :param scanned_from: .med mtime at or after this ISO date/datetime
+      :param scanned_to: .med mtime before this ISO date/datetime
+      :param order_by: name or scanned
+      :param descending: reverse order
+      :param cursor: next_cursor of the previous page
+    data is an iterator of SlideEntry, code -4 for invalid parameters
+    """
+    if not storageMonitor.is_alive():
+        return {'code': -1, 'data': 'lost connection to image storage'}
+    if order_by not in SlideListView.ORDERS:
+        return {'code': -4, 'data': f'can not order by {order_by}, use one of {SlideListView.ORDERS}'}
+    try:
+        mtime_from, mtime_to = parse_scan_time(scanned_from), parse_scan_time(scanned_to)
+        after = decode_slide_cursor(cursor, order_by, descending) if cursor else None
+    except ValueError as e:
+        return {'code': -4, 'data': str(e)}
+    sindex = slideIndex.get_index(slide_type)
+    if sindex is None:
+        return {'code': 0, 'data': iter(())}
+    view = sindex.list_view()
+    return {'code': 0, 'data': view.iter_slides(order_by, descending, after, prefix, mtime_from, mtime_to)}
+
+def query_slide_page(slide_type, limit, **filters):
+    """
+    one page of analyzed slides, next_cursor is None on the last page
+      :param slide_type: urine or thyroid
+      :param limit: slides per page, up to ALLSLIDES_MAX_PAGE
+      :param filters: parameters of select_slides()
+    """
+    if not 1 <= limit <= MYENV.ALLSLIDES_MAX_PAGE:
+        return {'code': -4, 'data': f'limit must be 1 to {MYENV.ALLSLIDES_MAX_PAGE}'}
+    err = select_slides(slide_type, **filters)
+    if err['code'] < 0:
+        return err
+    ## one more slide tells if there is a next page
+    rows = list(islice(err['data'], limit+1))
+    order_by, descending = filters.get('order_by', 'name'), filters.get('descending', False)
+    next_cursor = encode_slide_cursor(order_by, descending, rows[limit-1]) if len(rows) > limit else None
+    return {'code': 0, 'data': {'slides': [slide_list_item(x) for x in rows[:limit]], 'next_cursor': next_cursor}}
+
+def query_slide_listing(slide_type, prefix=None, scanned_from=None, scanned_to=None, order_by=None, descending=False,
+                        cursor=None, limit=None):
+    """
+    analyzed slides of /allslides, parameters as select_slides()
+      :param limit: slides per page
+    data is a page {'slides', 'next_cursor'} if limit or cursor is given, else a list of slide names,
+    in the order of the folder scan (as before pagination) if neither filter nor order is given
+    """
+    filters = {'prefix': prefix, 'scanned_from': scanned_from, 'scanned_to': scanned_to,
+               'order_by': order_by or 'name', 'descending': descending, 'cursor': cursor}
+    if limit is not None or cursor is not None:
+        return query_slide_page(slide_type, limit if limit is not None else MYENV.ALLSLIDES_PAGE_SIZE, **filters)
+    if prefix is None and scanned_from is None and scanned_to is None and order_by is None and not descending:
+        return query_all_slide_name(slide_type)
+    err = select_slides(slide_type, **filters)
+    if err['code'] < 0:
+        return err
+    return {'code': 0, 'data': [x.slideid for x in err['data']]}
+
+def iter_slide_lines(slides, limit=None, summary=None, batch=1000):
+    """
+    NDJSON lines of slides, joined in batches of lines
+      :param slides: iterator of SlideEntry of select_slides()
+      :param limit: maximum slides, None for all
+      :param summary: dict whose 'slides' is counted up
+    """
+    lines = []
+    for entry in islice(slides, limit):
+        lines.append(json.dumps(slide_list_item(entry)))
+        if len(lines) >= batch:
+            yield '\n'.join(lines) + '\n'
+            if summary is not None:
+                summary['slides'] += len(lines)
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+        if summary is not None:
+            summary['slides'] += len(lines)
+
+def rescan_slide_index(slide_type=None):
+    """
+    force re-scan of the slide index
+      :param slide_type: urine or thyroid, None for all slide types
+    """
+    if not storageMonitor.is_alive():
+        return {'code': -1, 'data': 'lost connection to image storage'}
+    return {'code': 0, 'data': slideIndex.rescan(slide_type)}
+
+def find_latest_slide(slide_type, slide_id):
+    """
+    find the latest scanned slide whose name contains slide_id, None if not found
+      :param slide_type: urine or thyroid
+      :param slide_id: slide id (pathology id) for querying
+    concurrent queries of the same slide_id share one resolution
+    """
+    return resolveFlight.do((slide_type.lower(), slide_id), resolve_latest_slide, slide_type, slide_id)
+
+def resolve_latest_slide(slide_type, slide_id):
+    """ find_latest_slide() without coalescing """
+    sindex = slideIndex.get_index(slide_type)
+    if sindex is None:
+        return None
+    return sindex.find_latest(slide_id)
+
+def query_qcresult_for_slide(slide_type, slide_id, out_ver, check_connection=True):
     """
     query analyzed metadata for QC
       :param slide_type: urine or thyroid
       :param slide_id: slide id
       :param out_ver: data format version for return data
+      :param check_connection: False if caller has just checked image storage
     """
-    if not is_net_connection_alive(MYENV.DRIVEY_HOME):
+    if check_connection and not storageMonitor.is_alive():
         return {'code': -1, 'data': {}}
     ## magic number for urine criteria
     magic_suspicious = qcMAGIC.getqc_magic_s()
@@ -259,12 +515,15 @@ def query_qcresult_for_slide(slide_type, slide_id, out_ver):
     logger.trace(f'starting queryQCresult4slide({slide_type}, {slide_id})...')
     ##
     medfile = os.path.join(aixmeta['medpath'], aixmeta['medname'])
-    if not os.path.exists(medfile):
+    sindex = slideIndex.get_index(slide_type)
+    entry = sindex.lookup(slide_id) if sindex else None
+    if entry is None or not (entry.has_med and entry.has_aix):
         logger.error(f'{medfile} does not exist')
         return {'code': -2, 'data': {}}
 
-    aixfile = medfile.replace('.med', '.aix')
-    aixinfo, cellslist, cellscount = get_target_cells_from_aix(aixfile)
+    ## read through the indexed folder, the same cache key as slide watcher warm-ups
+    summary = load_qc_summary(sindex.slide_file(slide_id), magic_threshold)
+    aixinfo, cellscount = summary.aixinfo, summary.cellscount
     signals = ['red', 'green']
     aixmeta['signal'] = [signals[1] for _ in range(4)] if out_ver == 1 else [signals[1] for _ in range(2)]
     if aixinfo['Model'] == 'AIxURO':
@@ -306,13 +565,13 @@ def query_qcresult_for_slide(slide_type, slide_id, out_ver):
         aixmeta['rawdata'] += f'Histiocytes: {cellscount[3]}; Lymphocytes: {cellscount[4]}; '
         aixmeta['rawdata'] += f'Colloid: {cellscount[5]}'
         num_of_tags = 20 if aixinfo['ModelVersion'][:6] in ['2025.2'] else 8
-        traits = count_number_of_thyroid_traits(cellslist, num_of_tags)
+        traits = summary.trait_counts(num_of_tags, magic_threshold)
         if '2025.2' in aixinfo['ModelVersion']:
-            trait_count = len(list(filter(lambda x: x['traits'][8] >= magic_threshold and x['category'] == 1, cellslist)))
+            trait_count = summary.count_trait_in_category(8, 1, magic_threshold)
             traits_criteria = trait_count > 0
             traitcount = f'Microfollicles: {traits[2]}'
         elif '2024.2' in aixinfo['ModelVersion']:
-            trait_count = len(list(filter(lambda x: x['traits'][4] >= magic_threshold and x['category'] == 1, cellslist)))
+            trait_count = summary.count_trait_in_category(4, 1, magic_threshold)
             traits_criteria = trait_count > 0
             traitcount = f'Microfollicles: {traits[0]}; Papillae: {traits[1]}; Pale nuclei: {traits[2]}; '
             traitcount += f'Grooving: {traits[3]}; Pseudoinclusions: {traits[4]}; '
@@ -374,9 +633,82 @@ def open_med_with_cytoinsights(medfname):
             subprocess.Popen(['start', '', medfname], shell=True)
     return err
 
+def summarize_one_aix(aixfile, threshold):
+    """
+    worker of summarize_cell_counts_to_csv(): summary record of one .aix
+      :param aixfile: .aix filename
+      :param threshold: score threshold for counting thyroid traits
+    returns (aixfile, record, error message)
+    """
+    try:
+        ## a bulk export must not evict slides users query
+        summary = load_qc_summary(aixfile, threshold, cache=False)
+        modelinfo = summary.aixinfo
+        if not category_names(modelinfo):
+            return aixfile, None, f"unsupported model {modelinfo.get('Model')}"
+        record = {
+            'path': aixfile,
+            'model': modelinfo.get('Model'),
+            'version': modelinfo.get('ModelVersion'),
+            'cellscount': summary.cellscount,
+            'threshold': threshold,
+            'traitcount': []
+        }
+        if record['model'] == 'AIxTHY':
+            num_of_tags = 20 if record['version'][:6] in ['2025.2'] else 8
+            record['traitcount'] = summary.trait_counts(num_of_tags, threshold)
+    except Exception as e:
+        return aixfile, None, f'{type(e).__name__}: {e}'
+    return aixfile, record, ''
+
+def summary_csv_row(record, is_urine):
+    """
+    CSV row of summary record
+      :param record: summary record of .aix
+      :param is_urine: True for urine fields, False for thyroid fields
+    """
+    cellscount = record['cellscount']
+    thisrow = {}
+    thisrow['slide_id'] = os.path.splitext(os.path.basename(record['path']))[0]
+    if is_urine:
+        thisrow['suspicious'] = cellscount[2]
+        thisrow['atypical']   = cellscount[3]
+    elif record['version'][:6] in ['2025.2']:
+        thisrow['follicular']    = cellscount[1]
+        thisrow['hurthle']       = cellscount[2]
+        thisrow['histiocytes']   = cellscount[5]
+        thisrow['lymphocytes']   = cellscount[4]
+        thisrow['colloid']       = cellscount[6]
+    else:
+        thisrow['follicular']    = cellscount[1]
+        thisrow['hurthle']       = cellscount[2]
+        thisrow['histiocytes']   = cellscount[3]
+        thisrow['lymphocytes']   = cellscount[4]
+        thisrow['colloid']       = cellscount[5]
+    return thisrow
+
+def list_aix_files(aixpath):
+    """
+    list .aix with size and mtime in one directory read
+      :param aixpath: folder contains .aix files
+    """
+    aixstat = {}
+    with os.scandir(aixpath) as entries:
+        for entry in entries:
+            if os.path.splitext(entry.name)[1].lower() != '.aix':
+                continue
+            try:
+                fstat = entry.stat()
+            except OSError as e:
+                logger.warning(f'can not stat {entry.name}: {e}')
+                continue
+            aixstat[entry.path] = (fstat.st_mtime, fstat.st_size)
+    return aixstat
+
 def summarize_cell_counts_to_csv(slidetype, medpath=None):
     """
-    summarize cell counts to CSV
+    summarize cell counts to CSV, only new or modified .aix are parsed
+    (by a process pool), the others are taken from the summary store
       :param slidetype: urine or thyroid
       :param medpath: folder contains .aix/.med files
     """
@@ -384,40 +716,65 @@ def summarize_cell_counts_to_csv(slidetype, medpath=None):
     if not os.path.exists(csvroot):
         os.makedirs(csvroot)
     aixpath = medpath if medpath else os.path.join(MYENV.DRIVEY_HOME, slidetype.lower())
-    aixfile = glob.glob(os.path.join(aixpath, '*.aix'))
+    aixstat = list_aix_files(aixpath)
+    aixfile = sorted(aixstat)
     logger.debug(f"found {len(aixfile)} .aix files in {aixpath}")
     csvfname = ''
     is_urine = True if slidetype.lower() == 'urine' else False
     if aixfile:
+        store = get_summary_store(slidetype)
+        threshold = qcMAGIC.get_score_threshold()
+        cached = {x: store.get(x, *aixstat[x]) for x in aixfile}
+        toparse = [x for x in aixfile if cached[x] is None]
+        logger.debug(f'{len(aixfile)-len(toparse)} summaries from store, {len(toparse)} .aix to parse')
         ## summarize cell counts into CSV
         csvfname = f"{csvroot}\\summary_of_{slidetype}_cells_{time.strftime('%Y%m%d_%H%M%S')}.csv"
-        with open(csvfname, 'w', newline='', encoding='utf-8') as outcsv:
-            if is_urine:
-                fields = ['slide_id', 'suspicious', 'atypical']
-            else:
-                fields = ['slide_id', 'follicular', 'hurthle', 'histiocytes', 'lymphocytes', 'colloid']
-
-            ww = csv.DictWriter(outcsv, fieldnames=fields)
-            ww.writeheader()
-            for thisaix in aixfile:
-                thisrow = {}
-                if os.path.exists(thisaix):
-                    modelinfo, _, cellscount = get_target_cells_from_aix(thisaix)
-                    thisrow['slide_id'] = os.path.splitext(os.path.basename(thisaix))[0]
-                    if is_urine:
-                        thisrow['suspicious'] = cellscount[2]
-                        thisrow['atypical']   = cellscount[3]
-                    elif modelinfo['ModelVersion'][:6] in ['2025.2']:
-                        thisrow['follicular']    = cellscount[1]
-                        thisrow['hurthle']       = cellscount[2]
-                        thisrow['histiocytes']   = cellscount[5]
-                        thisrow['lymphocytes']   = cellscount[4]
-                        thisrow['colloid']       = cellscount[6]
-                    else:
-                        thisrow['follicular']    = cellscount[1]
-                        thisrow['hurthle']       = cellscount[2]
-                        thisrow['histiocytes']   = cellscount[3]
-                        thisrow['lymphocytes']   = cellscount[4]
-                        thisrow['colloid']       = cellscount[5]
-                ww.writerow(thisrow)
+        nworkers = MYENV.SUMMARY_WORKERS if MYENV.SUMMARY_WORKERS > 0 else (os.cpu_count() or 1)
+        procts = time.perf_counter()
+        nfiles, nbytes, nfailed = 0, 0, 0
+        ## CSV appears only when it is complete
+        tmpfname = f'{csvfname}.tmp'
+        try:
+            with open(tmpfname, 'w', newline='', encoding='utf-8') as outcsv:
+                if is_urine:
+                    fields = ['slide_id', 'suspicious', 'atypical']
+                else:
+                    fields = ['slide_id', 'follicular', 'hurthle', 'histiocytes', 'lymphocytes', 'colloid']
+
+                ww = csv.DictWriter(outcsv, fieldnames=fields)
+                ww.writeheader()
+                with ProcessPoolExecutor(max_workers=nworkers) as pool:
+                    ## map() yields in file order, rows are written as soon as their turn completes
+                    parsed = pool.map(summarize_one_aix, toparse, repeat(threshold), chunksize=4)
+                    for thisaix in aixfile:
+                        record = cached[thisaix]
+                        if record is None:
+                            _, record, errmsg = next(parsed)
+                        else:
+                            errmsg = ''
+                        try:
+                            thisrow = summary_csv_row(record, is_urine) if record else None
+                        except (IndexError, KeyError, TypeError) as e:
+                            thisrow, errmsg = None, f'unusable summary {type(e).__name__}: {e}'
+                        if thisrow is None:
+                            nfailed += 1
+                            logger.error(f'skip {os.path.basename(thisaix)}: {errmsg}')
+                            continue
+                        if cached[thisaix] is None:
+                            record['mtime'], record['size'] = aixstat[thisaix]
+                            store.put(record)
+                            nfiles += 1
+                            nbytes += record['size']
+                        ww.writerow(thisrow)
+            os.replace(tmpfname, csvfname)
+        except BaseException:
+            if os.path.exists(tmpfname):
+                os.remove(tmpfname)
+            raise
+        finally:
+            ## keep summaries parsed before a failure
+            store.save()
+        elapsed = max(time.perf_counter()-procts, 1e-6)
+        logger.info(f'parsed {nfiles} .aix ({nfailed} failed) with {nworkers} workers in {elapsed:.1f}s: '
+                    f'{nfiles/elapsed:.1f} files/s, {nbytes/elapsed/1024/1024:.1f} MB/s')
     return os.path.basename(csvfname)
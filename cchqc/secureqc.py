@@ -2,16 +2,24 @@
    Secure QCAPI
 """
 from datetime import datetime, timedelta
+from typing import Optional
 from loguru import logger
 import jwt
-from fastapi import APIRouter, Depends, Query, Request, HTTPException
+from fastapi import APIRouter, Depends, Query, Request, Response, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 #from jose import JWTError, jwt
 from cchqc.config import MYENV, serviceHistory, TSaction
-from cchqc.qcxfuncs import get_st_mtime
-from cchqc.qcxfuncs import query_all_slide_name, query_qcresult_for_slide
+from cchqc.workers import storagePool
+from cchqc.storagemonitor import storageMonitor, storage_unavailable
+from cchqc.qcxfuncs import query_slide_listing, select_slides, iter_slide_lines
+from cchqc.qcxfuncs import query_qcresult_for_slide, rescan_slide_index
 from cchqc.qcxfuncs import change_qc_score_criteria, change_qc_magic_number, get_current_magic_number
+from cchqc.qcxfuncs import get_qc_cache_stats
+from cchqc.batchqc import SlidesQuery, evaluate_slides, stream_slides_as_ndjson
+from cchqc.slidestore import query_slide_store
+from cchqc.conditional import resolve_slide, listing_validators, validator_headers, is_not_modified, not_modified
 
 secure_qcapicch = APIRouter()
 security = HTTPBearer()
@@ -99,26 +107,81 @@ async def verify_access_token(token: str, request: Request):
     raise HTTPException(status_code=401, detail=errmsg)
 
 @secure_qcapicch.get('/allslides', summary='query all the analyzed slide image files')
-async def get_all_slides(slide_type: str, user_role: str=Depends(verify_token)):
-    """ endpoints for CCH QC workflow with access token """
+async def get_all_slides(slide_type: str, request: Request, response: Response, prefix: Optional[str] = None,
+                         scanned_from: Optional[str] = None, scanned_to: Optional[str] = None,
+                         order_by: Optional[str] = None, descending: bool = False,
+                         cursor: Optional[str] = None, limit: Optional[int] = None, stream: bool = False,
+                         user_role: str=Depends(verify_token)):
+    """ endpoints for CCH QC workflow with access token, parameters as /qc/allslides """
     procts = TSaction()
     if slide_type.lower() not in ['urine', 'thyroid']:
         errmsg = f'there is no slide for {slide_type} slides'
         logger.error(errmsg)
         serviceHistory.append(f"{procts.action_at()},allslides,{user_role['who']},failed,{procts.consumed_time()},{errmsg}")
         raise HTTPException(status_code=404, detail=f'there is no slide for {slide_type} slides')
+    if not storageMonitor.is_alive():
+        errmsg = 'lost the connection to image storage'
+        logger.error(errmsg)
+        serviceHistory.append(f"{procts.action_at()},allslides,{user_role['who']},failed,{procts.consumed_time()},{errmsg}")
+        raise storage_unavailable(errmsg)
+    variant = f'list|{prefix}|{scanned_from}|{scanned_to}|{order_by}|{descending}|{cursor}|{limit}|{stream}'
+    validators = await storagePool.run(listing_validators, slide_type, variant)
+    if is_not_modified(request, validators):
+        serviceHistory.append(f"{procts.action_at()},allslides,{user_role['who']},completed,{procts.consumed_time()},not modified")
+        return not_modified(validators)
     logger.info(f'get_all_slides({slide_type})')
-    err = query_all_slide_name(slide_type)
+    if stream:
+        err = await storagePool.run(select_slides, slide_type, prefix, scanned_from, scanned_to,
+                                    order_by or 'name', descending, cursor)
+    else:
+        err = await storagePool.run(query_slide_listing, slide_type, prefix, scanned_from, scanned_to,
+                                    order_by, descending, cursor, limit)
     if err['code'] < 0:
         logger.error(err['data'])
-        serviceHistory.append(f"{procts.action_at()},allslides,{user_role['who']},failed,{procts.consumed_time()},err['data']")
-        raise HTTPException(status_code=404, detail=err['data'])
-    errmsg = f"found {len(err['data'])} slide image files"
+        serviceHistory.append(f"{procts.action_at()},allslides,{user_role['who']},failed,{procts.consumed_time()},{err['data']}")
+        if err['code'] == -4:
+            raise HTTPException(status_code=400, detail=err['data'])
+        raise storage_unavailable(err['data'])
+    ## validators were taken before listing, a later change only makes the next revalidation miss
+    headers = validator_headers(validators)
+    if stream:
+        def ndjson_lines():
+            summary = {'slides': 0}
+            yield from iter_slide_lines(err['data'], limit, summary)
+            serviceHistory.append(f"{procts.action_at()},allslides,{user_role['who']},completed,{procts.consumed_time()},streamed {summary['slides']} slide image files")
+        return StreamingResponse(ndjson_lines(), media_type='application/x-ndjson', headers=headers)
+    data = err['data']
+    nslides = len(data['slides']) if isinstance(data, dict) else len(data)
+    errmsg = f"found {nslides} slide image files"
     serviceHistory.append(f"{procts.action_at()},allslides,{user_role['who']},completed,{procts.consumed_time()},{errmsg}")
+    response.headers.update(headers)
+    return data
+
+@secure_qcapicch.post('/rescan', summary='force re-scan of the slide index')
+async def rescan_all_slides(slide_type: Optional[str] = None, user_role: str=Depends(verify_token)):
+    """ endpoint for forcing re-scan of the slide index with access token """
+    procts = TSaction()
+    if slide_type and slide_type.lower() not in ['urine', 'thyroid']:
+        errmsg = f'there is no slide for {slide_type} slides'
+        logger.error(errmsg)
+        serviceHistory.append(f"{procts.action_at()},rescan,{user_role['who']},failed,{procts.consumed_time()},{errmsg}")
+        raise HTTPException(status_code=404, detail=errmsg)
+    if not storageMonitor.is_alive():
+        errmsg = 'lost the connection to image storage'
+        logger.error(errmsg)
+        serviceHistory.append(f"{procts.action_at()},rescan,{user_role['who']},failed,{procts.consumed_time()},{errmsg}")
+        raise storage_unavailable(errmsg)
+    err = await storagePool.run(rescan_slide_index, slide_type)
+    if err['code'] < 0:
+        logger.error(err['data'])
+        serviceHistory.append(f"{procts.action_at()},rescan,{user_role['who']},failed,{procts.consumed_time()},{err['data']}")
+        raise storage_unavailable(err['data'])
+    serviceHistory.append(f"{procts.action_at()},rescan,{user_role['who']},completed,{procts.consumed_time()},{err['data']}")
     return err['data']
 
 @secure_qcapicch.get('/v0/slide', summary='query analyzed metadata for QC, return 2 signals')
-async def get_v0_slide_qc_result(slide_type: str, slide_id: str, user_role: str=Depends(verify_token)):
+async def get_v0_slide_qc_result(slide_type: str, slide_id: str, request: Request, response: Response,
+                                 user_role: str=Depends(verify_token)):
     """ v0 endpoint for querying analyzed metadata of specified slide """
     procts = TSaction()
     if slide_type.lower() not in ['urine', 'thyroid']:
@@ -126,35 +189,20 @@ async def get_v0_slide_qc_result(slide_type: str, slide_id: str, user_role: str=
         logger.error(errmsg)
         serviceHistory.append(f"{procts.action_at()},slide,{user_role['who']},failed,{procts.consumed_time()},{errmsg}")
         raise HTTPException(status_code=404, detail=f'{slide_type} {slide_id} can not be found')
-    logger.info(f'starting get_slide_qc_result({slide_type}, {slide_id}) ...')
-    ## find slide_id with pathology_id
-    err = query_all_slide_name(slide_type)
-    if err['code'] < 0:
+    if not storageMonitor.is_alive():
         errmsg = 'lost the connection to image storage'
         logger.error(errmsg)
         serviceHistory.append(f"{procts.action_at()},slide,{user_role['who']},failed,{procts.consumed_time()},{errmsg}")
-        raise HTTPException(status_code=404, detail=errmsg)
-    slideimages = []
-    for slidename in err['data']:
-        thisslide = {}
-        if slide_id in slidename:
-            thisslide['slideid'] = slidename
-            thisslide['stmtime'] = get_st_mtime(slide_type, f'{slidename}.med')
-            #logger.debug(f'{slidename}: {thisslide['stmtime']}')
-            slideimages.append(thisslide)
-    slide_found = True
-    if len(slideimages) > 1:
-        foundslide = sorted(slideimages, key=lambda x: (x['stmtime']), reverse=True)
-        #logger.debug(f'foundslide: {foundslide}')
-        slidename = foundslide[0]['slideid']
-    elif len(slideimages) == 1:
-        slidename = slideimages[0]['slideid']
-    else:
-        slide_found = False
-    ##
-    logger.debug(f'slideimages: {slideimages}')
-    if slide_found:
-        err = query_qcresult_for_slide(slide_type, slidename, 1)
+        raise storage_unavailable(errmsg)
+    logger.info(f'starting get_slide_qc_result({slide_type}, {slide_id}) ...')
+    ## find the latest scanned slide_id with pathology_id
+    slidename, validators = await storagePool.run(resolve_slide, slide_type, slide_id, 'v0')
+    logger.debug(f'{slide_id} is resolved to {slidename}')
+    if is_not_modified(request, validators):
+        serviceHistory.append(f"{procts.action_at()},slide,{user_role['who']},completed,{procts.consumed_time()},not modified")
+        return not_modified(validators)
+    if slidename is not None:
+        err = await storagePool.run(query_qcresult_for_slide, slide_type, slidename, 1)
         qcresult = err['data']
     else:
         qcresult = {}
@@ -171,10 +219,14 @@ async def get_v0_slide_qc_result(slide_type: str, slide_id: str, user_role: str=
         errmsg = f'{slide_type} slide {slide_id} does not exist'
         logger.error(errmsg)
         serviceHistory.append(f"{procts.action_at()},slide,{user_role['who']},failed,{procts.consumed_time()},{errmsg}")
+    if err['code'] == -1:
+        raise storage_unavailable(errmsg)
     if err['code'] < 0:
         raise HTTPException(status_code=404, detail=errmsg)
 
     serviceHistory.append(f"{procts.action_at()},slide,{user_role['who']},completed,{procts.consumed_time()},{qcresult['rawdata']}")
+    ## validators were taken before evaluating, a later change only makes the next revalidation miss
+    response.headers.update(validator_headers(validators))
     return {
         'signal1': qcresult['signal'][0],
         'signal2': qcresult['signal'][1],
@@ -186,7 +238,8 @@ async def get_v0_slide_qc_result(slide_type: str, slide_id: str, user_role: str=
     }
 
 @secure_qcapicch.get('/v1/slide', summary='query analyzed metadata for QC, return 4 signals')
-async def get_v1_slide_qc_result(slide_type: str, slide_id: str, user_role: str=Depends(verify_token)):
+async def get_v1_slide_qc_result(slide_type: str, slide_id: str, request: Request, response: Response,
+                                 user_role: str=Depends(verify_token)):
     """ v1 endpoint for querying analyzed metadata of specified slide """
     procts = TSaction()
     if slide_type.lower() not in ['urine', 'thyroid']:
@@ -194,38 +247,24 @@ async def get_v1_slide_qc_result(slide_type: str, slide_id: str, user_role: str=
         logger.error(errmsg)
         serviceHistory.append(f"{procts.action_at()},slide,{user_role['who']},failed,{procts.consumed_time()},{errmsg}")
         raise HTTPException(status_code=404, detail=f'{slide_type} {slide_id} can not be found')
-    logger.info(f'starting get_slide_qc_result({slide_type}, {slide_id}) ...')
-    ## find slide_id with pathology_id
-    err = query_all_slide_name(slide_type)
-    if err['code'] < 0:
+    if not storageMonitor.is_alive():
         errmsg = 'lost the connection to image storage'
         logger.error(errmsg)
         serviceHistory.append(f"{procts.action_at()},slide,{user_role['who']},failed,{procts.consumed_time()},{errmsg}")
-        raise HTTPException(status_code=404, detail=errmsg)
-    slideimages = []
-    for slidename in err['data']:
-        thisslide = {}
-        if slide_id in slidename:
-            thisslide['slideid'] = slidename
-            thisslide['stmtime'] = get_st_mtime(slide_type, f'{slidename}.med')
-            #logger.debug(f'{slidename}: {thisslide['stmtime']}')
-            slideimages.append(thisslide)
-    slide_found = True
-    if len(slideimages) > 1:
-        foundslide = sorted(slideimages, key=lambda x: (x['stmtime']), reverse=True)
-        #logger.debug(f'foundslide: {foundslide}')
-        slidename = foundslide[0]['slideid']
-    elif len(slideimages) == 1:
-        slidename = slideimages[0]['slideid']
-    else:
-        slide_found = False
-    ##
-    logger.debug(f'slideimages: {slideimages}')
-    if slide_found:
-        err = query_qcresult_for_slide(slide_type, slidename, 1)
+        raise storage_unavailable(errmsg)
+    logger.info(f'starting get_slide_qc_result({slide_type}, {slide_id}) ...')
+    ## find the latest scanned slide_id with pathology_id
+    slidename, validators = await storagePool.run(resolve_slide, slide_type, slide_id, 'v1')
+    logger.debug(f'{slide_id} is resolved to {slidename}')
+    if is_not_modified(request, validators):
+        serviceHistory.append(f"{procts.action_at()},slide,{user_role['who']},completed,{procts.consumed_time()},not modified")
+        return not_modified(validators)
+    if slidename is not None:
+        err = await storagePool.run(query_qcresult_for_slide, slide_type, slidename, 1)
         qcresult = err['data']
     else:
         qcresult = {}
+        err = {'code': -3, 'data': None}
     if err['code'] == -1:
         errmsg = 'lost net connection to image storage'
         logger.error(errmsg)
@@ -234,10 +273,18 @@ async def get_v1_slide_qc_result(slide_type: str, slide_id: str, user_role: str=
         errmsg = f'can not find any metadata for {slide_type} slide {slide_id}'
         logger.error(errmsg)
         serviceHistory.append(f"{procts.action_at()},slide,{user_role['who']},failed,{procts.consumed_time()},{errmsg}")
+    elif err['code'] == -3:
+        errmsg = f'{slide_type} slide {slide_id} does not exist'
+        logger.error(errmsg)
+        serviceHistory.append(f"{procts.action_at()},slide,{user_role['who']},failed,{procts.consumed_time()},{errmsg}")
+    if err['code'] == -1:
+        raise storage_unavailable(errmsg)
     if err['code'] < 0:
         raise HTTPException(status_code=404, detail=errmsg)
 
     serviceHistory.append(f"{procts.action_at()},slide,{user_role['who']},completed,{procts.consumed_time()},{qcresult['rawdata']}")
+    ## validators were taken before evaluating, a later change only makes the next revalidation miss
+    response.headers.update(validator_headers(validators))
     return {
         'signal1': qcresult['signal'][0],
         'signal2': qcresult['signal'][1],
@@ -250,6 +297,56 @@ async def get_v1_slide_qc_result(slide_type: str, slide_id: str, user_role: str=
         'refnote': qcresult['refnote']
     }
 
+@secure_qcapicch.post('/v1/slides', summary='query analyzed metadata for QC of many slides, return 4 signals each')
+async def get_v1_slides_qc_result(query: SlidesQuery, stream: bool = False, user_role: str=Depends(verify_token)):
+    """ v1 endpoint for querying analyzed metadata of many slides, per slide code as /qc/v1/slides """
+    procts = TSaction()
+    if len(query.slides) > MYENV.BATCH_MAX_SLIDES:
+        errmsg = f'too many slides ({len(query.slides)}), maximum is {MYENV.BATCH_MAX_SLIDES}'
+        logger.error(errmsg)
+        serviceHistory.append(f"{procts.action_at()},slides,{user_role['who']},failed,{procts.consumed_time()},{errmsg}")
+        raise HTTPException(status_code=413, detail=errmsg)
+    if not storageMonitor.is_alive():
+        errmsg = 'lost the connection to image storage'
+        logger.error(errmsg)
+        serviceHistory.append(f"{procts.action_at()},slides,{user_role['who']},failed,{procts.consumed_time()},{errmsg}")
+        raise storage_unavailable(errmsg)
+    logger.info(f'starting get_v1_slides_qc_result({len(query.slides)} slides) ...')
+    if stream:
+        async def ndjson_lines():
+            summary = {'completed': 0, 'failed': 0}
+            async for line in stream_slides_as_ndjson(query.slides, summary):
+                yield line
+            serviceHistory.append(f"{procts.action_at()},slides,{user_role['who']},completed,{procts.consumed_time()},{summary['completed']} completed; {summary['failed']} failed")
+        return StreamingResponse(ndjson_lines(), media_type='application/x-ndjson')
+    results = await evaluate_slides(query.slides)
+    nfailed = sum(1 for x in results if x['code'] < 0)
+    serviceHistory.append(f"{procts.action_at()},slides,{user_role['who']},completed,{procts.consumed_time()},{len(results)-nfailed} completed; {nfailed} failed")
+    return results
+
+@secure_qcapicch.get('/v1/slidestore', summary='query slides by pathology id, scan time, model and cell counts')
+async def query_slides_in_store(slide_type: str, pathology_id: Optional[str] = None,
+                                scanned_from: Optional[str] = None, scanned_to: Optional[str] = None,
+                                model: Optional[str] = None, version: Optional[str] = None,
+                                category: Optional[str] = None, min_count: Optional[int] = None, max_count: Optional[int] = None,
+                                order_by: str = 'scanned', descending: bool = True, limit: int = 100, offset: int = 0,
+                                user_role: str=Depends(verify_token)):
+    """ endpoint for querying the slide store, parameters as /qc/v1/slidestore """
+    procts = TSaction()
+    if slide_type.lower() not in ['urine', 'thyroid']:
+        errmsg = f'there is no slide for {slide_type} slides'
+        logger.error(errmsg)
+        serviceHistory.append(f"{procts.action_at()},slidestore,{user_role['who']},failed,{procts.consumed_time()},{errmsg}")
+        raise HTTPException(status_code=404, detail=errmsg)
+    err = await storagePool.run(query_slide_store, slide_type, pathology_id, scanned_from, scanned_to, model, version,
+                                category, min_count, max_count, order_by, descending, limit, offset)
+    if err['code'] < 0:
+        logger.error(err['data'])
+        serviceHistory.append(f"{procts.action_at()},slidestore,{user_role['who']},failed,{procts.consumed_time()},{err['data']}")
+        raise HTTPException(status_code=400, detail=err['data'])
+    serviceHistory.append(f"{procts.action_at()},slidestore,{user_role['who']},completed,{procts.consumed_time()},found {len(err['data'])} slides")
+    return err['data']
+
 @secure_qcapicch.post('/setScoreThreshold', summary='set urine score threshold', include_in_schema=True)
 async def set_score_threshold_for_qc(s: float, user_role: str=Depends(verify_token)):
     """ endpoint for change urine score criteria, default is 0.4 """
@@ -259,10 +356,10 @@ async def set_score_threshold_for_qc(s: float, user_role: str=Depends(verify_tok
         logger.warning(retmsg)
         errstat = 'failed'
     else:
-        change_qc_score_criteria(s)
+        await storagePool.run(change_qc_score_criteria, s)
         retmsg = f'score threshold was set to {s}'
         errstat = 'completed'
-    ret = get_current_magic_number()
+    ret = await storagePool.run(get_current_magic_number)
     serviceHistory.append(f"{procts.action_at()},setScoreCriteria,{user_role['who']},{errstat},{procts.consumed_time()},{retmsg}")
     return {
         'score threshold': ret[2]
@@ -272,7 +369,7 @@ async def set_score_threshold_for_qc(s: float, user_role: str=Depends(verify_tok
 async def get_magic_number_for_qc(user_role: str=Depends(verify_token)):
     """ endpoint for querying urine QC MAGIC number """
     procts = TSaction()
-    ret = get_current_magic_number()
+    ret = await storagePool.run(get_current_magic_number)
     serviceHistory.append(f"{procts.action_at()},currentQCmagic,{user_role['who']},completed,{procts.consumed_time()},{ret}")
     return {
         'suspicious': ret[0],
@@ -283,7 +380,7 @@ async def get_magic_number_for_qc(user_role: str=Depends(verify_token)):
 async def change_magic_number_for_qc(s: int, a: int, user_role: str=Depends(verify_token)):
     """ endpoint for changing urine QC MAGIC number """
     procts = TSaction()
-    ret = change_qc_magic_number(s, a)
+    ret = await storagePool.run(change_qc_magic_number, s, a)
     if ret:
         retstr = f'magic number was changed to suspicious:{s}, atypical:{a}'
         logger.info(retstr)
@@ -294,3 +391,12 @@ async def change_magic_number_for_qc(s: int, a: int, user_role: str=Depends(veri
         errstat = 'failed'
     serviceHistory.append(f"{procts.action_at()},changeQCmagic,{user_role['who']},{errstat},{procts.consumed_time()},{retstr}")
     return retstr
+
+@secure_qcapicch.get('/cachestats', summary='get QC result cache statistics', include_in_schema=True)
+async def get_qc_cache_statistics(user_role: str=Depends(verify_token)):
+    """ endpoint for querying hit/miss/eviction counters of QC result cache """
+    procts = TSaction()
+    err = get_qc_cache_stats()
+    stats = err['data']
+    serviceHistory.append(f"{procts.action_at()},cachestats,{user_role['who']},completed,{procts.consumed_time()},hits {stats['hits']} misses {stats['misses']}")
+    return stats
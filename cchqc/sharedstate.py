@@ -0,0 +1,243 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.sharedstate
+  state shared by API worker processes in one SQLite file: QC criteria, slide index and QC results
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from loguru import logger
+from cchqc.config import MYENV
+from cchqc.sidecar import sidecar_record, sidecar_from_record
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS criteria (name TEXT PRIMARY KEY, value NOT NULL);
+CREATE TABLE IF NOT EXISTS qcresults (aixfile TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, record BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS slideindex (slide_type TEXT PRIMARY KEY, generation INTEGER NOT NULL, scanned_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS slides (slide_type TEXT NOT NULL, slideid TEXT NOT NULL,
+    has_med INTEGER NOT NULL, has_aix INTEGER NOT NULL, med_size INTEGER NOT NULL, med_mtime REAL NOT NULL,
+    aix_size INTEGER NOT NULL, aix_mtime REAL NOT NULL, PRIMARY KEY (slide_type, slideid));
+CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL);
+'''
+
+class SharedState:
+    """ SQLite file (WAL) opened once per thread, QC criteria are cached until another connection commits """
+    def __init__(self, dbfile, criteria_defaults):
+        self.dbfile = dbfile
+        self.criteria_defaults = dict(criteria_defaults)
+        self.__local = threading.local()
+
+    def __connection(self):
+        conn = getattr(self.__local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.dbfile), exist_ok=True)
+            conn = sqlite3.connect(self.dbfile, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            ## first worker sets the time criteria are valid from, the same for all workers
+            conn.execute('INSERT OR IGNORE INTO criteria (name, value) VALUES (?, ?)', ('changed_at', time.time()))
+            self.__local.conn = conn
+            self.__local.version = None
+            self.__local.criteria = {}
+        return conn
+
+    @contextmanager
+    def __transaction(self):
+        """ write transaction, takes the write lock at BEGIN """
+        conn = self.__connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def __criteria(self):
+        conn = self.__connection()
+        ## data_version changes only when another connection commits, one cheap query per read
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if version != self.__local.version:
+            self.__local.criteria = dict(conn.execute('SELECT name, value FROM criteria'))
+            self.__local.version = version
+        return self.__local.criteria
+
+    def get_criteria(self, name):
+        """ current value of one QC criterion, its default if never set """
+        return self.__criteria().get(name, self.criteria_defaults[name])
+
+    def set_criteria(self, **values):
+        """ set QC criteria for all workers """
+        with self.__transaction() as conn:
+            conn.executemany('INSERT OR REPLACE INTO criteria (name, value) VALUES (?, ?)', values.items())
+        ## own commits do not change data_version of this connection
+        self.__local.criteria.update(values)
+
+    def reset_criteria(self):
+        """ back to defaults, when the service (re)starts """
+        changed_at = time.time()
+        with self.__transaction() as conn:
+            conn.execute('DELETE FROM criteria')
+            conn.execute('INSERT INTO criteria (name, value) VALUES (?, ?)', ('changed_at', changed_at))
+        self.__local.criteria = {'changed_at': changed_at}
+
+    def get_summary(self, aixfile, mtime, size):
+        """ SidecarSummary of .aix parsed by any worker, None if missing or .aix was changed """
+        row = self.__connection().execute('SELECT record FROM qcresults WHERE aixfile = ? AND mtime = ? AND size = ?',
+                                          (aixfile, mtime, size)).fetchone()
+        if row is None:
+            return None
+        return sidecar_from_record(json.loads(zlib.decompress(row[0])))
+
+    def put_summary(self, aixfile, mtime, size, sidecar):
+        """ share SidecarSummary of .aix, replaces the one of an older mtime/size """
+        record = zlib.compress(json.dumps(sidecar_record(sidecar), separators=(',', ':')).encode('utf-8'))
+        self.__connection().execute('INSERT OR REPLACE INTO qcresults (aixfile, mtime, size, record) VALUES (?, ?, ?, ?)',
+                                    (aixfile, mtime, size, record))
+
+    def prune_summaries(self, folder, aixfiles, max_entries, max_bytes):
+        """
+        drop QC results of .aix under folder that left the slide index, then the oldest written over budget
+          :param folder: folder of one slide type
+          :param aixfiles: .aix filenames in the slide index of folder
+          :param max_entries: QC results kept at most
+          :param max_bytes: compressed bytes of QC results kept at most
+        returns number of dropped QC results
+        """
+        prefix = os.path.join(folder, '')
+        with self.__transaction() as conn:
+            rows = conn.execute('SELECT aixfile FROM qcresults WHERE substr(aixfile, 1, ?) = ?', (len(prefix), prefix))
+            stale = [x for x in rows if x[0] not in aixfiles]
+            conn.executemany('DELETE FROM qcresults WHERE aixfile = ?', stale)
+            ## INSERT OR REPLACE takes a new rowid, the latest written have the largest
+            over, nentries, nbytes = [], 0, 0
+            for rowid, size in conn.execute('SELECT rowid, length(record) FROM qcresults ORDER BY rowid DESC').fetchall():
+                nentries += 1
+                nbytes += size
+                if nentries > max_entries or nbytes > max_bytes:
+                    over.append((rowid,))
+            conn.executemany('DELETE FROM qcresults WHERE rowid = ?', over)
+        return len(stale) + len(over)
+
+    def publish_slides(self, slide_type, entries, scanned_at):
+        """
+        replace slide index of slide_type, returns its new generation
+          :param entries: SlideEntry tuples
+          :param scanned_at: timestamp of the scan
+        """
+        with self.__transaction() as conn:
+            conn.execute('DELETE FROM slides WHERE slide_type = ?', (slide_type,))
+            conn.executemany('INSERT INTO slides VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [(slide_type, *x) for x in entries])
+            conn.execute('INSERT INTO slideindex VALUES (?, 1, ?) ON CONFLICT(slide_type) DO UPDATE '
+                         'SET generation = generation + 1, scanned_at = excluded.scanned_at', (slide_type, scanned_at))
+            return conn.execute('SELECT generation FROM slideindex WHERE slide_type = ?', (slide_type,)).fetchone()[0]
+
+    def slides_generation(self, slide_type):
+        """ generation of the published slide index, 0 if none """
+        row = self.__connection().execute('SELECT generation FROM slideindex WHERE slide_type = ?', (slide_type,)).fetchone()
+        return row[0] if row else 0
+
+    def load_slides(self, slide_type):
+        """ (generation, scanned_at, [slide rows]) of the published slide index """
+        conn = self.__connection()
+        ## one read transaction, rows and generation are of the same publish
+        conn.execute('BEGIN')
+        try:
+            row = conn.execute('SELECT generation, scanned_at FROM slideindex WHERE slide_type = ?', (slide_type,)).fetchone()
+            rows = conn.execute('SELECT slideid, has_med, has_aix, med_size, med_mtime, aix_size, aix_mtime '
+                                'FROM slides WHERE slide_type = ?', (slide_type,)).fetchall()
+        finally:
+            conn.execute('COMMIT')
+        generation, scanned_at = row if row else (0, 0.0)
+        return generation, scanned_at, rows
+
+    def acquire_lease(self, name, owner, ttl):
+        """ take or renew lease name for ttl seconds, False if another owner holds it """
+        now = time.time()
+        with self.__transaction() as conn:
+            row = conn.execute('SELECT owner, expires FROM leases WHERE name = ?', (name,)).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            conn.execute('INSERT OR REPLACE INTO leases (name, owner, expires) VALUES (?, ?, ?)', (name, owner, now+ttl))
+            return True
+
+    def release_lease(self, name, owner):
+        """ give up lease name if owner holds it """
+        with self.__transaction() as conn:
+            conn.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner))
+
+class LeaderLease:
+    """ lease renewed in a daemon thread, the worker holding it runs the background services """
+    def __init__(self, state, name, ttl):
+        self.state = state
+        self.name = name
+        self.ttl = ttl
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.__leader = False
+        self.__on_elected = None
+        self.__on_lost = None
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def is_leader(self):
+        """ True if this worker holds the lease """
+        return self.__leader
+
+    def __renew(self):
+        try:
+            leader = self.state.acquire_lease(self.name, self.owner, self.ttl)
+        except sqlite3.Error as e:
+            logger.error(f'LeaderLease: can not renew {self.name}: {e}')
+            leader = False
+        if leader and not self.__leader:
+            self.__leader = True
+            logger.info(f'{self.owner} is the leader of API workers')
+            self.__on_elected()
+        elif not leader and self.__leader:
+            self.__leader = False
+            logger.warning(f'{self.owner} lost the leader lease')
+            self.__on_lost()
+
+    def __renew_loop(self):
+        while not self.__stop.wait(self.ttl/3):
+            self.__renew()
+
+    def start(self, on_elected, on_lost):
+        """
+        try to take the lease now, then renew or take it over in a daemon thread
+          :param on_elected: called when this worker becomes the leader
+          :param on_lost: called when this worker loses the lease or stops
+        """
+        if self.__thread is not None:
+            return
+        self.__on_elected, self.__on_lost = on_elected, on_lost
+        self.__renew()
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__renew_loop, name='leaderlease', daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """ stop renewing, release the lease so another worker takes over at once """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout=5)
+            self.__thread = None
+        if self.__leader:
+            self.__leader = False
+            self.__on_lost()
+            try:
+                self.state.release_lease(self.name, self.owner)
+            except sqlite3.Error as e:
+                logger.error(f'LeaderLease: can not release {self.name}: {e}')
+
+if MYENV.API_WORKERS > 1:
+    sharedState = SharedState(os.path.join(MYENV.AMAQC_HOME, 'metadata', 'qcapi_shared.db'),
+                              {'magic_s': 6, 'magic_a': 8, 'threshold': 0.4, 'changed_at': 0.0})
+    leaderLease = LeaderLease(sharedState, 'leader', MYENV.SHARED_LEASE_SECONDS)
+else:
+    sharedState = None
+    leaderLease = None
@@ -0,0 +1,167 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.sidecar
+  compact QC summary written once per .aix, read instead of the .aix while it is fresh
+"""
+import gzip
+import json
+import os
+import numpy as np
+from loguru import logger
+from cchqc.config import MYENV
+from cchqc.metrics import aixSidecarTotal
+
+SIDECAR_VERSION = 1
+SIDECAR_SUFFIX = '.qcsum'
+THRESHOLD_STEPS = 100       # trait counts are kept at thresholds 0.00, 0.01, ..., 1.00
+TRAIT_CATEGORIES = (1,)     # categories of count_trait_in_category(), follicular cells
+
+def threshold_step(threshold):
+    """ index of threshold on the 0.01 grid, None if it is not on the grid """
+    step = round(threshold*THRESHOLD_STEPS)
+    if 0 <= step <= THRESHOLD_STEPS and step/THRESHOLD_STEPS == threshold:
+        return step
+    return None
+
+def grid_thresholds():
+    """ thresholds 0.00, 0.01, ..., 1.00, k/THRESHOLD_STEPS is the same float as the threshold """
+    return (np.arange(THRESHOLD_STEPS+1)/THRESHOLD_STEPS).tolist()
+
+def to_histograms(counts):
+    """ cells with score in [k/THRESHOLD_STEPS, (k+1)/THRESHOLD_STEPS) of each trait, smaller to store """
+    return [[x - y for x, y in zip(row, row[1:] + [0])] for row in counts]
+
+def from_histograms(histograms):
+    """ inverse of to_histograms() """
+    return [np.cumsum(row[::-1])[::-1].tolist() for row in histograms]
+
+class SidecarSummary:
+    """ category counts and trait counts at grid thresholds, same queries as CellSummary """
+    def __init__(self, aixinfo, cellscount, traitcounts, categorycounts):
+        self.aixinfo = aixinfo
+        self.cellscount = cellscount
+        self.traitcounts = traitcounts
+        self.categorycounts = categorycounts
+
+    @classmethod
+    def from_cell_summary(cls, summary):
+        """ reduce CellSummary to counts at grid thresholds, traits x (THRESHOLD_STEPS+1) """
+        grid = grid_thresholds()
+        traitcounts = summary.trait_counts_at(summary.scores.width, grid)
+        categorycounts = {x: summary.category_counts_at(x, grid) for x in TRAIT_CATEGORIES}
+        return cls(summary.aixinfo, summary.cellscount, [list(x) for x in zip(*traitcounts)], categorycounts)
+
+    def supports(self, threshold):
+        """ True if trait counts of threshold are kept """
+        return not self.traitcounts or threshold is None or threshold_step(threshold) is not None
+
+    def trait_counts(self, max_traits, threshold):
+        """
+        count cells of each trait with score >= threshold
+          :param max_traits: maximum number of traits
+          :param threshold: criteria on the 0.01 grid
+        """
+        step = threshold_step(threshold)
+        traitcount = [0 for _ in range(max_traits)]
+        for i, counts in enumerate(self.traitcounts[:max_traits]):
+            traitcount[i] = counts[step]
+        return traitcount
+
+    def count_trait_in_category(self, trait, category, threshold):
+        """
+        count cells of category with trait score >= threshold
+          :param trait: index of trait
+          :param category: one of TRAIT_CATEGORIES
+          :param threshold: criteria on the 0.01 grid
+        """
+        counts = self.categorycounts[category]
+        if trait >= len(counts):
+            return 0
+        return counts[trait][threshold_step(threshold)]
+
+    def nbytes(self):
+        """ estimated memory size """
+        ncounts = sum(len(x) for x in self.traitcounts) + sum(len(y) for x in self.categorycounts.values() for y in x)
+        return 1024 + 36*ncounts
+
+def sidecar_record(sidecar):
+    """ JSON-able dict of SidecarSummary, trait counts as histograms """
+    return {
+        'steps': THRESHOLD_STEPS,
+        'aixinfo': sidecar.aixinfo,
+        'cellscount': sidecar.cellscount,
+        'histograms': to_histograms(sidecar.traitcounts),
+        'categoryhistograms': {str(k): to_histograms(v) for k, v in sidecar.categorycounts.items()}
+    }
+
+def sidecar_from_record(record):
+    """ SidecarSummary of sidecar_record(), None if it was made with another grid """
+    if record.get('steps') != THRESHOLD_STEPS:
+        return None
+    categorycounts = {int(k): from_histograms(v) for k, v in record['categoryhistograms'].items()}
+    return SidecarSummary(record['aixinfo'], record['cellscount'], from_histograms(record['histograms']), categorycounts)
+
+def sidecar_paths(aixfile):
+    """ sidecar files (gzipped JSON) of .aix in lookup order, next to .aix if allowed, then under AMAQC_HOME """
+    fname = os.path.basename(aixfile) + SIDECAR_SUFFIX
+    localfile = os.path.join(MYENV.AMAQC_HOME, 'sidecar', os.path.basename(os.path.dirname(aixfile)), fname)
+    if MYENV.SIDECAR_BESIDE_AIX:
+        return [os.path.join(os.path.dirname(aixfile), fname), localfile]
+    return [localfile]
+
+def read_sidecar(aixfile, mtime, size):
+    """
+    SidecarSummary of .aix, None if there is no sidecar of this mtime and size
+      :param aixfile: .aix filename
+      :param mtime: current st_mtime of .aix
+      :param size: current st_size of .aix
+    """
+    for sidecarfile in sidecar_paths(aixfile):
+        try:
+            with gzip.open(sidecarfile, 'rt', encoding='utf-8') as fsidecar:
+                stored = json.load(fsidecar)
+        except FileNotFoundError:
+            continue
+        except (OSError, EOFError, ValueError) as e:
+            logger.warning(f'can not read {sidecarfile}: {e}')
+            continue
+        source = stored.get('source', {})
+        if stored.get('version') != SIDECAR_VERSION:
+            continue
+        if source.get('name') != os.path.basename(aixfile) or source.get('mtime') != mtime or source.get('size') != size:
+            ## .aix was re-written after its sidecar
+            continue
+        sidecar = sidecar_from_record(stored)
+        if sidecar is None:
+            continue
+        aixSidecarTotal.inc('hit')
+        return sidecar
+    aixSidecarTotal.inc('miss')
+    return None
+
+def write_sidecar(aixfile, mtime, size, sidecar):
+    """
+    write SidecarSummary of .aix atomically, returns sidecar filename or None
+      :param aixfile: .aix filename
+      :param mtime: st_mtime of parsed .aix
+      :param size: st_size of parsed .aix
+      :param sidecar: SidecarSummary of the .aix
+    """
+    stored = {
+        'version': SIDECAR_VERSION,
+        'source': {'name': os.path.basename(aixfile), 'mtime': mtime, 'size': size},
+        **sidecar_record(sidecar)
+    }
+    for sidecarfile in sidecar_paths(aixfile):
+        tmpfile = f'{sidecarfile}.tmp'
+        try:
+            os.makedirs(os.path.dirname(sidecarfile), exist_ok=True)
+            with gzip.open(tmpfile, 'wt', encoding='utf-8') as fsidecar:
+                json.dump(stored, fsidecar, separators=(',', ':'))
+            os.replace(tmpfile, sidecarfile)
+        except OSError as e:
+            ## e.g. read-only image storage, try the local cache
+            logger.warning(f'can not write {sidecarfile}: {e}')
+            continue
+        aixSidecarTotal.inc('written')
+        return sidecarfile
+    aixSidecarTotal.inc('failed')
+    return None
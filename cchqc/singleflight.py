@@ -0,0 +1,63 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.singleflight
+  coalesce concurrent identical work: one call runs, callers of the same key wait and share its result or error
+"""
+import threading
+from cchqc.metrics import singleflightTotal, singleflightInflight
+
+class FlightCall:
+    """ one in-flight call and what its waiters get """
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """ at most one running call per key, for blocking work on storage/worker threads """
+    def __init__(self, name):
+        self.name = name
+        self.__lock = threading.Lock()
+        self.__calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        run func(*args, **kwargs) unless a call of key is running, then wait for that one
+          :param key: hashable identity of the work
+          :param func: blocking function
+        waiters get the same result object or the same exception
+        """
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = FlightCall()
+                self.__calls[key] = call
+            else:
+                call.waiters += 1
+        if not leader:
+            singleflightTotal.inc(self.name, 'coalesced')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        singleflightTotal.inc(self.name, 'executed')
+        singleflightInflight.inc(self.name)
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            ## later callers start a new call, they may see newer files
+            with self.__lock:
+                del self.__calls[key]
+            singleflightInflight.dec(self.name)
+            call.done.set()
+        return call.result
+
+    def inflight(self):
+        """ number of running calls """
+        with self.__lock:
+            return len(self.__calls)
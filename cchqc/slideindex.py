@@ -0,0 +1,363 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.slideindex
+  in-memory index of analyzed slides in image storage, refreshed in background
+"""
+import os
+import sqlite3
+from bisect import bisect_left, bisect_right
+import threading
+import time
+from typing import NamedTuple
+from loguru import logger
+from cchqc.config import MYENV
+from cchqc.storagemonitor import storageMonitor
+from cchqc.sharedstate import sharedState, leaderLease
+from cchqc.singleflight import SingleFlight
+
+SLIDE_TYPES = ['urine', 'thyroid']
+
+class SlideEntry(NamedTuple):
+    """ .med/.aix presence, size and mtime of one slide """
+    slideid: str
+    has_med: bool
+    has_aix: bool
+    med_size: int
+    med_mtime: float
+    aix_size: int
+    aix_mtime: float
+
+class SlideNameResolver:
+    """ trigram index over analyzed slide names, substring lookup of the latest scan """
+    GRAM = 3
+    MEMO_SIZE = 4096
+
+    def __init__(self, entries):
+        self.__names = [x.slideid for x in entries]
+        self.__mtimes = [x.med_mtime for x in entries]
+        self.__grams = {}
+        for i, name in enumerate(self.__names):
+            for gram in {name[j:j+self.GRAM] for j in range(len(name)-self.GRAM+1)}:
+                self.__grams.setdefault(gram, []).append(i)
+        self.__memo = {}
+
+    def __candidates(self, slide_id):
+        """ indexes of names which may contain slide_id, in name order """
+        if len(slide_id) < self.GRAM:
+            return range(len(self.__names))
+        postings = None
+        for j in range(len(slide_id)-self.GRAM+1):
+            plist = self.__grams.get(slide_id[j:j+self.GRAM])
+            if plist is None:
+                return []
+            if postings is None or len(plist) < len(postings):
+                postings = plist
+        return postings
+
+    def find_latest(self, slide_id):
+        """
+        latest scanned slide name containing slide_id, None if not found
+          :param slide_id: slide id (pathology id) for querying
+        same result as picking max .med mtime of `slide_id in slidename`, first one on ties
+        """
+        if slide_id in self.__memo:
+            return self.__memo[slide_id]
+        names, mtimes = self.__names, self.__mtimes
+        best = None
+        for i in self.__candidates(slide_id):
+            if slide_id in names[i] and (best is None or mtimes[i] > mtimes[best]):
+                best = i
+        found = None if best is None else names[best]
+        if len(self.__memo) >= self.MEMO_SIZE:
+            self.__memo = {}
+        self.__memo[slide_id] = found
+        return found
+
+class SlideListView:
+    """ analyzed slides of one scan sorted by name and by (.med mtime, name), for pages of the listing """
+    ORDERS = ('name', 'scanned')
+
+    def __init__(self, entries):
+        analyzed = [x for x in entries if x.has_med and x.has_aix]
+        self.by_name = sorted(analyzed, key=lambda x: x.slideid)
+        self.names = [x.slideid for x in self.by_name]
+        self.by_mtime = sorted(analyzed, key=lambda x: (x.med_mtime, x.slideid))
+        self.mtime_keys = [(x.med_mtime, x.slideid) for x in self.by_mtime]
+
+    def __len__(self):
+        return len(self.names)
+
+    @staticmethod
+    def sort_key(order_by, entry):
+        """ key of entry in order_by, cursors point at keys """
+        return entry.slideid if order_by == 'name' else (entry.med_mtime, entry.slideid)
+
+    def iter_slides(self, order_by='name', descending=False, after=None, prefix=None, mtime_from=None, mtime_to=None):
+        """
+        SlideEntry in order, starting after cursor key
+          :param order_by: name or scanned (.med mtime)
+          :param after: sort_key() of the last slide of the previous page
+          :param prefix: slide name prefix
+          :param mtime_from: .med mtime >= this timestamp
+          :param mtime_to: .med mtime < this timestamp
+        the range of prefix (order by name) or of mtime (order by scanned) is found by bisection,
+        the other filter is checked slide by slide
+        """
+        if order_by == 'name':
+            keys, rows = self.names, self.by_name
+            lo = bisect_left(keys, prefix) if prefix else 0
+            hi = bisect_right(keys, prefix + '\U0010ffff') if prefix else len(keys)
+        else:
+            keys, rows = self.mtime_keys, self.by_mtime
+            lo = bisect_left(keys, (mtime_from,)) if mtime_from is not None else 0
+            hi = bisect_left(keys, (mtime_to,)) if mtime_to is not None else len(keys)
+        if after is not None:
+            if descending:
+                hi = min(hi, bisect_left(keys, after))
+            else:
+                lo = max(lo, bisect_right(keys, after))
+        for i in (range(hi-1, lo-1, -1) if descending else range(lo, hi)):
+            entry = rows[i]
+            if order_by == 'name':
+                if (mtime_from is not None and entry.med_mtime < mtime_from) or (mtime_to is not None and entry.med_mtime >= mtime_to):
+                    continue
+            elif prefix and not entry.slideid.startswith(prefix):
+                continue
+            yield entry
+
+class SlideIndex:
+    """ slide index of one slide type folder, published to SharedState if given """
+    def __init__(self, slide_type, folder=None, shared=None):
+        self.slide_type = slide_type.lower()
+        self.folder = folder if folder else os.path.join(MYENV.DRIVEY_HOME, self.slide_type)
+        self.__lock = threading.Lock()
+        self.__entries = {}
+        self.__resolver = SlideNameResolver([])
+        self.__view = SlideListView([])
+        self.__generation = 0
+        self.__scanned_at = 0.0
+        self.__modified_at = 0.0
+        self.__built = False
+        self.__shared = shared
+        self.__shared_generation = 0
+
+    def scan_folder(self):
+        """ list .med/.aix of the folder with one directory read """
+        found = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                ext = ext.lower()
+                if ext not in ('.med', '.aix'):
+                    continue
+                try:
+                    ## DirEntry.stat() is served from the directory listing on Windows
+                    fstat = entry.stat()
+                except OSError as e:
+                    logger.warning(f'can not stat {entry.name}: {e}')
+                    continue
+                found.setdefault(stem, {})[ext] = (fstat.st_size, fstat.st_mtime)
+        return found
+
+    def refresh(self):
+        """
+        re-scan folder, keep previous entries if the folder can not be read
+        entries of unchanged size/mtime are reused, resolver and list view are rebuilt only if a slide was
+        added, removed or changed; the directory is still listed every time since re-writing .aix in place
+        does not change the mtime of the folder
+        """
+        procts = time.perf_counter()
+        try:
+            found = self.scan_folder()
+        except OSError as e:
+            logger.error(f'SlideIndex.refresh({self.slide_type}) failed: {e}')
+            return False
+        previous = self.__entries
+        entries = {}
+        added, changed = 0, 0
+        for stem, files in found.items():
+            state = ('.med' in files, '.aix' in files, *files.get('.med', (0, 0.0)), *files.get('.aix', (0, 0.0)))
+            entry = previous.get(stem)
+            if entry is None:
+                added += 1
+                entry = SlideEntry(stem, *state)
+            elif entry[1:] != state:
+                changed += 1
+                entry = SlideEntry(stem, *state)
+            entries[stem] = entry
+        removed = len(previous) - (len(entries) - added)
+        modified = added or removed or changed or not self.__built
+        scanned_at = time.time()
+        self.__install(entries if modified else None, scanned_at)
+        if modified and self.__shared:
+            try:
+                self.__shared_generation = self.__shared.publish_slides(self.slide_type, entries.values(), scanned_at)
+                ## shared QC results are bounded like QC result cache of each worker
+                aixfiles = {self.slide_file(x.slideid) for x in entries.values() if x.has_aix}
+                dropped = self.__shared.prune_summaries(self.folder, aixfiles, MYENV.QCCACHE_MAX_ENTRIES,
+                                                        MYENV.QCCACHE_MAX_MB*1024*1024)
+                if dropped:
+                    logger.debug(f'{self.slide_type} index: dropped {dropped} shared QC results')
+            except sqlite3.Error as e:
+                logger.error(f'SlideIndex.refresh({self.slide_type}) can not publish: {e}')
+        if added or removed or changed:
+            logger.debug(f'{self.slide_type} index: +{added} -{removed} ~{changed} in {time.perf_counter()-procts:.3f}s')
+        return True
+
+    def __install(self, entries, scanned_at):
+        """ replace entries and resolver, only the scan time if entries is None """
+        if entries is not None:
+            ## build outside the lock, lookups keep using the previous resolver meanwhile
+            resolver = SlideNameResolver([x for x in entries.values() if x.has_med and x.has_aix])
+            view = SlideListView(entries.values())
+        with self.__lock:
+            if entries is not None:
+                self.__entries = entries
+                self.__resolver = resolver
+                self.__view = view
+                self.__generation += 1
+                self.__modified_at = scanned_at
+            self.__scanned_at = scanned_at
+            self.__built = True
+
+    def sync(self):
+        """ load the index published by another API worker, True if it was loaded """
+        if not self.__shared:
+            return False
+        try:
+            if self.__shared.slides_generation(self.slide_type) == self.__shared_generation:
+                return False
+            generation, scanned_at, rows = self.__shared.load_slides(self.slide_type)
+        except sqlite3.Error as e:
+            logger.error(f'SlideIndex.sync({self.slide_type}) failed: {e}')
+            return False
+        if not generation:
+            return False
+        entries = {}
+        for row in rows:
+            entry = SlideEntry(row[0], bool(row[1]), bool(row[2]), *row[3:])
+            entries[entry.slideid] = entry
+        self.__install(entries, scanned_at)
+        self.__shared_generation = generation
+        return True
+
+    def is_built(self):
+        """ True if the folder was scanned at least once """
+        return self.__built
+
+    def generation(self):
+        """ counter increased whenever the index content changes """
+        return self.__generation
+
+    def scanned_at(self):
+        """ timestamp of the last successful scan """
+        return self.__scanned_at
+
+    def version(self):
+        """ (generation, timestamp of the last content change), same in all API workers with SharedState """
+        with self.__lock:
+            generation = self.__shared_generation if self.__shared else self.__generation
+            return generation, self.__modified_at
+
+    def slide_file(self, slideid, ext='.aix'):
+        """
+        path of .med/.aix of slideid in the indexed folder
+        the one key of QC result cache and shared state for queries, slide watcher and slide store
+        """
+        return os.path.join(self.folder, f'{slideid}{ext}')
+
+    def lookup(self, slideid):
+        """ get SlideEntry of slideid, None if not found """
+        return self.__entries.get(slideid)
+
+    def find_latest(self, slide_id):
+        """ latest scanned analyzed slide whose name contains slide_id, None if not found """
+        return self.__resolver.find_latest(slide_id)
+
+    def list_view(self):
+        """ SlideListView of the current scan, replaced (not changed) by later scans """
+        return self.__view
+
+    def analyzed_slides(self):
+        """ slide names having both .med and .aix """
+        entries = self.__entries
+        return [k for k, v in entries.items() if v.has_med and v.has_aix]
+
+class SlideIndexService:
+    """ slide indexes of all slide types with background refresh
+    with SharedState only the leader of API workers re-scans, others load what it published
+    """
+    def __init__(self, slide_types, shared=None, leader=None):
+        self.__indexes = {stype: SlideIndex(stype, shared=shared) for stype in slide_types}
+        self.__shared = shared
+        self.__leader = leader
+        self.__build = SingleFlight('index')
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def get_index(self, slide_type):
+        """ get SlideIndex of slide_type, build it on first use """
+        sindex = self.__indexes.get(slide_type.lower())
+        if sindex is not None and not sindex.is_built():
+            ## requests before the first scan share one folder listing
+            self.__build.do(sindex.slide_type, self.__build_index, sindex)
+        return sindex
+
+    @staticmethod
+    def __build_index(sindex):
+        if not sindex.is_built() and not sindex.sync():
+            sindex.refresh()
+
+    def rescan(self, slide_type=None):
+        """ force re-scan of one slide type or all of them """
+        stypes = [slide_type.lower()] if slide_type else list(self.__indexes)
+        ret = {}
+        for stype in stypes:
+            sindex = self.__indexes.get(stype)
+            if sindex is None:
+                continue
+            sindex.refresh()
+            ret[stype] = len(sindex.analyzed_slides())
+        return ret
+
+    def __refresh_loop(self, interval):
+        while not self.__stop.wait(interval):
+            if not storageMonitor.is_alive():
+                ## keep previous entries, do not block on a lost connection
+                continue
+            for sindex in self.__indexes.values():
+                sindex.refresh()
+
+    def __shared_loop(self, interval):
+        """ leader re-scans every interval, everyone loads newer published indexes """
+        last_scan = time.monotonic()
+        while not self.__stop.wait(MYENV.SHARED_SYNC_SECONDS):
+            leader = self.__leader is not None and self.__leader.is_leader()
+            if leader and time.monotonic()-last_scan >= interval and storageMonitor.is_alive():
+                last_scan = time.monotonic()
+                for sindex in self.__indexes.values():
+                    sindex.refresh()
+                continue
+            for sindex in self.__indexes.values():
+                sindex.sync()
+
+    def start(self, interval=None):
+        """ build indexes once (or load them from another API worker), then refresh them in a daemon thread """
+        for sindex in self.__indexes.values():
+            if not sindex.sync():
+                sindex.refresh()
+        if self.__thread is not None:
+            return
+        interval = interval if interval else MYENV.SLIDEINDEX_REFRESH_SECONDS
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__shared_loop if self.__shared else self.__refresh_loop, args=(interval,),
+                                         name='slideindex', daemon=True)
+        self.__thread.start()
+        logger.info(f'slide index service started, refresh every {interval} seconds')
+
+    def stop(self):
+        """ stop background refresh """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout=5)
+            self.__thread = None
+
+slideIndex = SlideIndexService(SLIDE_TYPES, sharedState, leaderLease)
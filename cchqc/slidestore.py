@@ -0,0 +1,268 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.slidestore
+  slide metadata and per-slide category counts in SQLite under AMAQC_HOME/metadata, kept in sync with the slide index
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from loguru import logger
+from cchqc.config import MYENV
+from cchqc.slideindex import slideIndex, SLIDE_TYPES
+from cchqc.storagemonitor import storageMonitor
+from cchqc.qcxfuncs import load_qc_summary, category_names, parse_scan_time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS slides (slide_type TEXT NOT NULL, slidename TEXT NOT NULL, pathology_id TEXT NOT NULL,
+    med_mtime REAL NOT NULL, med_size INTEGER NOT NULL, aix_mtime REAL NOT NULL, aix_size INTEGER NOT NULL,
+    model TEXT, version TEXT, PRIMARY KEY (slide_type, slidename));
+CREATE TABLE IF NOT EXISTS slidecounts (slide_type TEXT NOT NULL, slidename TEXT NOT NULL, category TEXT NOT NULL,
+    count INTEGER NOT NULL, PRIMARY KEY (slide_type, slidename, category));
+CREATE INDEX IF NOT EXISTS slides_pathology_id ON slides (slide_type, pathology_id);
+CREATE INDEX IF NOT EXISTS slides_med_mtime ON slides (slide_type, med_mtime);
+CREATE INDEX IF NOT EXISTS slidecounts_count ON slidecounts (slide_type, category, count);
+'''
+ORDER_COLUMNS = {'scanned': 's.med_mtime', 'name': 's.slidename', 'pathology_id': 's.pathology_id', 'count': 'c.count'}
+SYNC_BATCH = 100    # slides written per transaction, queries see progress of a long first sync
+KNOWN_CATEGORIES = {x for model, version in (('AIxURO', ''), ('AIxTHY', '2024.2'), ('AIxTHY', '2025.2'))
+                    for x in category_names({'Model': model, 'ModelVersion': version})}
+
+def pathology_id_of(slidename):
+    """ pathology id in slide name by PATHOLOGY_ID_PATTERN, whole name if it does not match """
+    found = re.search(MYENV.PATHOLOGY_ID_PATTERN, slidename)
+    return found.group(0) if found and found.group(0) else slidename
+
+class SlideStore:
+    """ SQLite file (WAL) opened once per thread, written by one sync thread and read by queries of any worker """
+    def __init__(self, dbfile):
+        self.dbfile = dbfile
+        self.__local = threading.local()
+
+    def __connection(self):
+        conn = getattr(self.__local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.dbfile), exist_ok=True)
+            conn = sqlite3.connect(self.dbfile, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self.__local.conn = conn
+        return conn
+
+    def signatures(self, slide_type):
+        """ {slidename: (med_mtime, med_size, aix_mtime, aix_size)} of stored slides """
+        rows = self.__connection().execute('SELECT slidename, med_mtime, med_size, aix_mtime, aix_size FROM slides '
+                                           'WHERE slide_type = ?', (slide_type,))
+        return {x[0]: tuple(x[1:]) for x in rows}
+
+    def put_slides(self, slide_type, records):
+        """
+        add or replace slides with their counts in one transaction
+          :param records: list of (SlideEntry, model, version, {category: count})
+        """
+        conn = self.__connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for entry, model, version, counts in records:
+                conn.execute('INSERT OR REPLACE INTO slides VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             (slide_type, entry.slideid, pathology_id_of(entry.slideid), entry.med_mtime, entry.med_size,
+                              entry.aix_mtime, entry.aix_size, model, version))
+                conn.execute('DELETE FROM slidecounts WHERE slide_type = ? AND slidename = ?', (slide_type, entry.slideid))
+                conn.executemany('INSERT INTO slidecounts VALUES (?, ?, ?, ?)',
+                                 [(slide_type, entry.slideid, k, v) for k, v in counts.items()])
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def delete_slides(self, slide_type, slidenames):
+        """ remove slides no longer in image storage """
+        conn = self.__connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('DELETE FROM slides WHERE slide_type = ? AND slidename = ?', [(slide_type, x) for x in slidenames])
+            conn.executemany('DELETE FROM slidecounts WHERE slide_type = ? AND slidename = ?', [(slide_type, x) for x in slidenames])
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def sync(self, slide_type, sindex):
+        """
+        store new or changed analyzed slides of SlideIndex, drop removed ones
+          :param slide_type: urine or thyroid
+          :param sindex: SlideIndex of slide_type
+        returns (stored, removed, failed, retry), slides of retry are not stored and tried again by the next sync
+        """
+        stored = self.signatures(slide_type)
+        current = {}
+        for slidename in sindex.analyzed_slides():
+            entry = sindex.lookup(slidename)
+            if entry is not None:
+                current[slidename] = entry
+        removed = [x for x in stored if x not in current]
+        if removed:
+            self.delete_slides(slide_type, removed)
+        changed = [x for k, x in current.items() if stored.get(k) != (x.med_mtime, x.med_size, x.aix_mtime, x.aix_size)]
+        records, nstored, nfailed, nretry = [], 0, 0, 0
+        for entry in changed:
+            aixfile = sindex.slide_file(entry.slideid)
+            try:
+                ## sidecar or parse, a sync over the whole archive must not evict slides users query
+                summary = load_qc_summary(aixfile, cache=False)
+                aixinfo = summary.aixinfo
+                counts = dict(zip(category_names(aixinfo), summary.cellscount))
+                records.append((entry, aixinfo.get('Model'), aixinfo.get('ModelVersion'), counts))
+            except (zlib.error, EOFError, ValueError, KeyError, IndexError, TypeError) as e:
+                ## broken or truncated .aix, stored without model and counts, not retried until .aix changes
+                logger.warning(f'SlideStore.sync({slide_type}) can not summarize {entry.slideid}: {e}')
+                records.append((entry, None, None, {}))
+                nfailed += 1
+            except OSError as e:
+                ## e.g. SMB error, not stored so the next sync tries it again
+                logger.warning(f'SlideStore.sync({slide_type}) can not read {entry.slideid}, retry later: {e}')
+                nretry += 1
+                continue
+            if len(records) >= SYNC_BATCH:
+                self.put_slides(slide_type, records)
+                nstored += len(records)
+                records = []
+        if records:
+            self.put_slides(slide_type, records)
+            nstored += len(records)
+        return nstored, len(removed), nfailed, nretry
+
+    def query(self, slide_type, pathology_id=None, scanned_from=None, scanned_to=None, model=None, version=None,
+              category=None, min_count=None, max_count=None, order_by='scanned', descending=True, limit=100, offset=0):
+        """
+        stored slides matching all given filters
+          :param slide_type: urine or thyroid
+          :param pathology_id: exact pathology id
+          :param scanned_from: .med mtime >= this timestamp
+          :param scanned_to: .med mtime < this timestamp
+          :param model: model name, e.g. AIxURO
+          :param version: model version prefix, e.g. 2025.2
+          :param category: cell category for min_count/max_count and order_by count
+          :param order_by: scanned, name, pathology_id or count
+        """
+        clauses, params = ['s.slide_type = ?'], [slide_type]
+        joins = ''
+        if category:
+            joins = 'JOIN slidecounts c ON c.slide_type = s.slide_type AND c.slidename = s.slidename AND c.category = ?'
+            params.insert(0, category)
+            if min_count is not None:
+                clauses.append('c.count >= ?')
+                params.append(min_count)
+            if max_count is not None:
+                clauses.append('c.count <= ?')
+                params.append(max_count)
+        for clause, value in (('s.pathology_id = ?', pathology_id), ('s.med_mtime >= ?', scanned_from),
+                              ('s.med_mtime < ?', scanned_to), ('s.model = ?', model)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        if version:
+            ## prefix match as a range, stays on the index
+            clauses.append('s.version >= ? AND s.version < ?')
+            params.extend([version, version + '\U0010ffff'])
+        order = f"{ORDER_COLUMNS[order_by]} {'DESC' if descending else 'ASC'}, s.slidename"
+        sql = (f'SELECT s.slidename, s.pathology_id, s.med_mtime, s.med_size, s.aix_size, s.model, s.version '
+               f"FROM slides s {joins} WHERE {' AND '.join(clauses)} ORDER BY {order} LIMIT ? OFFSET ?")
+        conn = self.__connection()
+        rows = conn.execute(sql, params + [limit, offset]).fetchall()
+        counts = {}
+        if rows:
+            marks = ', '.join('?' for _ in rows)
+            for slidename, cname, count in conn.execute(f'SELECT slidename, category, count FROM slidecounts '
+                                                        f'WHERE slide_type = ? AND slidename IN ({marks})',
+                                                        [slide_type] + [x[0] for x in rows]):
+                counts.setdefault(slidename, {})[cname] = count
+        return [{
+            'slidename': x[0],
+            'pathology_id': x[1],
+            'scanned_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(x[2])),
+            'med_size': x[3],
+            'aix_size': x[4],
+            'model': x[5],
+            'version': x[6],
+            'counts': counts.get(x[0], {})
+        } for x in rows]
+
+class SlideStoreService:
+    """ sync SlideStore with the slide index in a daemon thread, only after the index changed """
+    def __init__(self, store, slide_types, interval):
+        self.store = store
+        self.slide_types = [x.lower() for x in slide_types]
+        self.interval = interval
+        self.__generations = {}
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def sync_once(self):
+        """ sync slide types whose slide index generation changed """
+        for slide_type in self.slide_types:
+            if self.__stop.is_set() or not storageMonitor.is_alive():
+                return
+            sindex = slideIndex.get_index(slide_type)
+            if sindex is None or self.__generations.get(slide_type) == sindex.generation():
+                continue
+            generation = sindex.generation()
+            procts = time.perf_counter()
+            try:
+                nstored, nremoved, nfailed, nretry = self.store.sync(slide_type, sindex)
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f'SlideStoreService: sync of {slide_type} failed: {e}')
+                continue
+            if not nretry:
+                ## else sync again at the next check though the index did not change
+                self.__generations[slide_type] = generation
+            if nstored or nremoved or nretry:
+                logger.info(f'slide store {slide_type}: {nstored} stored ({nfailed} failed), {nremoved} removed, '
+                            f'{nretry} to retry in {time.perf_counter()-procts:.3f}s')
+
+    def __sync_loop(self):
+        self.sync_once()
+        while not self.__stop.wait(self.interval):
+            self.sync_once()
+
+    def start(self):
+        """ sync now and then every interval in a daemon thread """
+        if self.__thread is not None:
+            return
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__sync_loop, name='slidestore', daemon=True)
+        self.__thread.start()
+        logger.info(f'slide store service started, check every {self.interval} seconds')
+
+    def stop(self):
+        """ stop background sync """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout=5)
+            self.__thread = None
+
+slideStore = SlideStore(os.path.join(MYENV.AMAQC_HOME, 'metadata', 'slide_store.db'))
+slideStoreService = SlideStoreService(slideStore, SLIDE_TYPES, MYENV.SLIDESTORE_SYNC_SECONDS)
+
+def query_slide_store(slide_type, pathology_id=None, scanned_from=None, scanned_to=None, model=None, version=None,
+                      category=None, min_count=None, max_count=None, order_by='scanned', descending=True, limit=100, offset=0):
+    """
+    query slides of the slide store, parameters as SlideStore.query() but scan times as ISO date/datetime
+    code -4 for invalid parameters
+    """
+    if category and category not in KNOWN_CATEGORIES:
+        return {'code': -4, 'data': f'unknown cell category {category}'}
+    if order_by not in ORDER_COLUMNS or (order_by == 'count' and not category):
+        return {'code': -4, 'data': f'can not order by {order_by}' + ('' if category else ' without category')}
+    if (min_count is not None or max_count is not None) and not category:
+        return {'code': -4, 'data': 'min_count/max_count need category'}
+    if not 1 <= limit <= MYENV.SLIDESTORE_MAX_ROWS or offset < 0:
+        return {'code': -4, 'data': f'limit must be 1 to {MYENV.SLIDESTORE_MAX_ROWS}, offset not negative'}
+    try:
+        scanned_from, scanned_to = parse_scan_time(scanned_from), parse_scan_time(scanned_to)
+    except ValueError as e:
+        return {'code': -4, 'data': f'invalid scan time: {e}'}
+    slides = slideStore.query(slide_type.lower(), pathology_id, scanned_from, scanned_to, model, version,
+                              category, min_count, max_count, order_by, descending, limit, offset)
+    return {'code': 0, 'data': slides}
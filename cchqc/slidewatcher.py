@@ -0,0 +1,192 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.slidewatcher
+  watch slide folders, warm QC result cache as soon as new .med/.aix pairs are complete
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from cchqc.config import MYENV
+from cchqc.metrics import qcMetrics
+from cchqc.slideindex import slideIndex, SLIDE_TYPES
+from cchqc.storagemonitor import storageMonitor
+from cchqc.qcxfuncs import load_qc_summary
+
+def pair_signature(folder, slideid):
+    """
+    (med_size, med_mtime, aix_size, aix_mtime) of a slide, None if one of them is missing
+      :param folder: slide type folder
+      :param slideid: slide name without extension
+    """
+    try:
+        medstat = os.stat(os.path.join(folder, f'{slideid}.med'))
+        aixstat = os.stat(os.path.join(folder, f'{slideid}.aix'))
+    except OSError:
+        return None
+    return (medstat.st_size, medstat.st_mtime, aixstat.st_size, aixstat.st_mtime)
+
+class SlideWatcher:
+    """ poll slide folders, parse stable new slides on a bounded pool
+    a folder is only re-scanned when its mtime or its slide index changes,
+    .aix re-written in place is found by the background refresh of the slide index
+    """
+    def __init__(self, slide_types, interval, stable_seconds, max_workers):
+        self.slide_types = [x.lower() for x in slide_types]
+        self.interval = interval
+        self.stable_seconds = stable_seconds
+        self.max_workers = max_workers
+        self.__lock = threading.Lock()
+        self.__dirmtimes = {}
+        self.__generations = {}
+        self.__seen = {}
+        self.__pending = {}
+        self.__inflight = set()
+        self.__executor = None
+        self.__stats = {'polls': 0, 'skipped': 0, 'warmed': 0, 'failed': 0}
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def __submit(self, slide_type, aixfile, slideid, signature):
+        """ parse .aix into QC result cache on the watcher pool """
+        key = (slide_type, slideid)
+        with self.__lock:
+            if key in self.__inflight:
+                return
+            self.__inflight.add(key)
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='slidewatcher')
+            executor = self.__executor
+        executor.submit(self.__warm, slide_type, aixfile, slideid, signature)
+
+    def __warm(self, slide_type, aixfile, slideid, signature):
+        procts = time.perf_counter()
+        try:
+            load_qc_summary(aixfile)
+        except Exception as e:
+            logger.error(f'SlideWatcher: failed to parse {aixfile}: {e}')
+            ok = False
+        else:
+            logger.debug(f'SlideWatcher: {aixfile} is cached in {time.perf_counter()-procts:.3f}s')
+            ok = True
+        with self.__lock:
+            self.__inflight.discard((slide_type, slideid))
+            self.__stats['warmed' if ok else 'failed'] += 1
+            ## a failed slide is retried only after it is re-written
+            self.__seen.setdefault(slide_type, {})[slideid] = signature
+
+    def poll_type(self, slide_type, now=None):
+        """
+        check one slide folder for new or re-written slides
+          :param slide_type: urine or thyroid
+          :param now: current time, for testing
+        """
+        now = now if now is not None else time.time()
+        sindex = slideIndex.get_index(slide_type)
+        if sindex is None:
+            return
+        try:
+            dirmtime = os.stat(sindex.folder).st_mtime
+        except OSError as e:
+            logger.error(f'SlideWatcher: can not stat {sindex.folder}: {e}')
+            return
+        with self.__lock:
+            self.__stats['polls'] += 1
+            pending = {k: v for k, v in self.__pending.items() if k[0] == slide_type}
+            unchanged = dirmtime == self.__dirmtimes.get(slide_type) and sindex.generation() == self.__generations.get(slide_type)
+            if unchanged and not pending:
+                ## nothing was added, renamed or deleted since the last poll
+                self.__stats['skipped'] += 1
+                return
+        if dirmtime != self.__dirmtimes.get(slide_type):
+            sindex.refresh()
+        current = {x: sindex.lookup(x) for x in sindex.analyzed_slides()}
+        with self.__lock:
+            self.__dirmtimes[slide_type] = dirmtime
+            self.__generations[slide_type] = sindex.generation()
+            seen = self.__seen.get(slide_type)
+            if seen is None:
+                ## baseline at start, slides already there are parsed on demand
+                self.__seen[slide_type] = {k: (v.med_size, v.med_mtime, v.aix_size, v.aix_mtime) for k, v in current.items()}
+                return
+            for slideid in list(seen):
+                if slideid not in current:
+                    del seen[slideid]
+            candidates = [k for k, v in current.items() if seen.get(k) != (v.med_size, v.med_mtime, v.aix_size, v.aix_mtime)]
+            candidates.extend(k[1] for k in pending if k[1] not in current)
+        for slideid in candidates:
+            key = (slide_type, slideid)
+            signature = pair_signature(sindex.folder, slideid)
+            with self.__lock:
+                if signature is None:
+                    self.__pending.pop(key, None)
+                    continue
+                if key in self.__inflight or self.__seen[slide_type].get(slideid) == signature:
+                    self.__pending.pop(key, None)
+                    continue
+                since = self.__pending.get(key)
+                if since is None or since[0] != signature:
+                    ## new or still being written, wait until it stops changing
+                    self.__pending[key] = (signature, now)
+                    continue
+                if now - since[1] < self.stable_seconds:
+                    continue
+                del self.__pending[key]
+            self.__submit(slide_type, sindex.slide_file(slideid), slideid, signature)
+
+    def poll_once(self, now=None):
+        """ check all slide folders once """
+        for slide_type in self.slide_types:
+            self.poll_type(slide_type, now)
+
+    def drain(self):
+        """ wait for submitted parses, for testing and shutdown """
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        """ poll and warm-up counters """
+        with self.__lock:
+            return {**self.__stats, 'pending': len(self.__pending), 'inflight': len(self.__inflight)}
+
+    def __watch_loop(self):
+        while not self.__stop.wait(self.interval):
+            if not storageMonitor.is_alive():
+                continue
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.error(f'SlideWatcher: poll failed: {e}')
+
+    def start(self):
+        """ take baseline of slide folders, then poll them in a daemon thread """
+        if self.__thread is not None:
+            return
+        self.poll_once()
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__watch_loop, name='slidewatcher', daemon=True)
+        self.__thread.start()
+        logger.info(f'slide watcher started, poll every {self.interval} seconds, stable after {self.stable_seconds} seconds')
+
+    def stop(self):
+        """ stop polling and wait for running parses """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout=5)
+            self.__thread = None
+        self.drain()
+
+slideWatcher = SlideWatcher(SLIDE_TYPES, MYENV.WATCHER_POLL_SECONDS, MYENV.WATCHER_STABLE_SECONDS, MYENV.WATCHER_WORKERS)
+
+def collect_watcher_metrics():
+    """ slide watcher counters for /metrics """
+    stats = slideWatcher.stats()
+    return [
+        ('qcapi_watcher_polls_total', 'counter', 'slide folder polls', [({}, stats['polls'])]),
+        ('qcapi_watcher_polls_skipped_total', 'counter', 'slide folder polls skipped by unchanged mtime', [({}, stats['skipped'])]),
+        ('qcapi_watcher_warmed_total', 'counter', 'new slides parsed into QC result cache', [({'result': 'ok'}, stats['warmed']), ({'result': 'failed'}, stats['failed'])]),
+        ('qcapi_watcher_pending', 'gauge', 'new slides waiting to be stable', [({}, stats['pending'])])
+    ]
+
+qcMetrics.add_collector(collect_watcher_metrics)
@@ -0,0 +1,175 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.storagemonitor
+  probe image storage in background, requests read the cached state
+"""
+import math
+import os
+import threading
+import time
+from loguru import logger
+from fastapi import HTTPException
+try:
+    import win32wnet
+    import pywintypes
+except ImportError:     ## not Windows, image storage is a local or mounted folder
+    win32wnet = None
+    pywintypes = None
+from cchqc.config import MYENV
+from cchqc.metrics import qcMetrics, storageProbesTotal, storageProbeSeconds
+
+def is_net_connection_alive(drivehome):
+    """ misc tools ♚
+    is NET drives still connected?? re-connect once if lost connection
+      :param drivehome: path in remote drive
+    """
+    if win32wnet is None:
+        return os.path.exists(drivehome)
+    reconn = False
+    driveletter = drivehome[:2]
+    if not os.path.exists(driveletter):
+        reconn = True
+    else:
+        if not os.path.exists(drivehome):
+            logger.trace(f'{driveletter} is connected, but not connected to {drivehome}, need to re-connect')
+            win32wnet.WNetCancelConnection2(driveletter, 1, True)
+            reconn = True
+    if reconn:  ## reconnect remote Windows computer
+        ## try re-connect
+        try:
+            win32wnet.WNetAddConnection2(0, driveletter, MYENV.DRIVEY_URL, None, MYENV.Y_USERNAME, MYENV.Y_PASSWORD)
+        except pywintypes.error as e:
+            logger.error(f'connection error: {e} ({drivehome})')
+        else:
+            logger.info(f'{drivehome} is re-connected to {driveletter}')
+    #
+    return os.path.exists(drivehome)
+
+class StorageMonitor:
+    """ cached state of image storage, probed and re-connected by a daemon thread """
+    def __init__(self, drivehome, interval, max_interval, timeout):
+        self.drivehome = drivehome
+        self.interval = interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.__lock = threading.Lock()
+        self.__alive = None
+        self.__checked_at = 0.0
+        self.__latency = None
+        self.__failures = 0
+        self.__probing_since = None
+        self.__next_probe_at = 0.0
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def __next_interval(self):
+        """ probe interval, doubled for each consecutive failure up to max_interval """
+        if self.__failures == 0:
+            return self.interval
+        return min(self.interval * 2**(self.__failures-1), self.max_interval)
+
+    def probe(self):
+        """ check (and re-connect) image storage now, update the cached state """
+        with self.__lock:
+            self.__probing_since = time.time()
+        procts = time.perf_counter()
+        try:
+            alive = is_net_connection_alive(self.drivehome)
+        except Exception as e:
+            logger.error(f'StorageMonitor.probe({self.drivehome}) failed: {e}')
+            alive = False
+        latency = time.perf_counter() - procts
+        storageProbesTotal.inc('up' if alive else 'down')
+        storageProbeSeconds.observe(latency)
+        with self.__lock:
+            changed = alive != self.__alive
+            self.__alive = alive
+            self.__checked_at = time.time()
+            self.__latency = latency
+            self.__probing_since = None
+            self.__failures = 0 if alive else self.__failures+1
+            self.__next_probe_at = self.__checked_at + self.__next_interval()
+        if changed and alive:
+            logger.info(f'image storage {self.drivehome} is up, probe took {latency:.3f}s')
+        elif changed:
+            logger.error(f'image storage {self.drivehome} is down, probe took {latency:.3f}s')
+        return alive
+
+    def is_alive(self):
+        """ cached state of image storage, False while a probe hangs over timeout """
+        with self.__lock:
+            alive, probing_since = self.__alive, self.__probing_since
+            stale = self.__thread is None and time.time() >= self.__next_probe_at
+        if probing_since is not None and time.time()-probing_since > self.timeout:
+            return False
+        if alive is None or stale:
+            ## monitor is not running, e.g. cli tools, probe on demand
+            return self.probe()
+        return alive
+
+    def retry_after(self):
+        """ seconds until the next probe, for Retry-After header """
+        with self.__lock:
+            remaining = self.__next_probe_at - time.time()
+        return max(1, math.ceil(remaining)) if remaining > 0 else self.interval
+
+    def status(self):
+        """ state of image storage for /health """
+        with self.__lock:
+            alive, probing_since = self.__alive, self.__probing_since
+            status = {
+                'status': 'unknown' if alive is None else ('up' if alive else 'down'),
+                'drivehome': self.drivehome,
+                'checked_at': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.__checked_at)) if self.__checked_at else None,
+                'latency_ms': None if self.__latency is None else round(self.__latency*1000, 1),
+                'failures': self.__failures
+            }
+        if probing_since is not None and time.time()-probing_since > self.timeout:
+            status['status'] = 'down'
+            status['probing_for'] = round(time.time()-probing_since, 1)
+        if status['status'] != 'up':
+            status['retry_after'] = self.retry_after()
+        return status
+
+    def __probe_loop(self):
+        while True:
+            with self.__lock:
+                wait = max(0.0, self.__next_probe_at - time.time())
+            if self.__stop.wait(wait):
+                return
+            self.probe()
+
+    def start(self):
+        """ probe image storage once, then keep probing in a daemon thread """
+        if self.__thread is not None:
+            return
+        self.probe()
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__probe_loop, name='storagemonitor', daemon=True)
+        self.__thread.start()
+        logger.info(f'storage monitor started, probe {self.drivehome} every {self.interval} seconds')
+
+    def stop(self):
+        """ stop background probing """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout=5)
+            self.__thread = None
+
+def storage_unavailable(errmsg):
+    """
+    HTTPException 503 with Retry-After of the next storage probe
+      :param errmsg: detail of the response
+    """
+    return HTTPException(status_code=503, detail=errmsg, headers={'Retry-After': str(storageMonitor.retry_after())})
+
+storageMonitor = StorageMonitor(MYENV.DRIVEY_HOME, MYENV.STORAGE_PROBE_SECONDS,
+                                MYENV.STORAGE_PROBE_MAX_SECONDS, MYENV.STORAGE_PROBE_TIMEOUT)
+
+def collect_storage_metrics():
+    """ image storage state for /metrics """
+    status = storageMonitor.status()
+    return [
+        ('qcapi_storage_up', 'gauge', '1 if image storage is reachable', [({}, 1 if status['status'] == 'up' else 0)]),
+        ('qcapi_storage_probe_failures', 'gauge', 'consecutive failed storage probes', [({}, status['failures'])])
+    ]
+
+qcMetrics.add_collector(collect_storage_metrics)
@@ -6,7 +6,9 @@ from typing import Optional
 from loguru import logger
 from fastapi import APIRouter, Query, Request, HTTPException
 from cchqc.config import serviceHistory, TSaction
+from cchqc.workers import storagePool
 from cchqc.qcxfuncs import open_med_with_cytoinsights, summarize_cell_counts_to_csv
+from cchqc.watchwsi import wsiMover
 
 localapi = APIRouter()
 
@@ -24,7 +26,7 @@ async def open_medfile(medfile: str, request: Request):
         logger.error(errmsg)
         serviceHistory.append(f"{procts.action_at()},openmed,{request.client.host},failed,{procts.consumed_time()},{errmsg}")
         raise HTTPException(status_code=404, detail=errmsg)
-    err = open_med_with_cytoinsights(medfile)
+    err = await storagePool.run(open_med_with_cytoinsights, medfile)
     errstat = 'completed' if err['code'] == 0 else 'failed'
     serviceHistory.append(f"{procts.action_at()},openmed,{request.client.host},{errstat},{procts.consumed_time()},{err['data']}")
     return err
@@ -44,10 +46,18 @@ async def summarize_cells_count(
     csvfname = ''
     workpath = aixpath if aixpath else ''
     if category.lower() in ['urine', 'thyroid']:
-        csvfname = summarize_cell_counts_to_csv(category, workpath)
+        csvfname = await storagePool.run(summarize_cell_counts_to_csv, category, workpath)
     if not csvfname:
         errmsg = f'can not find any .aix file in {aixpath}'
         serviceHistory.append(f"{procts.action_at()},summary,{request.client.host},failed,{procts.consumed_time()},{errmsg}")
         raise HTTPException(status_code=404, detail=errmsg)
     serviceHistory.append(f"{procts.action_at()},summary,{request.client.host},completed,{procts.consumed_time()},{csvfname}")
     return f'{csvfname} completed!'
+
+@localapi.get('/watchwsi', summary='watchwsi throughput and queue depth', include_in_schema=False)
+async def get_watchwsi_statistics(request: Request):
+    """ local private endpoint: moved files, bytes, throughput and queue depth of watchwsi """
+    procts = TSaction()
+    stats = wsiMover.stats()
+    serviceHistory.append(f"{procts.action_at()},watchwsi,{request.client.host},completed,{procts.consumed_time()},queue {stats['queue_depth']} moved {stats['files_moved']}")
+    return stats
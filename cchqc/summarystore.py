@@ -0,0 +1,90 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.summarystore
+  persistent per-slide summary of .aix files under AMAQC_HOME/metadata
+"""
+import json
+import os
+import threading
+from loguru import logger
+from cchqc.config import MYENV
+
+STORE_VERSION = 1
+
+class SummaryStore:
+    """ {aixfile: summary record} saved as JSON, record is valid while mtime/size unchanged """
+    def __init__(self, storefile):
+        self.storefile = storefile
+        self.__lock = threading.Lock()
+        self.__records = {}
+        self.__dirty = False
+        self.load()
+
+    def load(self):
+        """ load records, start empty if store is missing or unreadable """
+        if not os.path.exists(self.storefile):
+            return
+        try:
+            with open(self.storefile, 'r', encoding='utf-8') as fstore:
+                stored = json.load(fstore)
+        except (OSError, ValueError) as e:
+            logger.error(f'SummaryStore.load({self.storefile}) failed: {e}')
+            return
+        if stored.get('version') != STORE_VERSION:
+            logger.warning(f'{self.storefile} is version {stored.get("version")}, rebuild it')
+            return
+        with self.__lock:
+            self.__records = stored.get('records', {})
+
+    def get(self, aixfile, mtime, size):
+        """
+        get record of aixfile, None if missing or .aix was changed
+          :param aixfile: .aix filename
+          :param mtime: current st_mtime of .aix
+          :param size: current st_size of .aix
+        """
+        record = self.__records.get(aixfile)
+        if record is None or record['mtime'] != mtime or record['size'] != size:
+            return None
+        return record
+
+    def put(self, record):
+        """ add or replace record, keyed by record['path'] """
+        with self.__lock:
+            self.__records[record['path']] = record
+            self.__dirty = True
+
+    def records(self):
+        """ copy of all records """
+        with self.__lock:
+            return dict(self.__records)
+
+    def save(self):
+        """ write store atomically if changed """
+        with self.__lock:
+            if not self.__dirty:
+                return
+            stored = {'version': STORE_VERSION, 'records': self.__records}
+            tmpfile = f'{self.storefile}.tmp'
+            try:
+                os.makedirs(os.path.dirname(self.storefile), exist_ok=True)
+                with open(tmpfile, 'w', encoding='utf-8') as fstore:
+                    json.dump(stored, fstore)
+                os.replace(tmpfile, self.storefile)
+                self.__dirty = False
+            except OSError as e:
+                logger.error(f'SummaryStore.save({self.storefile}) failed: {e}')
+
+summaryStores = {}
+summaryStoresLock = threading.Lock()
+
+def get_summary_store(slidetype):
+    """
+    get SummaryStore of slide type
+      :param slidetype: urine or thyroid
+    """
+    with summaryStoresLock:
+        store = summaryStores.get(slidetype.lower())
+        if store is None:
+            storefile = os.path.join(MYENV.AMAQC_HOME, 'metadata', f'summary_store_{slidetype.lower()}.json')
+            store = SummaryStore(storefile)
+            summaryStores[slidetype.lower()] = store
+        return store
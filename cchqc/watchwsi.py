@@ -0,0 +1,335 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.watchwsi
+  watchwsi: move finished WSI files from scanner folders into the inference watch folder
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from cchqc.config import MYENV
+from cchqc.metrics import qcMetrics
+
+PART_SUFFIX = '.part'
+JOURNAL_COMPACT_RECORDS = 1000  # compact the journal after this many appended records
+
+class BandwidthLimiter:
+    """ token bucket shared by all copy workers """
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self.__lock = threading.Lock()
+        self.__next_at = time.monotonic()
+
+    def consume(self, nbytes):
+        """
+        wait until nbytes may be transferred
+          :param nbytes: size of next chunk
+        """
+        if self.bytes_per_second <= 0:
+            return
+        with self.__lock:
+            now = time.monotonic()
+            start = max(now, self.__next_at)
+            self.__next_at = start + nbytes/self.bytes_per_second
+        if start > now:
+            time.sleep(start-now)
+
+class MoveJournal:
+    """ append-only JSON lines of queued/done moves, replayed after a crash """
+    def __init__(self, journalfile):
+        self.journalfile = journalfile
+        self.__lock = threading.Lock()
+        self.__appended = 0
+
+    def appended(self):
+        """ records appended since the last compaction """
+        return self.__appended
+
+    def load(self):
+        """ last record of each source file, {src: record} """
+        records = {}
+        if not os.path.exists(self.journalfile):
+            return records
+        with open(self.journalfile, 'r', encoding='utf-8') as fjournal:
+            for line in fjournal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    ## torn last line of a crash
+                    continue
+                records[record['src']] = record
+        return records
+
+    def append(self, event, src, dst, size, mtime):
+        """
+        append one record and fsync it
+          :param event: queued, done or failed
+        """
+        record = {'ts': time.time(), 'event': event, 'src': src, 'dst': dst, 'size': size, 'mtime': mtime}
+        with self.__lock:
+            os.makedirs(os.path.dirname(self.journalfile), exist_ok=True)
+            with open(self.journalfile, 'a', encoding='utf-8') as fjournal:
+                fjournal.write(json.dumps(record)+'\n')
+                fjournal.flush()
+                os.fsync(fjournal.fileno())
+            self.__appended += 1
+
+    def compact(self, keep):
+        """
+        rewrite journal with the last record of each source file if keep(record) is True
+          :param keep: predicate of records still needed
+        appends wait meanwhile, no record of a running move is lost
+        """
+        with self.__lock:
+            records = [x for x in self.load().values() if keep(x)]
+            os.makedirs(os.path.dirname(self.journalfile), exist_ok=True)
+            tmpfile = f'{self.journalfile}.tmp'
+            with open(tmpfile, 'w', encoding='utf-8') as fjournal:
+                for record in records:
+                    fjournal.write(json.dumps(record)+'\n')
+            os.replace(tmpfile, self.journalfile)
+            self.__appended = 0
+
+class WsiMover:
+    """ poll scanner folders, copy stable WSI files concurrently, rename them into the watch folder """
+    def __init__(self, sources, target, extensions, journalfile, interval=5, stable_seconds=30,
+                 workers=4, bytes_per_second=0, keep_source=False, chunksize=4 << 20):
+        self.sources = sources
+        self.target = target
+        self.extensions = {x.lower() for x in extensions}
+        self.interval = interval
+        self.stable_seconds = stable_seconds
+        self.workers = workers
+        self.keep_source = keep_source
+        self.chunksize = chunksize
+        self.limiter = BandwidthLimiter(bytes_per_second)
+        self.journal = MoveJournal(journalfile)
+        self.__lock = threading.Lock()
+        self.__candidates = {}
+        self.__queued = set()
+        self.__settled = {}
+        self.__active = 0
+        self.__stats = {'files_moved': 0, 'files_failed': 0, 'bytes_copied': 0, 'bytes_resumed': 0}
+        self.__recent = deque()
+        self.__executor = None
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def __record_bytes(self, nbytes):
+        """ bytes copied per second of the last minute, for throughput """
+        second = int(time.monotonic())
+        with self.__lock:
+            self.__stats['bytes_copied'] += nbytes
+            if self.__recent and self.__recent[-1][0] == second:
+                self.__recent[-1][1] += nbytes
+            else:
+                self.__recent.append([second, nbytes])
+            while self.__recent and self.__recent[0][0] < second-60:
+                self.__recent.popleft()
+
+    def __keep_record(self, record):
+        """ journal records still needed: moves not done yet, moved sources kept in scanner folders """
+        if record['event'] == 'queued':
+            return True
+        return record['event'] == 'done' and self.keep_source and os.path.exists(record['src'])
+
+    def recover(self):
+        """ re-queue moves which were not done before the last shutdown or crash """
+        records = self.journal.load()
+        for src, record in records.items():
+            if record['event'] == 'done':
+                if self.keep_source and os.path.exists(src):
+                    self.__settled[src] = (record['size'], record['mtime'])
+                continue
+            if record['event'] != 'queued':
+                continue
+            logger.info(f'watchwsi: resume moving {src}')
+            self.__enqueue(src, record['dst'], record['size'], record['mtime'], resume=True)
+        self.journal.compact(self.__keep_record)
+
+    def __enqueue(self, src, dst, size, mtime, resume=False):
+        with self.__lock:
+            if src in self.__queued:
+                return
+            self.__queued.add(src)
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='watchwsi')
+            executor = self.__executor
+        if not resume:
+            self.journal.append('queued', src, dst, size, mtime)
+        executor.submit(self.__move, src, dst, size, mtime, resume)
+
+    def scan_once(self, now=None):
+        """
+        list scanner folders, queue files whose size and mtime stay unchanged for stable_seconds
+          :param now: current time, for testing
+        """
+        now = now if now is not None else time.time()
+        found = set()
+        for source in self.sources:
+            try:
+                with os.scandir(source) as entries:
+                    for entry in entries:
+                        if os.path.splitext(entry.name)[1].lower() not in self.extensions or not entry.is_file():
+                            continue
+                        fstat = entry.stat()
+                        found.add(entry.path)
+                        self.__check_candidate(entry.path, entry.name, fstat.st_size, fstat.st_mtime, now)
+            except OSError as e:
+                logger.error(f'watchwsi: can not scan {source}: {e}')
+        with self.__lock:
+            for src in list(self.__candidates):
+                if src not in found:
+                    del self.__candidates[src]
+        if self.journal.appended() >= JOURNAL_COMPACT_RECORDS:
+            self.journal.compact(self.__keep_record)
+
+    def __check_candidate(self, src, name, size, mtime, now):
+        with self.__lock:
+            if src in self.__queued or self.__settled.get(src) == (size, mtime):
+                return
+            since = self.__candidates.get(src)
+            if since is None or since[0] != (size, mtime):
+                ## new or still being written by the scanner
+                self.__candidates[src] = ((size, mtime), now)
+                return
+            if now - since[1] < self.stable_seconds:
+                return
+            del self.__candidates[src]
+        self.__enqueue(src, os.path.join(self.target, name), size, mtime)
+
+    def __copy(self, src, partfile, size, resume):
+        """ copy src to partfile, continue a partial copy of the same source if resume """
+        offset = os.path.getsize(partfile) if resume and os.path.exists(partfile) else 0
+        if offset > size:
+            offset = 0
+        if offset:
+            with self.__lock:
+                self.__stats['bytes_resumed'] += offset
+        with open(src, 'rb') as fsrc, open(partfile, 'r+b' if offset else 'wb') as fdst:
+            fsrc.seek(offset)
+            fdst.seek(offset)
+            fdst.truncate()
+            while True:
+                self.limiter.consume(self.chunksize)
+                chunk = fsrc.read(self.chunksize)
+                if not chunk:
+                    break
+                fdst.write(chunk)
+                self.__record_bytes(len(chunk))
+            fdst.flush()
+            os.fsync(fdst.fileno())
+
+    @staticmethod
+    def __unchanged(src, size, mtime):
+        """ True if src still has the size and mtime it was queued with """
+        fstat = os.stat(src)
+        return (fstat.st_size, fstat.st_mtime) == (size, mtime)
+
+    def __move(self, src, dst, size, mtime, resume):
+        partfile = dst + PART_SUFFIX
+        with self.__lock:
+            self.__active += 1
+        try:
+            if resume and os.path.exists(dst) and os.path.getsize(dst) == size:
+                ## journaled move of this source was renamed before the last crash, source may not be removed yet
+                logger.info(f'watchwsi: {dst} was already moved')
+                if not self.keep_source and os.path.exists(src) and self.__unchanged(src, size, mtime):
+                    os.remove(src)
+            else:
+                if not self.__unchanged(src, size, mtime):
+                    ## changed after it was queued, the next scan picks it up again
+                    raise ValueError(f'{src} was changed while queued')
+                if os.path.exists(dst):
+                    ## e.g. the same name from another scanner folder, never overwrite or drop a WSI
+                    raise FileExistsError(f'{dst} already exists')
+                self.__copy(src, partfile, size, resume)
+                if os.path.getsize(partfile) != size:
+                    raise OSError(f'{partfile} size mismatch')
+                os.replace(partfile, dst)
+                if not self.keep_source:
+                    os.remove(src)
+            self.journal.append('done', src, dst, size, mtime)
+            with self.__lock:
+                self.__stats['files_moved'] += 1
+                if self.keep_source:
+                    self.__settled[src] = (size, mtime)
+            logger.info(f'watchwsi: {src} is moved to {dst}')
+        except Exception as e:
+            logger.error(f'watchwsi: failed to move {src}: {e}')
+            self.journal.append('failed', src, dst, size, mtime)
+            with self.__lock:
+                self.__stats['files_failed'] += 1
+                ## do not retry until the source is changed
+                self.__settled[src] = (size, mtime)
+        finally:
+            with self.__lock:
+                self.__active -= 1
+                self.__queued.discard(src)
+
+    def drain(self):
+        """ wait for queued moves, for testing and shutdown """
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        """ throughput and queue depth of the mover """
+        with self.__lock:
+            second = int(time.monotonic())
+            recent = sum(x[1] for x in self.__recent if x[0] >= second-60)
+            return {
+                **self.__stats,
+                'waiting': len(self.__candidates),
+                'queue_depth': len(self.__queued) - self.__active,
+                'active': self.__active,
+                'throughput_mbps': round(recent/60/1024/1024, 3)
+            }
+
+    def __watch_loop(self):
+        while not self.__stop.wait(self.interval):
+            self.scan_once()
+
+    def start(self):
+        """ recover journal, then scan scanner folders in a daemon thread """
+        if self.__thread is not None:
+            return
+        if not self.sources or not self.target:
+            logger.error('watchwsi is not started, WATCHWSI_SOURCES and WATCHWSI_TARGET are required')
+            return
+        os.makedirs(self.target, exist_ok=True)
+        self.recover()
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__watch_loop, name='watchwsi', daemon=True)
+        self.__thread.start()
+        logger.info(f'watchwsi started, {self.sources} -> {self.target} with {self.workers} workers')
+
+    def stop(self):
+        """ stop scanning and wait for running copies """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout=5)
+            self.__thread = None
+        self.drain()
+
+wsiMover = WsiMover(MYENV.WATCHWSI_SOURCES, MYENV.WATCHWSI_TARGET, MYENV.WATCHWSI_EXTENSIONS,
+                    os.path.join(MYENV.AMAQC_HOME, 'metadata', 'watchwsi_journal.jsonl'),
+                    interval=MYENV.WATCHWSI_POLL_SECONDS, stable_seconds=MYENV.WATCHWSI_STABLE_SECONDS,
+                    workers=MYENV.WATCHWSI_WORKERS, bytes_per_second=MYENV.WATCHWSI_MAX_MBPS*1024*1024,
+                    keep_source=MYENV.WATCHWSI_KEEP_SOURCE)
+
+def collect_watchwsi_metrics():
+    """ watchwsi throughput and queue depth for /metrics """
+    stats = wsiMover.stats()
+    return [
+        ('qcapi_watchwsi_files_total', 'counter', 'WSI files moved to watch folder', [({'result': 'moved'}, stats['files_moved']), ({'result': 'failed'}, stats['files_failed'])]),
+        ('qcapi_watchwsi_bytes_copied_total', 'counter', 'WSI bytes copied', [({}, stats['bytes_copied'])]),
+        ('qcapi_watchwsi_queue_depth', 'gauge', 'WSI files queued for copy', [({}, stats['queue_depth'])]),
+        ('qcapi_watchwsi_active', 'gauge', 'WSI copies in progress', [({}, stats['active'])]),
+        ('qcapi_watchwsi_waiting', 'gauge', 'WSI files waiting to be stable', [({}, stats['waiting'])]),
+        ('qcapi_watchwsi_throughput_mbps', 'gauge', 'WSI copy MB/s of the last minute', [({}, stats['throughput_mbps'])])
+    ]
+
+qcMetrics.add_collector(collect_watchwsi_metrics)
@@ -0,0 +1,41 @@
+""" Docstring for CCHQC.v1.qcapi.cchqc.workers
+  bounded thread pool for blocking storage access and .aix parsing
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from cchqc.config import MYENV
+
+class StoragePool:
+    """ run blocking functions off the event loop with bounded concurrency """
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.__lock = threading.Lock()
+        self.__executor = None
+
+    def executor(self):
+        """ get executor, create it on first use """
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='storage')
+                logger.info(f'storage pool started with {self.max_workers} workers')
+            return self.__executor
+
+    async def run(self, func, *args, **kwargs):
+        """
+        await func(*args, **kwargs) running in the pool
+          :param func: blocking function
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor(), functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        """ wait for running jobs and release workers """
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+storagePool = StoragePool(MYENV.STORAGE_WORKERS)
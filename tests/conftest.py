@@ -0,0 +1,19 @@
+""" Docstring for CCHQC.v1.qcapi.tests.conftest
+  point settings of cchqc at temporary folders before any cchqc module is imported
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+TEST_HOME = tempfile.mkdtemp(prefix='qcapi_test_')
+atexit.register(shutil.rmtree, TEST_HOME, True)
+for name in ('LOCALAPPDATA', 'DRIVEY_HOME', 'AMAQC_HOME'):
+    os.environ[name] = os.path.join(TEST_HOME, name.lower())
+    os.makedirs(os.environ[name])
+os.makedirs(os.path.join(os.environ['LOCALAPPDATA'], 'ama_qcapi'))
+for slide_type in ('urine', 'thyroid'):
+    os.makedirs(os.path.join(os.environ['DRIVEY_HOME'], slide_type))
+## DRIVEY_URL keeps its default UNC path, slides are still read from DRIVEY_HOME
+os.environ.pop('DRIVEY_URL', None)
+os.environ['API_WORKERS'] = '1'
@@ -0,0 +1,41 @@
+""" Docstring for CCHQC.v1.qcapi.tests.test_aixio
+  chunked AixReader reads the same bytes as a single read, across gzip members and chunk borders
+"""
+import gzip
+import os
+import random
+import pytest
+import cchqc.aixio as aixio
+from cchqc.aixio import AixReader, read_aix_bytes
+
+def write_members(aixfile, payload, nmembers, padding=0):
+    """ payload as nmembers gzip members, then padding zero bytes """
+    step = len(payload)//nmembers + 1
+    with open(aixfile, 'wb') as faix:
+        for i in range(0, len(payload), step):
+            faix.write(gzip.compress(payload[i:i+step]))
+        faix.write(b'\0'*padding)
+
+@pytest.mark.parametrize('nmembers, padding', [(1, 0), (3, 0), (3, 64)])
+@pytest.mark.parametrize('block', [7, 4096])
+def test_chunked_read_matches_single_read(tmp_path, monkeypatch, nmembers, padding, block):
+    rng = random.Random(block)
+    payload = bytes(rng.randrange(48, 58) for _ in range(200000))
+    aixfile = os.path.join(tmp_path, 'slide.aix')
+    write_members(aixfile, payload, nmembers, padding)
+    monkeypatch.setattr(aixio, 'READ_BLOCK', block)
+    with AixReader(aixfile, use_mmap=False, chunked=True) as reader:
+        assert reader.read(1000) + reader.read() == payload
+    with AixReader(aixfile, use_mmap=False, chunked=True) as reader:
+        chunks = iter(lambda: reader.read(65536), b'')
+        assert b''.join(chunks) == payload == read_aix_bytes(aixfile, False)
+        assert reader.stats['compressed'] == os.path.getsize(aixfile)
+
+def test_chunked_truncated_aix_raises(tmp_path, monkeypatch):
+    aixfile = os.path.join(tmp_path, 'slide.aix')
+    with open(aixfile, 'wb') as faix:
+        faix.write(gzip.compress(os.urandom(100000))[:50000])
+    monkeypatch.setattr(aixio, 'READ_BLOCK', 4096)
+    with AixReader(aixfile, use_mmap=False, chunked=True) as reader:
+        with pytest.raises(EOFError):
+            reader.read()
@@ -0,0 +1,98 @@
+""" Docstring for CCHQC.v1.qcapi.tests.test_aixstream
+  streaming and summary parsers give the same result as loading the whole .aix JSON
+"""
+import gzip
+import json
+import os
+import random
+import pytest
+from cchqc.qcxfuncs import get_target_cells_from_aix, stream_target_cells_from_aix, summarize_target_cells_from_aix
+
+MODELS = {
+    'uro': {'Model': 'AIxURO', 'ModelVersion': '2024.1.0'},
+    'uro-legacy': {'Model': 'AIxURO', 'ModelVersion': '2.1.3', 'ModelArchitect': 'decart'},
+    'thy-2024.2': {'Model': 'AIxTHY', 'ModelVersion': '2024.2.1'},
+    'thy-2025.2': {'Model': 'AIxTHY', 'ModelVersion': '2025.2.0'}
+}
+
+def make_aix_json(modelinfo, ncells, tags, model_last, seed=0):
+    """
+    .aix JSON text
+      :param tags: 'all' every cell has 20 trait scores, 'none' no cell has tags, 'mixed' missing or shorter tags
+      :param model_last: write 'model' after 'graph'
+    """
+    rng = random.Random(seed)
+    graph = []
+    for i in range(ncells):
+        cdata = {'category': rng.choice([-1] + list(range(8))), 'score': round(rng.random(), 6), 'prob': round(rng.random(), 6)}
+        if modelinfo['Model'] == 'AIxURO':
+            cdata['ncRatio'] = round(rng.random(), 6)
+        if tags == 'all' or (tags == 'mixed' and rng.random() < 0.6):
+            cdata['tags'] = [round(rng.random(), 6) for _ in range(20 if tags == 'all' else rng.choice([8, 14, 20]))]
+        cell = {'name': f'cell_{i}', 'segments': [[rng.uniform(0, 1000), rng.uniform(0, 1000)] for _ in range(4)],
+                'data': cdata if rng.random() > 0.05 else {}}
+        node = {'name': f'node_{i}', 'children': [[f'cell_{i}', cell]] if rng.random() > 0.05 else []}
+        graph.append([f'node_{i}', node])
+    aixjson = {'graph': graph, 'model': modelinfo} if model_last else {'model': modelinfo, 'graph': graph}
+    return json.dumps(aixjson)
+
+def write_aix(aixfile, text, members):
+    """ write text as concatenated gzip members, like .aix appended by several writes """
+    data = text.encode('utf-8')
+    step = len(data)//members + 1
+    with open(aixfile, 'wb') as faix:
+        for i in range(0, len(data), step):
+            faix.write(gzip.compress(data[i:i+step]))
+    return aixfile
+
+def baseline_summary(aixfile):
+    """ cellscount and trait score rows from the whole JSON, as the original loader counted them """
+    with gzip.open(aixfile, 'rt', encoding='utf-8') as gaix:
+        aixjson = json.load(gaix)
+    aixinfo = aixjson.get('model', {})
+    cellscount = [0 for _ in range(8)]
+    traitrows = []
+    for cell in aixjson.get('graph', {}):
+        for kkbody in cell[1].get('children', '') or []:
+            cdata = kkbody[1].get('data', '')
+            if not cdata:
+                continue
+            category = cdata.get('category', -1)
+            if 0 <= category < 8:
+                cellscount[category] += 1
+            traitrows.append((category, cdata.get('tags', [0.0 for _ in range(20)])))
+    if 'ModelArchitect' in aixinfo:
+        num_nuclei, num_atypical, num_benign = cellscount[3], cellscount[1], cellscount[0]
+        cellscount[0], cellscount[4] = 0, num_benign
+        cellscount[1], cellscount[3] = num_nuclei, num_atypical
+    return aixinfo, cellscount, traitrows
+
+def expected_trait_counts(traitrows, threshold, category=None):
+    """ cells with score >= threshold of each of 20 traits """
+    return [sum(1 for c, x in traitrows if (category is None or c == category) and i < len(x) and x[i] >= threshold)
+            for i in range(20)]
+
+@pytest.mark.parametrize('profile', MODELS)
+@pytest.mark.parametrize('tags', ['all', 'none', 'mixed'])
+@pytest.mark.parametrize('members,model_last', [(1, False), (3, False), (3, True)])
+def test_summary_matches_baseline(tmp_path, profile, tags, members, model_last):
+    aixfile = write_aix(os.path.join(tmp_path, 'slide.aix'), make_aix_json(MODELS[profile], 300, tags, model_last), members)
+    aixinfo, cellscount, traitrows = baseline_summary(aixfile)
+    summary = summarize_target_cells_from_aix(aixfile)
+    assert summary.aixinfo == aixinfo
+    assert summary.cellscount == cellscount
+    if aixinfo['Model'] == 'AIxTHY':
+        for threshold in (0.0, 0.4, 0.437, 0.9):
+            assert summary.trait_counts(20, threshold) == expected_trait_counts(traitrows, threshold)
+            assert [summary.count_trait_in_category(i, 1, threshold) for i in range(20)] == \
+                   expected_trait_counts(traitrows, threshold, 1)
+
+@pytest.mark.parametrize('profile', MODELS)
+@pytest.mark.parametrize('tags', ['all', 'mixed'])
+@pytest.mark.parametrize('members', [1, 3])
+def test_stream_matches_whole_json(tmp_path, profile, tags, members):
+    aixfile = write_aix(os.path.join(tmp_path, 'slide.aix'), make_aix_json(MODELS[profile], 300, tags, False), members)
+    aixinfo, cells, cellscount = get_target_cells_from_aix(aixfile)
+    saixinfo, scells, scellscount = stream_target_cells_from_aix(aixfile, with_segments=True)
+    assert (saixinfo, scellscount) == (aixinfo, cellscount)
+    assert [dict(x) for x in scells] == [dict(x) for x in cells]
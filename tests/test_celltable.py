@@ -0,0 +1,41 @@
+""" Docstring for CCHQC.v1.qcapi.tests.test_celltable
+  CellTable keeps the .aix values, QC criteria equal those of cell dicts and CellSummary
+"""
+import gzip
+import json
+import os
+import pytest
+from benchmarks.synthaix import write_profile_aix
+from cchqc.cellsummary import CellSummary
+from cchqc.celltable import CellTable
+from cchqc.qcxfuncs import count_number_of_thyroid_traits, get_target_cells_from_aix
+
+def test_trait_counts_next_to_threshold():
+    tags = [0.399999999 for _ in range(8)]
+    cells = [{'category': 1, 'score': 0.5, 'prob': 0.5, 'tags': tags}]
+    table = CellTable.from_cell_nodes([('cell_0', None, x) for x in cells], [0.0]*20, False, False)
+    celldicts = [{'traits': tags}]
+    summary = CellSummary({}, [0]*8, [1], [tags])
+    assert count_number_of_thyroid_traits(table, 8, 0.4) == [0]*8
+    assert count_number_of_thyroid_traits(celldicts, 8, 0.4) == [0]*8
+    assert summary.trait_counts(8, 0.4) == [0]*8
+    assert count_number_of_thyroid_traits(table, 8, 0.399999999) == [1]*8
+
+def test_rows_keep_json_values(tmp_path):
+    aixfile = write_profile_aix(os.path.join(tmp_path, 'slide.aix'), 'uro', 300)
+    with gzip.open(aixfile, 'rt', encoding='utf-8') as gaix:
+        graph = json.load(gaix)['graph']
+    expected = {}
+    for node in graph:
+        for _, cell in node[1]['children']:
+            cdata = cell['data']
+            expected[cell['name']] = (cdata['score'], cdata['prob'], cdata['ncRatio'], cdata['tags'], cell['segments'])
+    _, table, _ = get_target_cells_from_aix(aixfile)
+    assert len(table) == len(expected)
+    for row in table:
+        assert (row['score'], row['probability'], row['ncratio'], row['traits'], row['segments']) == expected[row['cellname']]
+
+def test_out_of_range_category_is_rejected():
+    cells = [{'category': 1, 'score': 0.5, 'prob': 0.5, 'tags': [0.0]*8}, {'category': 200, 'score': 0.5, 'prob': 0.5, 'tags': [0.0]*8}]
+    with pytest.raises(ValueError, match='category id 200'):
+        CellTable.from_cell_nodes([(f'cell_{i}', None, x) for i, x in enumerate(cells)], [0.0]*20, False, False)
@@ -0,0 +1,56 @@
+""" Docstring for CCHQC.v1.qcapi.tests.test_sharedstate
+  QC results shared by API workers are bounded and follow the slide index
+"""
+import os
+import pytest
+from benchmarks.synthaix import write_profile_aix
+from cchqc.config import MYENV
+from cchqc.sharedstate import SharedState
+from cchqc.sidecar import SidecarSummary
+from cchqc.slideindex import SlideIndex
+from cchqc.qcxfuncs import summarize_target_cells_from_aix
+
+@pytest.fixture
+def state(tmp_path):
+    return SharedState(os.path.join(tmp_path, 'metadata', 'shared.db'), {'magic_s': 6, 'magic_a': 8, 'threshold': 0.4, 'changed_at': 0.0})
+
+@pytest.fixture(scope='module')
+def sidecar(tmp_path_factory):
+    aixfile = write_profile_aix(os.path.join(tmp_path_factory.mktemp('aix'), 'S0.aix'), 'uro', 200)
+    return SidecarSummary.from_cell_summary(summarize_target_cells_from_aix(aixfile))
+
+def add_slide(folder, slideid):
+    """ .med/.aix pair, .aix is not read by SlideIndex """
+    for ext in ('.med', '.aix'):
+        with open(os.path.join(folder, f'{slideid}{ext}'), 'wb') as fslide:
+            fslide.write(b'\0'*1024)
+
+def test_refresh_drops_results_of_removed_slides(tmp_path, state, sidecar):
+    folder = os.path.join(tmp_path, 'urine')
+    os.makedirs(folder)
+    for slideid in ('S1', 'S2'):
+        add_slide(folder, slideid)
+    sindex = SlideIndex('urine', folder, shared=state)
+    sindex.refresh()
+    outside = os.path.join(tmp_path, 'export', 'S9.aix')
+    for aixfile in (sindex.slide_file('S1'), sindex.slide_file('S2'), outside):
+        state.put_summary(aixfile, 1.0, 1024, sidecar)
+    os.remove(sindex.slide_file('S2'))
+    sindex.refresh()
+    assert state.get_summary(sindex.slide_file('S1'), 1.0, 1024) is not None
+    assert state.get_summary(sindex.slide_file('S2'), 1.0, 1024) is None
+    ## .aix outside the folder are left to the budget
+    assert state.get_summary(outside, 1.0, 1024) is not None
+
+def test_prune_keeps_latest_written_within_budget(tmp_path, state, sidecar):
+    folder = os.path.join(tmp_path, 'urine')
+    aixfiles = [os.path.join(folder, f'S{i}.aix') for i in range(5)]
+    for aixfile in aixfiles:
+        state.put_summary(aixfile, 1.0, 1024, sidecar)
+    ## re-written .aix is the latest
+    state.put_summary(aixfiles[0], 2.0, 1024, sidecar)
+    assert state.prune_summaries(folder, set(aixfiles), 3, MYENV.QCCACHE_MAX_MB*1024*1024) == 2
+    assert [state.get_summary(x, 1.0, 1024) is not None for x in aixfiles[1:]] == [False, False, True, True]
+    assert state.get_summary(aixfiles[0], 2.0, 1024) is not None
+    ## one record over the byte budget keeps nothing
+    assert state.prune_summaries(folder, set(aixfiles), 3, 1) == 3
@@ -0,0 +1,78 @@
+""" Docstring for CCHQC.v1.qcapi.tests.test_slidestore
+  SlideStore.sync() of a local slide folder
+"""
+import os
+import pytest
+import cchqc.slidestore as slidestore
+from benchmarks.synthaix import write_profile_aix
+from cchqc.qccache import qcResultCache
+from cchqc.slideindex import SlideIndex
+from cchqc.slidestore import SlideStore
+
+def add_slide(folder, slideid, aixdata=None):
+    """ .med/.aix pair, .aix of aixdata bytes if given """
+    aixfile = os.path.join(folder, f'{slideid}.aix')
+    if aixdata is None:
+        write_profile_aix(aixfile, 'uro', 200)
+    else:
+        with open(aixfile, 'wb') as faix:
+            faix.write(aixdata)
+    with open(os.path.join(folder, f'{slideid}.med'), 'wb') as fmed:
+        fmed.write(b'\0'*1024)
+
+@pytest.fixture
+def store_and_index(tmp_path):
+    folder = os.path.join(tmp_path, 'urine')
+    os.makedirs(folder)
+    add_slide(folder, 'S100-001')
+    add_slide(folder, 'S100-002', b'not gzip')
+    sindex = SlideIndex('urine', folder)
+    sindex.refresh()
+    return SlideStore(os.path.join(tmp_path, 'slide_store.db')), sindex
+
+def test_sync_leaves_qc_result_cache_alone(store_and_index):
+    store, sindex = store_and_index
+    qcResultCache.clear()
+    assert store.sync('urine', sindex) == (2, 0, 1, 0)
+    assert qcResultCache.stats()['entries'] == 0
+    slides = {x['slidename']: x for x in store.query('urine', order_by='name')}
+    assert slides['S100-001']['model'] == 'AIxURO' and slides['S100-001']['counts']
+    ## broken .aix is stored and not parsed again until it changes
+    assert slides['S100-002']['model'] is None
+    assert store.sync('urine', sindex) == (0, 0, 0, 0)
+
+def test_read_error_is_retried(store_and_index, monkeypatch):
+    store, sindex = store_and_index
+    load_qc_summary = slidestore.load_qc_summary
+    def unreachable(aixfile, *args, **kwargs):
+        if aixfile.endswith('S100-001.aix'):
+            raise OSError('network name is no longer available')
+        return load_qc_summary(aixfile, *args, **kwargs)
+    monkeypatch.setattr(slidestore, 'load_qc_summary', unreachable)
+    assert store.sync('urine', sindex) == (1, 0, 1, 1)
+    assert [x['slidename'] for x in store.query('urine')] == ['S100-002']
+    monkeypatch.setattr(slidestore, 'load_qc_summary', load_qc_summary)
+    assert store.sync('urine', sindex) == (1, 0, 0, 0)
+    assert sorted(x['slidename'] for x in store.query('urine')) == ['S100-001', 'S100-002']
+
+def test_truncated_aix_fails_and_permission_error_is_retried(tmp_path, monkeypatch):
+    folder = os.path.join(tmp_path, 'urine')
+    os.makedirs(folder)
+    add_slide(folder, 'S200-001')
+    aixfile = os.path.join(folder, 'S200-001.aix')
+    with open(aixfile, 'rb') as faix:
+        aixdata = faix.read()
+    add_slide(folder, 'S200-001', aixdata[:len(aixdata)//2])
+    add_slide(folder, 'S200-002')
+    sindex = SlideIndex('urine', folder)
+    sindex.refresh()
+    store = SlideStore(os.path.join(tmp_path, 'slide_store.db'))
+    load_qc_summary = slidestore.load_qc_summary
+    def locked(aixfile, *args, **kwargs):
+        if aixfile.endswith('S200-002.aix'):
+            raise PermissionError(13, 'Permission denied', aixfile)
+        return load_qc_summary(aixfile, *args, **kwargs)
+    monkeypatch.setattr(slidestore, 'load_qc_summary', locked)
+    assert store.sync('urine', sindex) == (1, 0, 1, 1)
+    slides = store.query('urine')
+    assert [x['slidename'] for x in slides] == ['S200-001'] and slides[0]['model'] is None
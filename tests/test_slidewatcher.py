@@ -0,0 +1,72 @@
+""" Docstring for CCHQC.v1.qcapi.tests.test_slidewatcher
+  SlideWatcher.poll_type() over a local slide folder
+"""
+import os
+import pytest
+from benchmarks.synthaix import write_profile_aix
+from cchqc.config import MYENV
+from cchqc.qccache import qcResultCache
+from cchqc.slideindex import slideIndex
+from cchqc.slidewatcher import SlideWatcher
+from cchqc.qcxfuncs import query_qcresult_for_slide
+
+STABLE = 10
+
+def add_slide(slideid, seed=0):
+    """ write .med/.aix pair of a small urine slide """
+    folder = os.path.join(MYENV.DRIVEY_HOME, 'urine')
+    write_profile_aix(os.path.join(folder, f'{slideid}.aix'), 'uro', 200, seed)
+    with open(os.path.join(folder, f'{slideid}.med'), 'wb') as fmed:
+        fmed.write(b'\0'*1024)
+
+@pytest.fixture
+def watcher():
+    swatcher = SlideWatcher(['urine'], 1, STABLE, 1)
+    swatcher.poll_type('urine', now=0.0)    ## baseline
+    yield swatcher
+    swatcher.drain()
+
+def test_unchanged_folder_is_skipped(watcher):
+    watcher.poll_type('urine', now=1.0)
+    watcher.poll_type('urine', now=2.0)
+    assert watcher.stats()['skipped'] == 2
+    assert watcher.stats()['warmed'] == 0
+
+def test_new_slide_is_warmed_after_it_is_stable(watcher):
+    add_slide('WATCH-0001')
+    watcher.poll_type('urine', now=100.0)
+    assert watcher.stats()['pending'] == 1
+    watcher.poll_type('urine', now=100.0+STABLE/2)
+    watcher.drain()
+    assert watcher.stats()['warmed'] == 0
+    watcher.poll_type('urine', now=100.0+STABLE)
+    watcher.drain()
+    stats = watcher.stats()
+    assert (stats['warmed'], stats['failed'], stats['pending']) == (1, 0, 0)
+
+def test_slide_still_written_waits_again(watcher):
+    add_slide('WATCH-0002')
+    watcher.poll_type('urine', now=200.0)
+    ## .aix re-written before it was stable, the wait starts again
+    add_slide('WATCH-0002', seed=1)
+    watcher.poll_type('urine', now=200.0+STABLE)
+    watcher.drain()
+    assert watcher.stats()['warmed'] == 0
+    watcher.poll_type('urine', now=200.0+2*STABLE)
+    watcher.drain()
+    assert watcher.stats()['warmed'] == 1
+
+def test_warmed_slide_is_a_cache_hit_of_queries(watcher):
+    add_slide('WATCH-0003')
+    watcher.poll_type('urine', now=300.0)
+    watcher.poll_type('urine', now=300.0+STABLE)
+    watcher.drain()
+    sindex = slideIndex.get_index('urine')
+    aixfile = sindex.slide_file('WATCH-0003')
+    fstat = os.stat(aixfile)
+    assert qcResultCache.get(aixfile, fstat.st_mtime, fstat.st_size) is not None
+    hits = qcResultCache.stats()['hits']
+    ## default DRIVEY_URL is a UNC path, the query must still use the warmed key
+    result = query_qcresult_for_slide('urine', 'WATCH-0003', 1, check_connection=False)
+    assert result['code'] == 0
+    assert qcResultCache.stats()['hits'] == hits + 1
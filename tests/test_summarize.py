@@ -0,0 +1,40 @@
+""" Docstring for CCHQC.v1.qcapi.tests.test_summarize
+  summarize_cell_counts_to_csv() over a local folder with a broken .aix
+"""
+import csv
+import glob
+import os
+from benchmarks.synthaix import write_profile_aix, write_synthetic_aix
+from cchqc.config import MYENV
+from cchqc.summarystore import get_summary_store
+from cchqc.qccache import qcResultCache
+from cchqc.qcxfuncs import summarize_cell_counts_to_csv, summarize_one_aix
+
+def read_csv_rows():
+    """ rows of the only summary CSV under AMAQC_HOME """
+    csvfiles = glob.glob(os.path.join(MYENV.AMAQC_HOME, '*summary_of_urine_cells_*'))
+    assert len(csvfiles) == 1 and not csvfiles[0].endswith('.tmp')
+    with open(csvfiles[0], newline='', encoding='utf-8') as fcsv:
+        rows = list(csv.DictReader(fcsv))
+    os.remove(csvfiles[0])
+    return rows
+
+def test_unsupported_model_is_skipped(tmp_path):
+    folder = str(tmp_path)
+    write_profile_aix(os.path.join(folder, 'A-0001.aix'), 'uro', 100)
+    write_synthetic_aix(os.path.join(folder, 'B-0001.aix'), modelinfo={'Model': 'AIxFOO', 'ModelVersion': '1.0'}, ncells=10)
+    write_profile_aix(os.path.join(folder, 'C-0001.aix'), 'uro', 100, seed=1)
+    for _ in range(2):
+        ## a re-run takes A and C from the summary store and skips B again
+        assert summarize_cell_counts_to_csv('urine', folder)
+        assert [x['slide_id'] for x in read_csv_rows()] == ['A-0001', 'C-0001']
+    stored = get_summary_store('urine').records()
+    assert os.path.join(folder, 'B-0001.aix') not in stored
+    assert os.path.join(folder, 'A-0001.aix') in stored
+
+def test_summarize_one_aix_leaves_qc_result_cache_alone(tmp_path):
+    aixfile = write_profile_aix(os.path.join(tmp_path, 'A-0001.aix'), 'uro', 100)
+    qcResultCache.clear()
+    _, record, errmsg = summarize_one_aix(aixfile, 0.4)
+    assert errmsg == '' and record['model'] == 'AIxURO'
+    assert qcResultCache.stats()['entries'] == 0
@@ -0,0 +1,111 @@
+""" Docstring for CCHQC.v1.qcapi.tests.test_watchwsi
+  WsiMover stability detection, rename, resume and journal compaction on local folders
+"""
+import json
+import os
+import pytest
+import cchqc.watchwsi as watchwsi
+from cchqc.watchwsi import WsiMover, MoveJournal, PART_SUFFIX
+
+STABLE = 10
+
+@pytest.fixture
+def folders(tmp_path):
+    """ (scanner folder, watch folder, journal file) """
+    source, target = os.path.join(tmp_path, 'scanner'), os.path.join(tmp_path, 'watch')
+    os.makedirs(source)
+    os.makedirs(target)
+    return source, target, os.path.join(tmp_path, 'metadata', 'journal.jsonl')
+
+def make_mover(folders, **kwargs):
+    source, target, journalfile = folders
+    return WsiMover([source], target, ['.med'], journalfile, stable_seconds=STABLE, workers=2, chunksize=1024, **kwargs)
+
+def write_file(filename, data):
+    with open(filename, 'wb') as fwsi:
+        fwsi.write(data)
+    return filename
+
+def read_file(filename):
+    with open(filename, 'rb') as fwsi:
+        return fwsi.read()
+
+def test_moved_only_after_it_is_stable(folders):
+    source, target, _ = folders
+    src = write_file(os.path.join(source, 'S1.med'), b'a'*5000)
+    write_file(os.path.join(source, 'S1.txt'), b'not a WSI')
+    mover = make_mover(folders)
+    mover.scan_once(now=0.0)
+    mover.scan_once(now=STABLE/2)
+    assert mover.stats()['waiting'] == 1
+    ## still being written, the wait starts again
+    write_file(src, b'a'*8000)
+    mover.scan_once(now=STABLE+1)
+    mover.drain()
+    assert mover.stats()['files_moved'] == 0
+    mover.scan_once(now=2*STABLE+1)
+    mover.drain()
+    assert mover.stats()['files_moved'] == 1
+    assert read_file(os.path.join(target, 'S1.med')) == b'a'*8000
+    assert not os.path.exists(src) and not os.path.exists(os.path.join(target, 'S1.med'+PART_SUFFIX))
+    assert os.path.exists(os.path.join(source, 'S1.txt'))
+
+def test_existing_target_is_never_replaced(folders):
+    source, target, _ = folders
+    src = write_file(os.path.join(source, 'S2.med'), b'b'*4000)
+    dst = write_file(os.path.join(target, 'S2.med'), b'c'*4000)
+    mover = make_mover(folders)
+    mover.scan_once(now=0.0)
+    mover.scan_once(now=STABLE)
+    mover.drain()
+    stats = mover.stats()
+    assert (stats['files_moved'], stats['files_failed']) == (0, 1)
+    assert read_file(src) == b'b'*4000 and read_file(dst) == b'c'*4000
+
+def test_partial_copy_is_resumed(folders):
+    source, target, journalfile = folders
+    data = bytes(range(256))*40
+    src = write_file(os.path.join(source, 'S3.med'), data)
+    dst = os.path.join(target, 'S3.med')
+    write_file(dst+PART_SUFFIX, data[:4096])
+    fstat = os.stat(src)
+    MoveJournal(journalfile).append('queued', src, dst, fstat.st_size, fstat.st_mtime)
+    mover = make_mover(folders)
+    mover.recover()
+    mover.drain()
+    stats = mover.stats()
+    assert (stats['files_moved'], stats['bytes_resumed'], stats['bytes_copied']) == (1, 4096, len(data)-4096)
+    assert read_file(dst) == data and not os.path.exists(src)
+
+def test_rename_before_crash_is_finished(folders):
+    source, target, journalfile = folders
+    src = write_file(os.path.join(source, 'S4.med'), b'd'*3000)
+    dst = write_file(os.path.join(target, 'S4.med'), b'd'*3000)
+    fstat = os.stat(src)
+    MoveJournal(journalfile).append('queued', src, dst, fstat.st_size, fstat.st_mtime)
+    mover = make_mover(folders)
+    mover.recover()
+    mover.drain()
+    assert mover.stats()['files_moved'] == 1
+    assert not os.path.exists(src) and read_file(dst) == b'd'*3000
+    assert MoveJournal(journalfile).load()[src]['event'] == 'done'
+
+def test_journal_is_compacted_while_running(folders, monkeypatch):
+    source, _, journalfile = folders
+    monkeypatch.setattr(watchwsi, 'JOURNAL_COMPACT_RECORDS', 100)
+    mover = make_mover(folders, keep_source=True)
+    for name in ('S5', 'S6', 'S7'):
+        write_file(os.path.join(source, f'{name}.med'), b'e'*1000)
+    mover.scan_once(now=0.0)
+    mover.scan_once(now=STABLE)
+    mover.drain()
+    assert mover.journal.appended() == 6
+    os.remove(os.path.join(source, 'S7.med'))
+    monkeypatch.setattr(watchwsi, 'JOURNAL_COMPACT_RECORDS', 6)
+    mover.scan_once(now=2*STABLE)
+    assert mover.journal.appended() == 0
+    with open(journalfile, encoding='utf-8') as fjournal:
+        kept = [json.loads(x) for x in fjournal]
+    ## sources kept in the scanner folder stay settled, the removed one is dropped
+    assert sorted(os.path.basename(x['src']) for x in kept) == ['S5.med', 'S6.med']
+    assert all(x['event'] == 'done' for x in kept)